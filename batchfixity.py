@@ -6,7 +6,8 @@ import argparse
 import os
 import shutil
 from ififuncs import hashlib_manifest
-from ififuncs import generate_log
+from ififuncs import generate_log, close_log
+import fixitycache
 
 def count_files(source):
     '''
@@ -40,12 +41,23 @@ def make_parser():
         '-v', action='store_true',
         help='verbose mode - some extra information such as overall file count.'
     )
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        help='Number of files to hash at once. Defaults to the number of CPU cores'
+    )
+    parser.add_argument(
+        '-cache',
+        choices=['trust', 'paranoid'],
+        help='Use the fixity cache. trust skips hashing files whose size, date modified and inode have not changed. paranoid hashes everything and reports checksums that changed when the metadata did not. See fixitycache.py'
+    )
     return parser
 
 
-def create_manifest(source):
+def create_manifest(source, workers=None, cache=None):
     '''
     Generates a master log and creates checksum manifests for all subdirectories.
+    workers and cache are passed to hashlib_manifest.
     '''
     master_log = os.path.expanduser('~/Desktop/batchfixity_errors.log')
     os.chdir(source)
@@ -59,8 +71,11 @@ def create_manifest(source):
             generate_log(log_name, 'batchfixity started')
             generate_log(log_name, '%s created' % manifest_textfile)
             try:
-                hashlib_manifest(full_path, manifest_textfile, full_path)
+                hashlib_manifest(
+                    full_path, manifest_textfile, full_path, workers, cache
+                )
                 generate_log(log_name, 'manifest creation complete')
+                close_log(log_name)
                 shutil.move(log_name, full_path)
             except IOError:
                 with open(master_log, 'ab') as log:
@@ -80,7 +95,9 @@ def main():
     args = parser.parse_args()
     if args.v:
         count_files(args.input)
-    create_manifest(args.input)
+    cache = fixitycache.open_cache(args.cache, 'batchfixity.py')
+    create_manifest(args.input, args.j, cache)
+    fixitycache.close_cache(cache)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+'''
+Benchmarks for the performance sensitive parts of IFIscripts.
+Synthetic test data is written to a temporary directory which is deleted
+afterwards, so this can be safely run on any machine.
+Usage: benchmark.py hash, benchmark.py manifest or benchmark.py subs
+'''
+import sys
+import os
+import time
+import argparse
+import shutil
+import tempfile
+import random
+import ififuncs
+import dcpsubs2srt
+from lxml import etree
+
+
+def make_test_files(directory, file_count, file_size):
+    '''
+    Writes file_count files of file_size bytes of random data to directory.
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for counter in range(file_count):
+        filename = os.path.join(directory, 'file_%06d.dat' % counter)
+        with open(filename, 'wb') as fo:
+            remaining = file_size
+            while remaining > 0:
+                chunk = min(remaining, 2**20)
+                fo.write(os.urandom(chunk))
+                remaining -= chunk
+
+
+def time_manifest(source, manifest_textfile, workers):
+    '''
+    Returns the amount of seconds hashlib_manifest takes with a set amount of
+    workers.
+    '''
+    start = time.time()
+    ififuncs.hashlib_manifest(source, manifest_textfile, source, workers)
+    return time.time() - start
+
+
+def benchmark_hash(args):
+    '''
+    Compares hashlib_manifest with 1/2/4/8 workers on lots of small files
+    and on a few large files.
+    '''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        datasets = [
+            ('small files', args.small_count, args.small_size),
+            ('large files', args.large_count, args.large_size),
+        ]
+        results = []
+        for label, file_count, file_size in datasets:
+            source = os.path.join(temp_dir, label.replace(' ', '_'))
+            print 'Writing %d %s of %d bytes' % (file_count, label, file_size)
+            make_test_files(source, file_count, file_size)
+            reference = None
+            for workers in args.workers:
+                manifest_textfile = os.path.join(
+                    temp_dir, '%s_%d_manifest.md5' % (label.replace(' ', '_'), workers)
+                )
+                seconds = time_manifest(source, manifest_textfile, workers)
+                with open(manifest_textfile, 'rb') as fo:
+                    manifest = fo.read()
+                if reference is None:
+                    reference = manifest
+                elif manifest != reference:
+                    print 'ERROR - manifest with %d workers differs from the single worker manifest' % workers
+                    sys.exit(1)
+                results.append([label, workers, seconds])
+        print '\n%-12s %8s %10s %8s' % ('dataset', 'workers', 'seconds', 'speedup')
+        baseline = {}
+        for label, workers, seconds in results:
+            baseline.setdefault(label, seconds)
+            print '%-12s %8d %10.2f %7.2fx' % (
+                label, workers, seconds, baseline[label] / max(seconds, 0.000001)
+            )
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def make_test_manifests(directory, entry_count):
+    '''
+    Writes a source and destination manifest with entry_count lines.
+    One in every thousand destination entries is missing, one is
+    mismatched and one extra file is added, so that the comparison
+    has something to report.
+    '''
+    source_manifest = os.path.join(directory, 'source_%d.md5' % entry_count)
+    destination_manifest = os.path.join(directory, 'destination_%d.md5' % entry_count)
+    with open(source_manifest, 'wb') as source_object:
+        with open(destination_manifest, 'wb') as destination_object:
+            for counter in range(entry_count):
+                checksum = '%032x' % random.getrandbits(128)
+                path = 'reel_%04d/frame_%07d.dpx' % (counter // 10000, counter)
+                source_object.write('%s  %s\n' % (checksum, path))
+                if counter % 1000 == 1:
+                    continue
+                if counter % 1000 == 2:
+                    checksum = '%032x' % random.getrandbits(128)
+                destination_object.write('%s  %s\n' % (checksum, path))
+                if counter % 1000 == 3:
+                    destination_object.write(
+                        '%032x  %s.extra\n' % (random.getrandbits(128), path)
+                    )
+    return source_manifest, destination_manifest
+
+
+def legacy_compare(source_manifest, destination_manifest):
+    '''
+    The list based comparison previously used in copyit.diff_report and
+    copyit.check_extra_files, kept here for comparison.
+    '''
+    with open(source_manifest, 'r') as fo:
+        sourcelist = fo.readlines()
+    with open(destination_manifest, 'r') as fo:
+        destlist = fo.readlines()
+    different = [i for i in sourcelist if i not in destlist]
+    sourcelist_files = [i[32:] for i in sourcelist]
+    extra = [i for i in [j[32:] for j in destlist] if i not in sourcelist_files]
+    return different, extra
+
+
+def benchmark_manifest(args):
+    '''
+    Times ififuncs.compare_manifests on synthetic manifests of various sizes.
+    The old list based comparison is also timed for smaller manifests.
+    '''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        print '%10s %12s %12s %10s %10s %10s' % (
+            'entries', 'dict (s)', 'legacy (s)', 'missing', 'extra', 'mismatched'
+        )
+        for entry_count in args.sizes:
+            source_manifest, destination_manifest = make_test_manifests(
+                temp_dir, entry_count
+            )
+            start = time.time()
+            missing, extra, mismatched = ififuncs.compare_manifests(
+                ififuncs.read_manifest(source_manifest),
+                ififuncs.read_manifest(destination_manifest)
+            )
+            dict_seconds = time.time() - start
+            legacy = 'skipped'
+            if entry_count <= args.legacy_max:
+                start = time.time()
+                different, legacy_extra = legacy_compare(
+                    source_manifest, destination_manifest
+                )
+                legacy = '%.2f' % (time.time() - start)
+                if len(different) != len(missing) + len(mismatched) or len(legacy_extra) != len(extra):
+                    print 'ERROR - legacy and dict comparisons disagree'
+                    sys.exit(1)
+            print '%10d %12.2f %12s %10d %10d %10d' % (
+                entry_count, dict_seconds, legacy,
+                len(missing), len(extra), len(mismatched)
+            )
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def make_test_subtitles(directory, cue_count):
+    '''
+    Writes an Interop subtitle XML file with cue_count two line subtitles.
+    '''
+    xml_filename = os.path.join(directory, 'subtitles_%d.xml' % cue_count)
+    with open(xml_filename, 'wb') as fo:
+        fo.write('<?xml version="1.0" encoding="UTF-8"?>\n<DCSubtitle Version="1.0">\n')
+        fo.write('<Font Id="Font1" Size="42">\n')
+        for counter in range(cue_count):
+            seconds = counter * 3
+            fo.write(
+                '<Subtitle SpotNumber="%d" TimeIn="%02d:%02d:%02d:000" TimeOut="%02d:%02d:%02d:125">'
+                '<Text VPosition="16">Subtitle %d</Text><Text VPosition="8">Second line</Text>'
+                '</Subtitle>\n' % (
+                    counter + 1,
+                    seconds // 3600, seconds // 60 % 60, seconds % 60,
+                    (seconds + 2) // 3600, (seconds + 2) // 60 % 60, (seconds + 2) % 60,
+                    counter + 1
+                )
+            )
+        fo.write('</Font>\n</DCSubtitle>\n')
+    return xml_filename
+
+
+def legacy_subs_to_srt(xml_filename, srt_file):
+    '''
+    The xpath based conversion previously used in dcpsubs2srt.py and
+    dcpaccess.burn_subs, kept here for comparison.
+    '''
+    dcp_subtitle = etree.parse(xml_filename)
+    total_subtitles = int(dcp_subtitle.xpath('count(//Subtitle)'))
+    counter = 0
+    with open(srt_file, "w") as myfile:
+        pass
+    while counter < total_subtitles:
+        in_point = dcp_subtitle.xpath('//Subtitle')[counter].attrib['TimeIn']
+        out_point = dcp_subtitle.xpath('//Subtitle')[counter].attrib['TimeOut']
+        with open(srt_file, "a") as myfile:
+            myfile.write(str(counter + 1) + '\n')
+            myfile.write(in_point + ' --> ' + out_point + '\n')
+            for i in dcp_subtitle.iterfind('.//Subtitle[%s]/Text' % (counter + 1)):
+                myfile.write(i.text + '\n')
+            myfile.write('\n')
+        counter += 1
+    return counter
+
+
+def benchmark_subs(args):
+    '''
+    Times dcpsubs2srt.subs_to_srt on synthetic subtitle files.
+    The old xpath based conversion is also timed for smaller files.
+    '''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        print '%10s %12s %12s' % ('cues', 'stream (s)', 'legacy (s)')
+        for cue_count in args.sizes:
+            xml_filename = make_test_subtitles(temp_dir, cue_count)
+            srt_file = xml_filename + '.srt'
+            start = time.time()
+            written = dcpsubs2srt.subs_to_srt(xml_filename, srt_file)
+            stream_seconds = time.time() - start
+            if written != cue_count:
+                print 'ERROR - %d of %d subtitles were written' % (written, cue_count)
+                sys.exit(1)
+            legacy = 'skipped'
+            if cue_count <= args.legacy_max:
+                start = time.time()
+                legacy_subs_to_srt(xml_filename, srt_file + '.legacy')
+                legacy = '%.2f' % (time.time() - start)
+            print '%10d %12.2f %12s' % (cue_count, stream_seconds, legacy)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for IFIscripts.'
+        ' Written by Kieran O\'Leary.'
+    )
+    subparsers = parser.add_subparsers(dest='benchmark')
+    hash_parser = subparsers.add_parser(
+        'hash', help='parallel manifest hashing with 1/2/4/8 workers'
+    )
+    hash_parser.add_argument(
+        '-workers', type=int, nargs='+', default=[1, 2, 4, 8],
+        help='Worker counts to compare'
+    )
+    hash_parser.add_argument(
+        '-small_count', type=int, default=2000,
+        help='Amount of small files'
+    )
+    hash_parser.add_argument(
+        '-small_size', type=int, default=64 * 1024,
+        help='Size of each small file in bytes'
+    )
+    hash_parser.add_argument(
+        '-large_count', type=int, default=4,
+        help='Amount of large files'
+    )
+    hash_parser.add_argument(
+        '-large_size', type=int, default=256 * 2**20,
+        help='Size of each large file in bytes'
+    )
+    hash_parser.set_defaults(func=benchmark_hash)
+    manifest_parser = subparsers.add_parser(
+        'manifest', help='manifest comparison with 10k/100k/1M entries'
+    )
+    manifest_parser.add_argument(
+        '-sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+        help='Manifest sizes to compare'
+    )
+    manifest_parser.add_argument(
+        '-legacy_max', type=int, default=10000,
+        help='Largest manifest to run the old quadratic comparison on'
+    )
+    manifest_parser.set_defaults(func=benchmark_manifest)
+    subs_parser = subparsers.add_parser(
+        'subs', help='DCP subtitle XML to SRT conversion with 5000 cues'
+    )
+    subs_parser.add_argument(
+        '-sizes', type=int, nargs='+', default=[500, 1000, 5000],
+        help='Amounts of subtitles to convert'
+    )
+    subs_parser.add_argument(
+        '-legacy_max', type=int, default=1000,
+        help='Largest file to run the old quadratic conversion on'
+    )
+    subs_parser.set_defaults(func=benchmark_subs)
+    return parser
+
+
+def main(args_):
+    '''
+    Launches the chosen benchmark.
+    '''
+    parser = make_parser()
+    args = parser.parse_args(args_)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,7 +2,11 @@
 '''
 Concatenates video files using FFmpeg stream copy for general use but
 particularly for XDCAM workflows in the IFI Irish Film Institute.
-Uses mkvpropedit to insert chapter markers for each source file.
+Chapter markers for each source file are written during the concatenation.
+Chapter times and the concat file are built from the same timeline of
+clip durations, so the chapters match the real offset of each clip.
+The MD5 of the output is taken straight after it is written and stored in
+a sidecar manifest, so sipcreator.py doesn't need to hash it again.
 Optionally wraps the file into a package structure with checksum manifests.
 
 Written by Kieran O'Leary.
@@ -10,12 +14,20 @@ Written by Kieran O'Leary.
 import sys
 import subprocess
 import os
+import json
 import argparse
 import time
 import shutil
+import tempfile
+import multiprocessing
+from fractions import Fraction, gcd
+from multiprocessing.pool import ThreadPool
 import sipcreator
 import ififuncs
 
+# The concat demuxer reads the duration of each clip in microseconds.
+CONCAT_TIMEBASE = 1000000
+
 def parse_args(args_):
     '''
     Parse command line arguments.
@@ -53,15 +65,28 @@ def parse_args(args_):
     )
     parser.add_argument(
         '-nochapters',
-        help='Skips the mkvpropedit chapter creation function', action='store_true'
+        help='Skips the chapter creation function', action='store_true'
+    )
+    parser.add_argument(
+        '-noverify',
+        help='Skips the verification of the AV streams of the output against'
+        ' the source. By default this runs alongside the MD5 of the output.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        help='Number of clips to probe at once. Defaults to the number of CPU cores'
     )
     parsed_args = parser.parse_args(args_)
     return parsed_args
 
 
-def ffmpeg_concat(concat_file, args, uuid, container):
+def ffmpeg_concat(concat_file, args, uuid, container, chapters_file=None):
     '''
     Launch the actual ffmpeg concatenation command.
+    Chapters from chapters_file are added by the same command, as changing
+    the file afterwards would invalidate the MD5 of the output.
     '''
     fmd5_logfile = os.path.join(args.o, '%s_concat.log' % uuid).replace('\\', '\\\\').replace(':', '\:')
     fmd5_env_dict = ififuncs.set_environment(fmd5_logfile)
@@ -70,6 +95,10 @@ def ffmpeg_concat(concat_file, args, uuid, container):
     cmd = [
         'ffmpeg', '-report', '-f', 'concat', '-safe', '0',
         '-i', concat_file,
+    ]
+    if chapters_file is not None:
+        cmd += ['-i', chapters_file, '-map_chapters', '1']
+    cmd += [
         '-c', 'copy', '-map', '0:v', '-map', '0:a?',
         os.path.join(args.o, '%s.%s' % (uuid, container)),
         '-f', 'md5', '-map', '0:v', '-map', '0:a?','-c', 'copy',  '-'
@@ -98,29 +127,129 @@ def recursive_file_list(video_files):
     print recursive_list
     return recursive_list
 
-def make_chapters(video_files):
+def escape_metadata(value):
     '''
-    Use mkvpropedit to insert chapter markers for each source video.
-    Each chapter's name will reflect the source filename of each clip.
+    Escapes the characters that are special in an ffmetadata file.
     '''
-    millis = ififuncs.get_milliseconds(video_files[0])
-    timestamp = ififuncs.convert_millis(int(millis))
-    chapter_list = [['00:00:00.000', os.path.basename(video_files[0])], [timestamp, os.path.basename(video_files[1])]]
-    count = 2
-    for video in video_files[1:]:
-        millis += ififuncs.get_milliseconds(video)
-        timestamp = ififuncs.convert_millis(int(millis))
-        if count == len(video_files):
-            continue
-        else:
-            chapter_list.append([timestamp, os.path.basename(video_files[count])])
-        count+=1
-    chapter_counter = 1
-    # uh use a real path/filename.
-    with open('chapters.txt', 'wb') as fo:
-        for i in chapter_list:
-            fo.write('CHAPTER%s=%s\nCHAPTER%sNAME=%s\n' % (str(chapter_counter).zfill(2), i[0], str(chapter_counter).zfill(2), i[1]))
-            chapter_counter += 1
+    for character in ('\\', '=', ';', '#', '\n'):
+        value = value.replace(character, '\\' + character)
+    return value
+
+
+def get_clip_duration(filename):
+    '''
+    Returns (filename, duration) for a clip, where duration is the length
+    of its first video stream in seconds, as an exact Fraction of the
+    stream's time base. The container duration is used if the stream
+    duration is unknown.
+    '''
+    ffprobe_cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=time_base,duration_ts:format=duration',
+        '-of', 'json', filename
+    ]
+    probe = json.loads(
+        subprocess.check_output(ffprobe_cmd, close_fds=ififuncs.CLOSE_FDS)
+    )
+    streams = probe.get('streams') or [{}]
+    duration_ts = streams[0].get('duration_ts')
+    if duration_ts is not None and 'time_base' in streams[0]:
+        return filename, Fraction(duration_ts) * Fraction(streams[0]['time_base'])
+    return filename, Fraction(probe['format']['duration'])
+
+
+def make_timeline(video_files, workers=None):
+    '''
+    Probes the duration of every clip at once, with up to workers ffprobe
+    processes. Returns a list with a dictionary for each clip, in the
+    order of video_files, with the keys:
+    filename, start, end - exact Fractions of a second in the output.
+    Durations are rounded to the nearest microsecond, so that the chapters
+    and the concat file offset each clip by exactly the same amount.
+    '''
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    pool = ThreadPool(max(1, min(workers, len(video_files))))
+    try:
+        durations = pool.map(get_clip_duration, video_files)
+    finally:
+        pool.close()
+        pool.join()
+    timeline = []
+    start = Fraction(0)
+    for filename, duration in durations:
+        duration = Fraction(
+            int(duration * CONCAT_TIMEBASE + Fraction(1, 2)), CONCAT_TIMEBASE
+        )
+        timeline.append({
+            'filename': filename, 'start': start, 'end': start + duration
+        })
+        start += duration
+    return timeline
+
+
+def get_timebase(timeline):
+    '''
+    Returns the smallest denominator that every chapter time in timeline
+    can be written in exactly.
+    '''
+    timebase = 1
+    for clip in timeline:
+        for time_point in (clip['start'], clip['end']):
+            denominator = time_point.denominator
+            timebase = timebase * denominator // gcd(timebase, denominator)
+    return timebase
+
+
+def write_concat_file(timeline, concat_file):
+    '''
+    Writes the ffmpeg concat file for the clips in timeline. Each clip's
+    duration is given, so ffmpeg offsets the next clip by the same amount
+    as the chapters do, rather than by its container duration.
+    '''
+    with open(concat_file, 'wb') as textfile:
+        for clip in timeline:
+            microseconds = int((clip['end'] - clip['start']) * CONCAT_TIMEBASE)
+            textfile.write('file \'%s\'\nduration %d.%06d\n' % (
+                clip['filename'],
+                microseconds // CONCAT_TIMEBASE,
+                microseconds % CONCAT_TIMEBASE
+            ))
+
+
+def make_chapters(timeline, chapters_file):
+    '''
+    Writes an ffmetadata file with a chapter marker for each clip in
+    timeline, for ffmpeg_concat to insert. Each chapter's name will reflect
+    the source filename of each clip.
+    '''
+    timebase = get_timebase(timeline)
+    with open(chapters_file, 'wb') as fo:
+        fo.write(';FFMETADATA1\n')
+        for clip in timeline:
+            fo.write('[CHAPTER]\nTIMEBASE=1/%d\nSTART=%d\nEND=%d\ntitle=%s\n' % (
+                timebase,
+                int(clip['start'] * timebase),
+                int(clip['end'] * timebase),
+                escape_metadata(os.path.basename(clip['filename']))
+            ))
+    return chapters_file
+
+
+def verify_streams(output_file, validation_logfile):
+    '''
+    Returns the MD5 of the AV streams of the output, for comparison with
+    the MD5 of the source streams from ffmpeg_concat.
+    '''
+    validation_env_dict = ififuncs.set_environment(validation_logfile)
+    return subprocess.check_output([
+        'ffmpeg', '-report',
+        '-i', output_file,
+        '-f', 'md5', '-map', '0:v', '-map', '0:a?', '-c', 'copy', '-'
+    ], env=validation_env_dict, close_fds=ififuncs.CLOSE_FDS).rstrip()
 
 
 def main(args_):
@@ -178,67 +307,98 @@ def main(args_):
         'Relationship, derivation, has source=%s' % source_uuid
     )
     video_files = args.i
-    concat_file = ififuncs.get_temp_concat('concat_stuff')
+    # Each run gets its own temporary folder, so that runs can't overwrite
+    # each other's concat and chapter files.
+    job_dir = tempfile.mkdtemp(prefix='concat_%s_' % uuid)
+    concat_file = os.path.join(job_dir, 'concat.txt')
     ififuncs.generate_log(
         log_name_source,
         'concatenation file=%s' % concat_file)
-    if args.r:
-        video_files = recursive_file_list(video_files)
-    video_files = ififuncs.sanitise_filenames(video_files)
-    for source_files in video_files:
+    try:
+        if args.r:
+            video_files = recursive_file_list(video_files)
+        video_files = ififuncs.sanitise_filenames(video_files)
+        for source_files in video_files:
+            ififuncs.generate_log(
+                log_name_source,
+                'source_files = %s' % source_files)
+        timeline = make_timeline(video_files, args.j)
+        chapters_file = None
+        if args.nochapters != True:
+            chapters_file = make_chapters(
+                timeline, os.path.join(job_dir, 'chapters.txt')
+            )
+        write_concat_file(timeline, concat_file)
         ififuncs.generate_log(
             log_name_source,
-            'source_files = %s' % source_files)
-    make_chapters(video_files)
-    ififuncs.concat_textfile(video_files, concat_file)
-    ififuncs.generate_log(
-        log_name_source,
-        'EVENT = Concatenation, status=started, eventType=Creation, agentName=ffmpeg, eventDetail=Source media concatenated into a single file output=%s' % os.path.join(args.o, '%s.%s' % (uuid, container)))
-    source_bitstream_md5, fmd5_logfile = ffmpeg_concat(concat_file, args, uuid, container)
+            'EVENT = Concatenation, status=started, eventType=Creation, agentName=ffmpeg, eventDetail=Source media concatenated into a single file output=%s' % os.path.join(args.o, '%s.%s' % (uuid, container)))
+        source_bitstream_md5, fmd5_logfile = ffmpeg_concat(
+            concat_file, args, uuid, container, chapters_file
+        )
+    finally:
+        shutil.rmtree(job_dir)
     output_file = os.path.join(args.o, '%s.%s' % (uuid, container))
     ififuncs.generate_log(
         log_name_source,
         'EVENT = Concatenation, status=finished, eventType=Creation, agentName=ffmpeg, eventDetail=Source media concatenated into a single file output=%s' % os.path.join(args.o, '%s.%s' % (uuid, container)))
-    ififuncs.generate_log(
-        log_name_source,
-        'EVENT = losslessness verification, status=started, eventType=messageDigestCalculation, agentName=ffmpeg, eventDetail=MD5s of AV streams of output file generated for validation')
-    validation_logfile = os.path.join(args.o, '%s_validation.log' % uuid).replace('\\', '\\\\').replace(':', '\:')
-    validation_env_dict = ififuncs.set_environment(validation_logfile)
-    output_bitstream_md5 = subprocess.check_output([
-        'ffmpeg', '-report',
-        '-i', output_file,
-        '-f', 'md5', '-map', '0:v', '-map', '0:a?', '-c', 'copy', '-'
-    ], env=validation_env_dict).rstrip()
-    ififuncs.generate_log(
-        log_name_source,
-        'EVENT = losslessness verification, status=finished, eventType=messageDigestCalculation, agentName=ffmpeg, eventDetail=MD5s of AV streams of output file generated for validation')
-    if source_bitstream_md5 == output_bitstream_md5:
-        print 'process appears to be lossless'
-        print source_bitstream_md5, output_bitstream_md5
+    if chapters_file is not None:
         ififuncs.generate_log(
-        log_name_source,
-        'EVENT = losslessness verification, eventOutcome=pass')
-    else:
-        print 'something went wrong - not lossless!'
-        print source_bitstream_md5,output_bitstream_md5
+            log_name_source,
+            'EVENT = eventType=modification, agentName=ffmpeg, eventDetail=Chapters added to file detailing start point of source clips.')
+    validation_logfile = os.path.join(args.o, '%s_validation.log' % uuid).replace('\\', '\\\\').replace(':', '\:')
+    # The output is hashed while it is still in the page cache. The
+    # muxer seeks back to finish the header, so the bytes can't be hashed
+    # as ffmpeg writes them. The stream verification reads the output too,
+    # so both run at the same time.
+    pool = ThreadPool(2)
+    output_md5_result = pool.apply_async(ififuncs.hashlib_md5, (output_file,))
+    if not args.noverify:
         ififuncs.generate_log(
-        log_name_source,
-        'EVENT = losslessness verification, eventOutcome=fail')
-    if args.nochapters != True:
-        subprocess.call(['mkvpropedit', output_file, '-c', 'chapters.txt'])
+            log_name_source,
+            'EVENT = losslessness verification, status=started, eventType=messageDigestCalculation, agentName=ffmpeg, eventDetail=MD5s of AV streams of output file generated for validation')
+        output_bitstream_md5 = pool.apply_async(
+            verify_streams, (output_file, validation_logfile)
+        ).get()
         ififuncs.generate_log(
             log_name_source,
-            'EVENT = eventType=modification, agentName=mkvpropedit, eventDetail=Chapters added to file detailing start point of source clips.')
-        ififuncs.concat_textfile(video_files, concat_file)
-        with open(log_name_source, 'r') as concat_log:
-            concat_lines = concat_log.readlines()
+            'EVENT = losslessness verification, status=finished, eventType=messageDigestCalculation, agentName=ffmpeg, eventDetail=MD5s of AV streams of output file generated for validation')
+        if source_bitstream_md5 == output_bitstream_md5:
+            print 'process appears to be lossless'
+            print source_bitstream_md5, output_bitstream_md5
+            ififuncs.generate_log(
+            log_name_source,
+            'EVENT = losslessness verification, eventOutcome=pass')
+        else:
+            print 'something went wrong - not lossless!'
+            print source_bitstream_md5,output_bitstream_md5
+            ififuncs.generate_log(
+            log_name_source,
+            'EVENT = losslessness verification, eventOutcome=fail')
+    output_md5 = output_md5_result.get()
+    pool.close()
+    pool.join()
+    # copyit.py uses this sidecar as the source manifest instead of
+    # hashing the output again.
+    output_manifest = output_file + '_manifest.md5'
+    ififuncs.write_manifest(
+        output_manifest, [(os.path.basename(output_file), output_md5)]
+    )
+    ififuncs.generate_log(
+        log_name_source,
+        'EVENT = message digest calculation, eventType=messageDigestCalculation, module=hashlib, eventOutcome=%s, eventDetail=MD5 of output file stored in %s' % (output_md5, output_manifest))
+    ififuncs.close_log(log_name_source)
+    with open(log_name_source, 'r') as concat_log:
+        concat_lines = concat_log.readlines()
     if not args.no_sip:
         sipcreator_log, sipcreator_manifest = sipcreator.main(['-i', output_file, '-u', uuid, '-oe', object_entry, '-user', user, '-o', args.o])
         shutil.move(fmd5_logfile, os.path.dirname(sipcreator_log))
-        shutil.move(validation_logfile.replace('\\\\', '\\').replace('\:', ':'), os.path.dirname(sipcreator_log))
         logs_dir = os.path.dirname(sipcreator_log)
         ififuncs.manifest_update(sipcreator_manifest, os.path.join(logs_dir, os.path.basename(fmd5_logfile)))
-        ififuncs.manifest_update(sipcreator_manifest, os.path.join(logs_dir,(os.path.basename(validation_logfile.replace('\\\\', '\\').replace('\:', ':')))))
+        if not args.noverify:
+            shutil.move(validation_logfile.replace('\\\\', '\\').replace('\:', ':'), logs_dir)
+            ififuncs.manifest_update(sipcreator_manifest, os.path.join(logs_dir,(os.path.basename(validation_logfile.replace('\\\\', '\\').replace('\:', ':')))))
+        # The SIP manifest now holds the MD5 of the output.
+        os.remove(output_manifest)
         with open(sipcreator_log, 'r') as sipcreator_log_object:
             sipcreator_lines = sipcreator_log_object.readlines()
         with open(sipcreator_log, 'wb') as fo:
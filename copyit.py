@@ -13,33 +13,10 @@ import argparse
 import hashlib
 import shutil
 import ififuncs
+import fixitycache
 from ififuncs import make_desktop_logs_dir, make_desktop_manifest_dir, generate_log
 
 
-def hashlib_md5(filename):
-    '''
-    Create an md5 checksum. This should use the ififuncs function instead.
-    '''
-    read_size = 0
-    last_percent_done = 0
-    md5_object = hashlib.md5()
-    total_size = os.path.getsize(filename)
-    with open(str(filename), 'rb') as file_object:
-        while True:
-            buf = file_object.read(2**20)
-            if not buf:
-                break
-            read_size += len(buf)
-            md5_object.update(buf)
-            percent_done = 100 * read_size / total_size
-            if percent_done > last_percent_done:
-                sys.stdout.write('[%d%%]\r' % percent_done)
-                sys.stdout.flush()
-                last_percent_done = percent_done
-    md5_output = md5_object.hexdigest()
-    return md5_output + '  ' + os.path.abspath(filename) +  '\n'
-
-
 def test_write_capabilities(directory, log_name_source):
     '''
     Checks if drives have write access.
@@ -91,74 +68,106 @@ def remove_bad_files(root_dir, log_name_source):
 
 def make_manifest(
         manifest_dir,
-        manifest_textfile, path_to_remove
+        manifest_textfile, path_to_remove, workers=None, cache=None
     ):
     '''
     Generates a checksum text manifest.
+    Files are hashed in parallel by ififuncs.parallel_hash, which will
+    also use the fixity cache if one is supplied.
     '''
-    checksum_list = []
-    manifest_generator = ''
-    source_counter = 0
     print 'Counting the amount of files to be processed.'
-    for root, directories, filenames in os.walk(manifest_dir):
-        directories[:] = [
-            d for d in directories if d[0] != '.'
-        ]
-        directories[:] = [
-            d for d in directories if d[0] != 'System Volume Information'
-        ]
-        filenames = [
-            f for f in filenames if os.path.basename(root) != 'System Volume Information'
-        ]
-        filenames = [
-            f for f in filenames if f[0] != '.'
-        ]
-        for files in filenames:
-            source_counter += 1
-    counter2 = 1
     if os.path.isdir(manifest_dir):
         os.chdir(manifest_dir)
-        for root, directories, filenames in os.walk(manifest_dir):
-            directories[:] = [
-                d for d in directories if d[0] != '.'
-            ]
-            directories[:] = [
-                d for d in directories if d[0] != 'System Volume Information'
-            ]
-            filenames = [
-                f for f in filenames if os.path.basename(root) != 'System Volume Information'
-            ]
-            filenames = [
-                f for f in filenames if f[0] != '.'
-            ]
-            for files in filenames:
-                checksum_list.append([root, files])
+        file_records = ififuncs.walk_files(
+            manifest_dir, skip_dirs=('System Volume Information',)
+        )
     elif os.path.isfile(manifest_dir):
-        checksum_list = [[os.path.dirname(manifest_dir), os.path.basename(manifest_dir)]]
-    for files in checksum_list:
-        print 'Generating MD5 for %s - %d of %d' % (
-            files, counter2, source_counter
+        file_records = [(
+            os.path.basename(manifest_dir), os.path.getsize(manifest_dir)
+        )]
+        manifest_dir = os.path.dirname(manifest_dir)
+    manifest_entries = ififuncs.hash_file_records(
+        manifest_dir, file_records, path_to_remove, workers, cache
+    )
+    return ififuncs.write_manifest(manifest_textfile, manifest_entries)
+
+
+def write_copied_manifest(
+        manifest_dir, manifest_textfile,
+        path_to_remove, copied_entries
+    ):
+    '''
+    Writes a manifest from the (relative_path, md5) list returned by
+    native_copy, without reading any files. Paths are laid out just
+    like make_manifest would lay them out for manifest_dir.
+    '''
+    if os.path.isfile(manifest_dir):
+        # A single file is listed by its name only, as in make_manifest.
+        root2 = ''
+    else:
+        root2 = ififuncs.manifest_root(manifest_dir, path_to_remove)
+    manifest_entries = [
+        (os.path.join(root2, relative_path).replace("\\", "/"), md5)
+        for relative_path, md5 in copied_entries
+    ]
+    return ififuncs.write_manifest(manifest_textfile, manifest_entries)
+
+
+def copy_and_hash(source_file, destination_file):
+    '''
+    Copies a file and returns the MD5 checksum of the source.
+    Each buffer is hashed as it is written, so the source is only read once.
+    Permissions and timestamps are preserved, like cp --preserve=mode,timestamps
+    '''
+    md5_object = hashlib.md5()
+    with open(destination_file, 'wb') as destination_object:
+        ififuncs.hash_io(
+            source_file, [md5_object], progress=True, output=destination_object
+        )
+        destination_object.flush()
+        os.fsync(destination_object.fileno())
+        if os.environ.get('IFI_HASH_DROP_CACHE', '0') != '0':
+            ififuncs.fadvise(destination_object, 'POSIX_FADV_DONTNEED')
+    shutil.copystat(source_file, destination_file)
+    return md5_object.hexdigest()
+
+
+def native_copy(source, destination_final_path, log_name_source):
+    '''
+    Copies source to destination_final_path with python instead of
+    robocopy/rsync/gcp/cp. Hidden files are skipped, as they are by the
+    other copy tools and by make_manifest.
+    Returns a list of (relative_path, md5) tuples of the source files.
+    '''
+    if os.path.isfile(source):
+        source_dir = os.path.dirname(source)
+        destination_dir = os.path.dirname(destination_final_path)
+        file_records = [(os.path.basename(source), os.path.getsize(source))]
+    else:
+        source_dir = source
+        destination_dir = destination_final_path
+        file_records = ififuncs.walk_files(
+            source, skip_dirs=('System Volume Information', '$Recycle.bin')
+        )
+    generate_log(
+        log_name_source,
+        'EVENT = File Transfer, status=started, agentName=copyit.py, module=copyit.copy_and_hash'
+    )
+    copied_entries = []
+    file_count = len(file_records)
+    for counter, (relative_path, _) in enumerate(file_records, 1):
+        source_file = os.path.join(source_dir, relative_path)
+        destination_file = os.path.join(destination_dir, relative_path)
+        if not os.path.isdir(os.path.dirname(destination_file)):
+            os.makedirs(os.path.dirname(destination_file))
+        print 'Copying %s - file %d of %d' % (source_file, counter, file_count)
+        md5 = copy_and_hash(source_file, destination_file)
+        copied_entries.append((relative_path, md5))
+    generate_log(
+                log_name_source,
+                'EVENT = File Transfer, status=completed'
             )
-        md5 = hashlib_md5(os.path.join(files[0], files[1]))
-        root2 = files[0].replace(path_to_remove, '')
-        try:
-            if root2[0] == '/':
-                root2 = root2[1:]
-            if root2[0] == '\\':
-                root2 = root2[1:]
-        except: IndexError
-        manifest_generator += md5[:32] + '  ' + os.path.join(
-            root2, files[1]
-            ).replace("\\", "/") + '\n'
-        counter2 += 1
-    manifest_list = manifest_generator.splitlines()
-    files_in_manifest = len(manifest_list)
-    # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[34:]))
-    with open(manifest_textfile, "wb") as text:
-        for i in manifest_list:
-            text.write(i + '\n')
-    return files_in_manifest
+    return copied_entries
 
 
 def copy_dir(
@@ -242,38 +251,31 @@ def diff_report(file1, file2, log_name_source):
     Analyzes checksum manifests in order to find mismatches.
     '''
     print 'Comparing manifests to verify file transfer'
-    with open(file1, 'r') as file1_manifest:
-        sourcelist = file1_manifest.readlines()
-    with open(file2, 'r') as file2_manifest:
-        destlist = file2_manifest.readlines()
-    for i in sourcelist:
-        if i not in destlist:
-            print '%s was expected, but a different value was found in destination manifest' % i.rstrip()
-            generate_log(
-                log_name_source,
-                'ERROR = %s was expected, but a different value was found in destination manifest' % i.rstrip())
+    source_dict = ififuncs.read_manifest(file1)
+    destination_dict = ififuncs.read_manifest(file2)
+    missing, _, mismatched = ififuncs.compare_manifests(
+        source_dict, destination_dict
+    )
+    for path in sorted(missing + mismatched):
+        i = '%s  %s' % (source_dict[path], path)
+        print '%s was expected, but a different value was found in destination manifest' % i
+        generate_log(
+            log_name_source,
+            'ERROR = %s was expected, but a different value was found in destination manifest' % i)
 
 
 def check_extra_files(file1, file2, log_name_source):
     '''
     Are there any extra files in the destination directory?
     '''
-    with open(file1, 'r') as file1_manifest:
-        sourcelist = file1_manifest.readlines()
-    with open(file2, 'r') as file2_manifest:
-        destlist = file2_manifest.readlines()
-    destlist_files = []
-    sourcelist_files = []
-    for dest_files in destlist:
-        destlist_files.append(dest_files[32:])
-    for source_files in sourcelist:
-        sourcelist_files.append(source_files[32:])
-    for i in destlist_files:
-        if i not in sourcelist_files:
-            print '%s is in your destination manifest but is not in the source manifest' % i.rstrip()
-            generate_log(
-                log_name_source,
-                'ERROR = %s is in your destination manifest but is not in the source manifest' % i.rstrip())
+    _, extra, _ = ififuncs.compare_manifests(
+        ififuncs.read_manifest(file1), ififuncs.read_manifest(file2)
+    )
+    for i in extra:
+        print '%s is in your destination manifest but is not in the source manifest' % i
+        generate_log(
+            log_name_source,
+            'ERROR = %s is in your destination manifest but is not in the source manifest' % i)
 
 
 def check_overwrite(file2check):
@@ -356,9 +358,31 @@ def setup(args_):
         action='store_true',
         help='use gcp instead of rsync on osx for SPEED on LTO'
     )
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        help='Number of files to hash at once. Defaults to the number of CPU cores'
+    )
+    parser.add_argument(
+        '-cache',
+        choices=['trust', 'paranoid'],
+        help='Use the fixity cache. trust skips hashing files whose size, date modified and inode have not changed. paranoid hashes everything and reports checksums that changed when the metadata did not. See fixitycache.py'
+    )
+    parser.add_argument(
+        '-native',
+        action='store_true',
+        help='Copy with python instead of robocopy/rsync/gcp/cp. Source files are hashed while they are copied, so they are only read once'
+    )
+    parser.add_argument(
+        '-noreread',
+        action='store_true',
+        help='Only works with -native. The destination manifest is made from the checksums calculated during the transfer rather than by reading the destination files again'
+    )
     rootpos = ''
     dircheck = None
     args = parser.parse_args(args_)
+    if args.noreread and not args.native:
+        parser.error('-noreread only works with -native')
     if os.path.isdir(args.source):
         dircheck = check_for_sip(args.source)
     if dircheck != None:
@@ -409,6 +433,9 @@ def count_stuff(source):
     '''
     Counts total files to be processed.
     '''
+    # concat.py leaves a sidecar manifest beside a single file source.
+    if os.path.isfile(source):
+        return 1, [os.path.basename(source)]
     source_count = 0
     file_list = []
     for _, directories, filenames in os.walk(source):
@@ -473,11 +500,14 @@ def manifest_existence(
     if proceed == 'y':
         if source_count != count_in_manifest:
             print 'checking which files are different'
+            # Sets make each lookup constant time, lists made this quadratic.
+            file_set = set(file_list)
+            manifest_file_set = set(manifest_files)
             for i in file_list:
-                if i not in manifest_files:
+                if i not in manifest_file_set:
                     print i, 'is present in your source directory but not in the source manifest'
             for i in manifest_files:
-                if i not in file_list:
+                if i not in file_set:
                     print i, 'is present in manifest but is missing in your source files'
             print 'This manifest may be outdated as the number of files in your directory does not match the number of files in the manifest'
             print 'There are', source_count, 'files in your source directory', count_in_manifest, 'in the manifest'
@@ -489,10 +519,13 @@ def manifest_existence(
 def make_destination_manifest(
         overwrite_destination_manifest, log_name_source,
         rootpos, destination_final_path,
-        manifest_destination, destination
+        manifest_destination, destination, workers=None,
+        copied_entries=None, cache=None
     ):
     '''
     Um, write destination manifest
+    If copied_entries from native_copy are supplied, the destination is
+    not read again and the checksums from the transfer are used instead.
     '''
     if overwrite_destination_manifest not in ('N', 'n'):
         if overwrite_destination_manifest == None:
@@ -505,10 +538,18 @@ def make_destination_manifest(
                 'EVENT = Destination Manifest Overwrite - Destination manifest already exists - Overwriting.'
             )
         print 'Generating destination manifest'
-        if rootpos == 'y':
+        if copied_entries is not None:
+            files_in_manifest = write_copied_manifest(
+                destination_final_path, manifest_destination,
+                destination, copied_entries
+            )
+            generate_log(
+                log_name_source,
+                'EVENT = Generating destination manifest: status=completed')
+        elif rootpos == 'y':
             files_in_manifest = make_manifest(
                 destination_final_path,
-                manifest_destination, destination
+                manifest_destination, destination, workers, cache
             )
             generate_log(
                 log_name_source,
@@ -517,7 +558,7 @@ def make_destination_manifest(
         else:
             files_in_manifest = make_manifest(
                 destination_final_path,
-                manifest_destination, destination
+                manifest_destination, destination, workers, cache
             )
             generate_log(
                 log_name_source,
@@ -532,12 +573,17 @@ def make_destination_manifest(
 
 
 def verify_copy(manifest, manifest_destination, log_name_source, overwrite_destination_manifest, files_in_manifest, destination_count, source_count):
+    '''
+    Compares the source and destination manifests.
+    Returns 'success' or 'failure'.
+    '''
     if filecmp.cmp(manifest, manifest_destination, shallow=False):
         print "Your files have reached their destination and the checksums match"
         generate_log(
             log_name_source,
             'EVENT = File Transfer Judgement - Success, eventOutcome=pass'
         )
+        return 'success'
     else:
         print "***********YOUR CHECKSUMS DO NOT MATCH*************"
         if overwrite_destination_manifest not in ('N', 'n'):
@@ -556,7 +602,8 @@ def verify_copy(manifest, manifest_destination, log_name_source, overwrite_desti
             print ' %s files in your destination \n %s files at source' % (
                 destination_count, source_count
             )
-def control_flow(manifest_sidecar, log_name_source, manifest, rootpos, args, source):
+        return 'failure'
+def control_flow(manifest_sidecar, log_name_source, manifest, rootpos, args, source, cache=None):
     if os.path.isfile(manifest_sidecar):
         print 'Manifest Sidecar exists - Source manifest Generation will be skipped.'
         generate_log(
@@ -570,12 +617,12 @@ def control_flow(manifest_sidecar, log_name_source, manifest, rootpos, args, sou
             generate_log(log_name_source, 'EVENT = Generating source manifest: status=started, eventType=message digest calculation, module=hashlib')
             if rootpos == 'y':
                 make_manifest(
-                    args.source, manifest, args.source
+                    args.source, manifest, args.source, args.j, cache
                 )
             else:
                 make_manifest(
                     source, manifest,
-                    os.path.dirname(source)
+                    os.path.dirname(source), args.j, cache
                 )
             generate_log(log_name_source, 'EVENT = Generating source manifest: status=completed')
         except OSError:
@@ -585,6 +632,18 @@ def control_flow(manifest_sidecar, log_name_source, manifest, rootpos, args, sou
 def main(args_):
     '''
     Launches the functions that will safely copy and paste your files.
+    Returns the path of the log file.
+    '''
+    return run(args_)['log']
+
+
+def run(args_):
+    '''
+    Does the work for main, but returns a dictionary describing the
+    transfer so that batch scripts like masscopy.py don't need to read
+    the log to find out what happened. Keys are:
+    log, outcome ('success' or 'failure'), source, destination,
+    source_count, destination_count
     '''
     dircheck = None
     args, rootpos, manifest_sidecar, log_name_source, destination_final_path, manifest_root, manifest_destination, manifest, destination, dirname, desktop_manifest_dir = setup(args_)
@@ -611,19 +670,48 @@ def main(args_):
         manifest, source_count,
         file_list, log_name_source
     )
-    manifest_sidecar, manifest, rootpos = control_flow(
-        manifest_sidecar, log_name_source, manifest, rootpos, args, source
+    cache = fixitycache.open_cache(args.cache, 'copyit.py')
+    # In native mode, the source manifest is a by-product of the transfer.
+    fused_manifest = (
+        args.native
+        and overwrite_destination_dir not in ('N', 'n')
+        and not os.path.isfile(manifest_sidecar)
+        and not os.path.isfile(manifest)
     )
+    if not fused_manifest:
+        manifest_sidecar, manifest, rootpos = control_flow(
+            manifest_sidecar, log_name_source, manifest, rootpos, args, source, cache
+        )
+    copied_entries = None
     if overwrite_destination_dir not in ('N', 'n'):
         if overwrite_destination_dir != None:
             generate_log(
                 log_name_source,
                 'EVENT = File Transfer Overwrite - Destination directory already exists - Overwriting.'
             )
-        copy_dir(
-            source, destination_final_path,
-            log_name_source, rootpos, destination, dirname, args
-        )
+        if args.native:
+            if fused_manifest:
+                print 'Generating source manifest during file transfer'
+                generate_log(log_name_source, 'EVENT = Generating source manifest: status=started, eventType=message digest calculation, module=hashlib')
+            copied_entries = native_copy(
+                source, destination_final_path, log_name_source
+            )
+            if fused_manifest:
+                if rootpos == 'y':
+                    write_copied_manifest(
+                        args.source, manifest, args.source, copied_entries
+                    )
+                else:
+                    write_copied_manifest(
+                        source, manifest,
+                        os.path.dirname(source), copied_entries
+                    )
+                generate_log(log_name_source, 'EVENT = Generating source manifest: status=completed')
+        else:
+            copy_dir(
+                source, destination_final_path,
+                log_name_source, rootpos, destination, dirname, args
+            )
     else:
         generate_log(
             log_name_source,
@@ -633,8 +721,10 @@ def main(args_):
         overwrite_destination_manifest, log_name_source,
         rootpos, destination_final_path,
         manifest_destination,
-        destination
+        destination, args.j,
+        copied_entries if args.noreread else None, cache
     )
+    fixitycache.close_cache(cache, log_name_source)
     destination_count = 0
     # dear god do this better, this is dreadful code!
     for _, _, filenames in os.walk(destination_final_path):
@@ -651,13 +741,21 @@ def main(args_):
                 for i in dest_manifest_list:
                     temp_object.write(i[:33] + ' ' + dirname + '/' +  i[34:])
             manifest = manifest_temp[1]
-    verify_copy(
+    outcome = verify_copy(
         manifest, manifest_destination, log_name_source, overwrite_destination_manifest, files_in_manifest, destination_count, source_count
     )
     manifest_rename = manifest[:-4] + time.strftime("_%Y_%m_%dT%H_%M_%S") + '.md5'
     if os.path.dirname(manifest) == desktop_manifest_dir:
         os.rename(manifest, manifest_rename)
         shutil.move(manifest_rename, os.path.join(desktop_manifest_dir, 'old_manifests'))
-    return log_name_source
+    ififuncs.close_log(log_name_source)
+    return {
+        'log': log_name_source,
+        'outcome': outcome,
+        'source': source,
+        'destination': destination_final_path,
+        'source_count': source_count,
+        'destination_count': destination_count
+    }
 if __name__ == '__main__':
     main(sys.argv[1:])
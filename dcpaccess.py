@@ -27,6 +27,8 @@ from email.mime.base import MIMEBase
 from email.mime.image import MIMEImage
 from email.mime.text import MIMEText
 import tempfile
+from dcpsubs2srt import subs_to_srt
+from dcpmodel import read_package
 from decimal import *
 from sys import platform as _platform
 getcontext().prec = 4
@@ -85,14 +87,6 @@ else:
     audio_concat_textfile = temp_dir + "/%s.txt" % audio_concat_filename
     
 
-def find_assetmap():   
-    if 'ASSETMAP' in dcp_files:
-        assetmap = 'ASSETMAP'
-    elif 'ASSETMAP.xml' in dcp_files:
-        assetmap = 'ASSETMAP.xml'
-    return assetmap
-        
-        
 # Begin recursive search through sub-directories for DCPs.  
 def choose_cpl(): 
     global cpl_list
@@ -113,27 +107,14 @@ def choose_cpl():
     
     
 def find_cpl():
-    # Generate an empty list as there may be multiple CPLs.    
-    # Get a list of all XML files in the main DCP directory.
-    xmlfiles = glob('*.xml')
-    # Loop through xmlfiles in order to find any CPLL files.
-    for i in xmlfiles:
-        try:  
-            xmlname = etree.parse(i)
-        except SyntaxError:
-            print( 'not a valid CPL!')
-            continue
-        except KeyError:
-            print( 'Missing CPL!')
-            continue
-        xml_namespace = xmlname.xpath('namespace-uri(.)')
-        # Create list of CPLs.
-        if 'CPL' in xml_namespace:
-            cpl_list.append(i) 
-        if len(cpl_list) == 0:  
-            continue
-        elif len(cpl_list) == 1:
-            cpl_parse = etree.parse(cpl_list[0])
+    # The CPLs were found by dcpmodel.read_package, which only reads the
+    # root element of each XML file.
+    for i in package['invalid_xml']:
+        print( 'not a valid CPL!')
+    for i in package['cpls']:
+        cpl_list.append(os.path.basename(i))
+    if len(cpl_list) == 1:
+        cpl_parse = etree.parse(cpl_list[0])
     if len(cpl_list) > 1:
         cpl_parse = choose_cpl() 
         # As there can be multiple subtitles, This options gives some info/choice.
@@ -208,7 +189,7 @@ def burn_subs():
         output_filename = os.path.basename(dcp_dir) + '_subs_reel' + str(counter + 1) + time.strftime("_%Y_%m_%dT%H_%M_%S")
         output_subs_mkv = os.path.expanduser("~/Desktop/%s.mkv") % output_filename
         try:  
-            xmlo = etree.parse(subs[subs_counter])
+            sub_count = subs_to_srt(subs[subs_counter], srt_file)
         except SyntaxError:
             if 'mxf' in srt_file:
                 print('Subtitle file is most likely an SMPTE MXF which is not currently supported.')
@@ -220,26 +201,7 @@ def burn_subs():
             print ('Missing CPL!')
             counter +=1
             continue
-        sub_count = int(xmlo.xpath('count(//Subtitle)'))
-        current_sub_counter = 0
-        with open(srt_file, "w") as myfile:
-               print ('Transforming ', sub_count, 'subtitles')
-        while current_sub_counter < sub_count:
-            counter2 = current_sub_counter +1
-            in_point = xmlo.xpath('//Subtitle')[current_sub_counter].attrib['TimeIn']
-            out      = xmlo.xpath('//Subtitle')[current_sub_counter].attrib['TimeOut']
-            in_point = in_point[:8] + '.' + in_point[9:]
-            out      = out[:8] + '.' + out[9:]
-            with open(srt_file, "a") as myfile:
-                myfile.write(str(current_sub_counter + 1) + '\n')
-                myfile.write(in_point + ' --> ' + out + '\n')
-                bla =  [bla.text for bla in xmlo.iterfind('.//Subtitle[%s]//Text' % int(counter2) ) ]
-                for i in bla:
-                        myfile.write(i.encode("utf-8") + '\n')
-                myfile.write('\n')
-                print( 'Transforming ' + str(current_sub_counter) + ' of' + str(count) + ' subtitles\r') ,
-            current_sub_counter +=1 
-        current_sub_counter= 0
+        print ('Transformed ', sub_count, 'subtitles')
         if delays == 0:
             print( 'There were no audio delays.')
             command = ['ffmpeg','-c:v ','libopenjpeg','-i',pic_mxfs[counter],'-i',aud_mxfs[counter],
@@ -370,19 +332,11 @@ for root,dirnames,filenames in os.walk(dcp_dir):
         # Changing directory makes globbing easier (from my experience anyhow).
         os.chdir(dir)
 
-        # Scan the main DCP directory for an assetmap. 
-        dcp_files = [f for f in listdir(dir) if isfile(join(dir, f))]
-        assetmap  = find_assetmap()
-
-        # Parse the assetmap in order to find the namespace.  
-        try:  
-            assetmap_xml = etree.parse(assetmap)
-        except SyntaxError:
-
+        # The ASSETMAP, PKLs and CPLs are parsed once by dcpmodel.
+        package = read_package(dir)
+        if package['error'] == 'NOT A VALID ASSETMAP':
             print('Not a valid ASSETMAP!')
             continue
-           
-        assetmap_namespace = assetmap_xml.xpath('namespace-uri(.)')     
 
         cpl_list = []
 
@@ -413,27 +367,9 @@ for root,dirnames,filenames in os.walk(dcp_dir):
         
         audio_delay = {}
         file_paths  = {} 
-        # Begin analysis of assetmap xml.
-
-        assetmap_paths =  assetmap_xml.findall('//ns:Path',namespaces={'ns': assetmap_namespace})
-        assetmap_uuids =  assetmap_xml.findall('//ns:Asset/ns:Id',namespaces={'ns': assetmap_namespace})
-            
-        counter = 0 
-        while counter <= len(assetmap_paths) -1 :
-
-            if 'file:///' in assetmap_paths[counter].text:
-                remove_this = 'file:///'
-                assetmap_paths[counter].text =  assetmap_paths[counter].text.replace(remove_this,"")
-            elif 'file://' in assetmap_paths[counter].text:
-                remove_this = 'file://'
-                assetmap_paths[counter].text =  assetmap_paths[counter].text.replace(remove_this,"")            
-
-            elif 'file:/' in assetmap_paths[counter].text:
-                remove_this = 'file:/'
-                assetmap_paths[counter].text =  assetmap_paths[counter].text.replace(remove_this,"")           
-
-            file_paths[assetmap_uuids[counter].text] = [assetmap_paths[counter].text] # {assetmapuuid:assetmapfilename}
-            counter += 1
+        # Paths from the assetmap, relative to the DCP directory.
+        for asset_uuid, path in package['paths'].items():
+            file_paths[asset_uuid] = [path] # {assetmapuuid:assetmapfilename}
             
         pic_mxfs = [] 
           
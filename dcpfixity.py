@@ -1,350 +1,234 @@
 #!/usr/bin/env python
-
-from lxml import etree
+'''
+DCP fixity checker/bagging tool.
+Every DCP beneath the input directory is found via its ASSETMAP, and the
+assets listed in its PKLs are hashed with SHA-1 and compared with the
+hashes in the PKL.
+Assets from every reel of every DCP are hashed in parallel, largest
+first, so that one huge picture reel doesn't hold up the end of the batch.
+Usage: dcpfixity.py /path/to/dcps
+'''
 import sys
-import pdb
-from glob import glob
-import csv
 import os
-from os import listdir
-from os.path import isfile, join
-import subprocess
-import base64
 import time
-import re
-import smtplib
+import base64
+import binascii
 import argparse
-import mimetypes
-from email.mime.multipart import MIMEMultipart
-from email import encoders
-from email.message import Message
-from email.mime.audio import MIMEAudio
-from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
-from email.mime.text import MIMEText
+from ififuncs import create_csv
+from ififuncs import append_csv_rows
+from ififuncs import parallel_multi_hash
+from ififuncs import send_gmail
+from dcpmodel import find_packages, get_asset_path
 try:
     import bagit
 except ImportError:
-    print 'skipping error'
-
-parser = argparse.ArgumentParser(description='DCP FIXITY checker/bagging tool.'
-                                 ' Written by Kieran O\'Leary.')
-parser.add_argument('input')
-parser.add_argument(
-                    '-bag', 
-                    action='store_true',help='bag the dcp_dir if it passes the hash check')
-parser.add_argument(
-                    '-csv', 
-                    action='store_true',help='File level csv is stored as sidecar to dcp directory')
-parser.add_argument(
-                    '-m', 
-                    action='store_true',help='send email report')
-args = parser.parse_args()
-
-if args.bag:
-    bagging = 'enabled'
-else:
-    bagging = 'disabled'
-
-if args.m:
-    email = 'enabled'
-else:
-    email = 'disabled'
-#bagrm =  os.path.abspath('bag-rm.py') 
-#bagit =  os.path.abspath('bagit.py') 
-#print bagrm
-dcp_dir = args.input
-# Two csv functions. One to create a csv, the other to add info to.
-def create_csv(csv_file, *args):
-    f = open(csv_file, 'wb')
-    try:
-        writer = csv.writer(f)
-        writer.writerow(*args)
-    finally:
-        f.close()
-        
-def append_csv(csv_file, *args):
-    f = open(csv_file, 'ab')
-    try:
-        writer = csv.writer(f)
-        writer.writerow(*args)
-    finally:
-        f.close()
-
-# Create a new .csv file with headings.  
-# CSV filename will be DCp directory name + time/date.
-
-# CSV will be saved to your Desktop.
-
-
-csv_report_filename = os.path.basename(dcp_dir) + '_dcp_level' + time.strftime("_%Y_%m_%dT%H_%M_%S")
-# CSV will be saved to your Desktop.
-
-csv_report = os.path.expanduser("~/Desktop/%s.csv") % csv_report_filename        
-create_csv(csv_report, ('DCP NAME', 'DIRECTORY NAME', 'JUDGEMENT'))
-
-if args.csv:
-    csv_setting = 'enabled'
-
-    
-    
-else:
-    csv_setting = 'disabled'
-    csv_filename = os.path.basename(dcp_dir) + '_file_level' + time.strftime("_%Y_%m_%dT%H_%M_%S")
-    csvfile = os.path.expanduser("~/Desktop/%s.csv") % csv_filename
-    #csv_file = os.path.expanduser("~/Desktop/%s.csv") % csv_filename
-    create_csv(csvfile, ('MXF HASH', 'STORED HASH', 'FILENAME', 'JUDGEMENT'))
-for root,dirnames,filenames in os.walk(dcp_dir):
-    if ("ASSETMAP.xml"  in filenames) or ("ASSETMAP"  in filenames) :
-        dir = root
-        #print os.path.basename(os.path.dirname(root)) 
-        filenoext = os.path.splitext(os.path.dirname(root))[0]
-        #print filenoext + 'dfsdfjkljoewuiljkdfs'
-        # Change directory to directory with video files
-
-        if csv_setting == 'enabled': 
-            #print filenoext
-            # Generate new directory names in AIP
-            fixity_dir   = "%s/fixity" % filenoext
-            os.makedirs(fixity_dir)
-            csvfile = fixity_dir + '/' + os.path.basename(os.path.dirname(root)) + '_item_level' + time.strftime("_%Y_%m_%dT%H_%M_%S") + '.csv'
-            #csv_file = os.path.expanduser("~/Desktop/%s.csv") % csv_filename
-            create_csv(csvfile, ('MXF HASH', 'STORED HASH', 'FILENAME', 'JUDGEMENT'))
-        
-        
-        # Changing directory makes globbing easier (from my experience anyhow).
-        os.chdir(dir)
-
-        # Scan the main DCP directory for an assetmap.
-        dcp_files = [f for f in listdir(dir) if isfile(join(dir, f))]
-        if 'ASSETMAP' in dcp_files:
-            assetmap = 'ASSETMAP'
-        elif 'ASSETMAP.xml' in dcp_files:
-            assetmap = 'ASSETMAP.xml'
-
-        # Parse the assetmap in order to find the namespace.  
-        try:  
-            assetmap_xml = etree.parse(assetmap)
-        except SyntaxError:
-            append_csv(csvfile,('NOT A VALID ASSETMAP', 'NOT A VALID ASSETMAP', dir,'NOT A VALID ASSETMAP'))
-            append_csv(csv_report,(os.path.basename(dir), dir, 'NOT A VALID ASSETMAP'))
-            print 'not an assetmap!!!!'
+    bagit = None
+
+CSV_HEADER = ('MXF HASH', 'STORED HASH', 'FILENAME', 'JUDGEMENT')
+
+
+def read_dcp(package):
+    '''
+    Returns a dictionary describing a package from dcpmodel.read_package,
+    with the keys:
+    directory, error - None, or the reason that the DCP can't be checked,
+    invalid_xml - XML files that could not be parsed,
+    assets - a list of (uuid, full path, PKL hash) for every asset in a PKL,
+    apart from the PKLs themselves.
+    '''
+    dcp = {
+        'directory': package['directory'],
+        'error': package['error'],
+        'invalid_xml': package['invalid_xml'],
+        'assets': []
+    }
+    if dcp['error'] is not None:
+        return dcp
+    for asset_uuid, pkl_hash in sorted(package['hashes'].items()):
+        path = get_asset_path(package, asset_uuid)
+        # PKLs are not listed in themselves, so they can't be checked.
+        if path is None or path in package['pkls']:
             continue
-           
-        assetmap_namespace = assetmap_xml.xpath('namespace-uri(.)')
-
-        
-
-        # Get a list of all XML files in the main DCP directory.
-        xmlfiles = glob('*.xml')
-
-        # Generate an empty list as there may be multiple PKLs.
-        pkl_list = []
-
-        # Loop through xmlfiles in order to find any PKL files.
-        for i in xmlfiles:
-            try:  
-                xmlname = etree.parse(i)
-            except SyntaxError:
-                append_csv(csvfile,('NOT A VALID PKL', 'NOT A VALID PKL', dir,'NOT A VALID PKL'))
-                append_csv(csv_report,(os.path.basename(dir), dir, 'NOT A VALID PKL'))
-                print 'not a valid PKL!!!!'
-                continue
-            except KeyError:
-                append_csv(csvfile,('PKL APPEARS TO BE MISSING', 'PKL APPEARS TO BE MISSING', dir,'PKL APPEARS TO BE MISSING'))
-                append_csv(csv_report,(os.path.basename(dir), dir, 'PKL APPEARS TO BE MISSING'))
-                print 'Missing PKL!!!!'
-                continue
-            
-            is_pkl = xmlname.xpath('namespace-uri(.)')
-            if 'PKL' in is_pkl:
-                pkl_list.append(i)
-            
-        if len(pkl_list) == 0:
-            
-            append_csv(csvfile,('PKL APPEARS TO BE MISSING', 'PKL APPEARS TO BE MISSING', dir,'PKL APPEARS TO BE MISSING'))
-            append_csv(csv_report,(os.path.basename(dir), dir, 'PKL APPEARS TO BE MISSING'))
-            continue
-        
-              
-        # Generate an empty dictionary that will link the PKL hashes to each UUID.        
-        pkl_hashes = {}
-
-        # Loop through the PKLs and link each hash to a UUID.
-        for i in pkl_list: 
-            pkl_parse = etree.parse(i)
-            pkl_namespace = pkl_parse.xpath('namespace-uri(.)') 
-            hashes =  pkl_parse.findall('//ns:Hash',namespaces={'ns': pkl_namespace})
-            xmluuid =  pkl_parse.findall('//ns:Asset/ns:Id',namespaces={'ns': pkl_namespace})
-
-            counter = 0
-            
-            while counter <= len(hashes) -1 : # The -1 is there because of lxml's zero indexing.
-                pkl_hashes[xmluuid[counter].text] = hashes[counter].text # {pkl_uuid:pkl_hash}
-                counter +=1
-                
-        # Begin analysis of assetmap xml.
-        counter = 0
-        assetmap_paths =  assetmap_xml.findall('//ns:Path',namespaces={'ns': assetmap_namespace})
-        assetmap_uuids =  assetmap_xml.findall('//ns:Asset/ns:Id',namespaces={'ns': assetmap_namespace})
-        #while counter <= len(assetmap_paths) -1 :
-            
-        counter = 0
-
-        file_paths = {}
-        
-        while counter <= len(assetmap_paths) -1 :
-            if 'file:///' in assetmap_paths[counter].text:
-                remove_this = 'file:///'
-                assetmap_paths[counter].text =  assetmap_paths[counter].text.replace(remove_this,"")
-            elif 'file://' in assetmap_paths[counter].text:
-                remove_this = 'file://'
-                assetmap_paths[counter].text =  assetmap_paths[counter].text.replace(remove_this,"")            
-
-            elif 'file:/' in assetmap_paths[counter].text:
-                remove_this = 'file:/'
-                assetmap_paths[counter].text =  assetmap_paths[counter].text.replace(remove_this,"")
-            
-
-            file_paths[assetmap_uuids[counter].text] = [assetmap_paths[counter].text] # {assetmapuuid:assetmapfilename}
-            counter +=1
-
-        # Removes PKLs from list of files to hash, as these files are not in manifest.
-        keys_to_remove = [] 
-
-        for i in file_paths:
-            if file_paths[i][0] in pkl_list:
-                keys_to_remove.append(i)
-        # PKL files are deleted from the file_paths dictionary. 
-        for i in keys_to_remove:
-            del file_paths[i]       
-
-        # Check if there are any files missing from the DCP.
-
-        missing_files = []
-        for i in file_paths:
-            if not os.path.isfile(file_paths[i][0]): # This checks if the file exists.
-                print time.strftime("%Y-%m-%dT%H:%M:%S") + ' - **********' + file_paths[i][0] + ' is missing **********'
-                missing_files.append(i)
-                # Add missing file info to the csv.
-                append_csv(csvfile,('MISSING FILE', pkl_hashes[i], os.path.abspath(file_paths[i][0]),'MISSING FILE'))
-
-        # This removes the missing files from the hashable list. 
-        for i in missing_files:
-            del file_paths[i]
-            del pkl_hashes[i]
-
-        # Generate fresh hashes on the actual files in the DCP.           
-        for i in file_paths:  
-            print time.strftime("%Y-%m-%dT%H:%M:%S") + ' - Generating fresh hash for ' + file_paths[i][0]
-            # Create SHA-1 binary hashes with OPENSSL.
-            
-            openssl_hash = subprocess.check_output(['openssl',
-                                                    'sha1',
-                                                    '-binary',
-                                                     file_paths[i][0]])
-            # Encode the hashes as base64.
-            b64hash =  base64.b64encode(openssl_hash)
-            # Append hashes to the list within the file_paths dictionary. 
-            file_paths[i].append(b64hash)
-
-        # Compare the hashes in the PKL manifest to the fresh hashes. 
-        hash_mismatches = []       
-        for i in file_paths:
-            if file_paths[i][1] == pkl_hashes[i]:
-                print file_paths[i][0] + ' is ok'
-                append_csv(csvfile,(file_paths[i][1], pkl_hashes[i], os.path.abspath(file_paths[i][0]),'HASH MATCH'))
+        dcp['assets'].append((asset_uuid, path, pkl_hash))
+    return dcp
+
+
+def sha1_base64(hex_digest):
+    '''
+    Converts a hex SHA-1 to the base64 encoding used in PKLs.
+    '''
+    return base64.b64encode(binascii.unhexlify(hex_digest))
+
+
+def hash_dcps(dcps, workers=None):
+    '''
+    Hashes the assets of every DCP in parallel, largest first.
+    Missing assets are yielded straight away with a hash of None.
+    Yields (dcp, path, pkl_hash, fresh_hash) as each asset is finished.
+    '''
+    jobs = []
+    for dcp in dcps:
+        for _, path, pkl_hash in dcp['assets']:
+            if os.path.isfile(path):
+                jobs.append((os.path.getsize(path), path, dcp, pkl_hash))
             else:
-                print file_paths[i][0] + ' mismatch'
-                hash_mismatches.append(file_paths[i][0])
-                append_csv(csvfile,(file_paths[i][1], pkl_hashes[i], os.path.abspath(file_paths[i][0]),'HASH MISMATCH'))
-            
-                
-        if len(hash_mismatches) > 0:
+                print time.strftime("%Y-%m-%dT%H:%M:%S") + ' - **********' + path + ' is missing **********'
+                yield dcp, path, pkl_hash, None
+    jobs.sort(key=lambda job: job[0], reverse=True)
+    assets = dict((path, (dcp, pkl_hash)) for _, path, dcp, pkl_hash in jobs)
+    for path, checksums in parallel_multi_hash(
+            [path for _, path, _, _ in jobs], ['sha1'], workers, ordered=False
+        ):
+        dcp, pkl_hash = assets[path]
+        yield dcp, path, pkl_hash, sha1_base64(checksums['sha1'])
+
+
+def check_dcps(dcps, workers=None):
+    '''
+    Hashes the assets of every DCP and compares them with the PKL hashes.
+    Yields (dcp, rows, missing, mismatches) as soon as every asset of a DCP
+    has been hashed, where rows are the file level CSV rows.
+    '''
+    remaining = {}
+    results = {}
+    for dcp in dcps:
+        remaining[dcp['directory']] = len(dcp['assets'])
+        results[dcp['directory']] = ([], [], [])
+        if not dcp['assets']:
+            yield (dcp,) + results.pop(dcp['directory'])
+    for dcp, path, pkl_hash, fresh_hash in hash_dcps(dcps, workers):
+        rows, missing, mismatches = results[dcp['directory']]
+        if fresh_hash is None:
+            missing.append(path)
+            rows.append(('MISSING FILE', pkl_hash, path, 'MISSING FILE'))
+        elif fresh_hash == pkl_hash:
+            print path + ' is ok'
+            rows.append((fresh_hash, pkl_hash, path, 'HASH MATCH'))
+        else:
+            print path + ' mismatch'
+            mismatches.append(path)
+            rows.append((fresh_hash, pkl_hash, path, 'HASH MISMATCH'))
+        remaining[dcp['directory']] -= 1
+        if remaining[dcp['directory']] == 0:
+            yield (dcp,) + results.pop(dcp['directory'])
+
+
+def get_file_level_csv(dcp_dir, args, desktop_csv):
+    '''
+    Returns the file level CSV for a DCP, creating it in a fixity folder
+    beside the DCP if -csv is used.
+    '''
+    if not args.csv:
+        return desktop_csv
+    fixity_dir = os.path.join(os.path.dirname(dcp_dir), 'fixity')
+    if not os.path.isdir(fixity_dir):
+        os.makedirs(fixity_dir)
+    csvfile = os.path.join(
+        fixity_dir,
+        os.path.basename(os.path.dirname(dcp_dir)) + '_item_level' + time.strftime("_%Y_%m_%dT%H_%M_%S") + '.csv'
+    )
+    create_csv(csvfile, CSV_HEADER)
+    return csvfile
+
+
+def bag_dcp(dcp_dir, source):
+    '''
+    Bags the parent folder of a DCP that passed the fixity check.
+    '''
+    parent_dir = os.path.dirname(dcp_dir)
+    if parent_dir != source and source == os.path.dirname(parent_dir):
+        if bagit is None:
+            print 'bagit is not installed, so %s will not be bagged' % parent_dir
+            return
+        bagit.make_bag(parent_dir)
+    else:
+        print 'bagging not supported for this folder structure right now'
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='DCP FIXITY checker/bagging tool.'
+        ' Written by Kieran O\'Leary.'
+    )
+    parser.add_argument('input')
+    parser.add_argument(
+        '-bag',
+        action='store_true', help='bag the dcp_dir if it passes the hash check'
+    )
+    parser.add_argument(
+        '-csv',
+        action='store_true', help='File level csv is stored as sidecar to dcp directory'
+    )
+    parser.add_argument(
+        '-m',
+        action='store_true', help='send email report'
+    )
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        help='Number of files to hash at once. Defaults to the number of CPU cores'
+    )
+    return parser
+
+
+def main(args_):
+    '''
+    Checks every DCP beneath the input directory and writes a DCP level
+    CSV report to the desktop. Returns the path of the report.
+    '''
+    args = make_parser().parse_args(args_)
+    dcp_dir = args.input
+    csv_report = os.path.expanduser("~/Desktop/%s.csv") % (
+        os.path.basename(dcp_dir) + '_dcp_level' + time.strftime("_%Y_%m_%dT%H_%M_%S")
+    )
+    create_csv(csv_report, ('DCP NAME', 'DIRECTORY NAME', 'JUDGEMENT'))
+    desktop_csv = None
+    if not args.csv:
+        desktop_csv = os.path.expanduser("~/Desktop/%s.csv") % (
+            os.path.basename(dcp_dir) + '_file_level' + time.strftime("_%Y_%m_%dT%H_%M_%S")
+        )
+        create_csv(desktop_csv, CSV_HEADER)
+    dcps = []
+    report_rows = []
+    for package in find_packages(dcp_dir):
+        dcp = read_dcp(package)
+        root = dcp['directory']
+        dcp['csv'] = get_file_level_csv(root, args, desktop_csv)
+        for xml_file in dcp['invalid_xml']:
+            print '%s is not a valid PKL!!!!' % xml_file
+            append_csv_rows(dcp['csv'], [('NOT A VALID PKL', 'NOT A VALID PKL', xml_file, 'NOT A VALID PKL')])
+            report_rows.append((os.path.basename(root), root, 'NOT A VALID PKL'))
+        if dcp['error'] is None:
+            dcps.append(dcp)
+            continue
+        print '%s - %s' % (root, dcp['error'])
+        append_csv_rows(dcp['csv'], [(dcp['error'], dcp['error'], root, dcp['error'])])
+        report_rows.append((os.path.basename(root), root, dcp['error']))
+    append_csv_rows(csv_report, report_rows)
+    for dcp, rows, missing, mismatches in check_dcps(dcps, args.j):
+        root = dcp['directory']
+        append_csv_rows(dcp['csv'], rows)
+        if mismatches:
             report = ' but THERE ARE HASH MISMATCHES. SCROLL UP FOR MORE INFO OR CHECK THE CSV'
-            baggable = 'n'
             print 'This DCP will not be bagged as it could not pass a fixity check'
         else:
             report = ' and all hashes match.'
-            baggable = 'y'
-
-        if len(missing_files) > 0:
-            print time.strftime("%Y-%m-%dT%H:%M:%S") + ' - WARNING - THERE ARE FILES MISSING FROM THIS DCP. SCROLL UP FOR MORE INFO OR CHECK THE CSV'
-            append_csv(csv_report,(os.path.dirname(root), dir, 'FILES MISSING - CHECK REPORT'))
+        if missing:
+            print time.strftime("%Y-%m-%dT%H:%M:%S") + ' - ' + root + ' - WARNING - THERE ARE FILES MISSING FROM THIS DCP. SCROLL UP FOR MORE INFO OR CHECK THE CSV'
+            append_csv_rows(csv_report, [(os.path.dirname(root), root, 'FILES MISSING - CHECK REPORT')])
             print 'This DCP will not be bagged as it could not pass a fixity check'
-        else: 
-            print time.strftime("%Y-%m-%dT%H:%M:%S") + ' - All files are present in your DCP' + report
-            append_csv(csv_report,(os.path.dirname(root), dir,'All files present ' + report))
-            
-        if bagging == 'enabled':
-            if baggable == 'y':
-                #pdb.set_trace()
-                if os.path.dirname(root) != args.input:
-                   
-
-                    dir = os.path.dirname(root)
-                    
-                    if args.input == os.path.dirname(dir):
-                        os.chdir(dir)
-
-                        bag = bagit.make_bag(dir)
-                        
-                    else:
-                        print 'bagging not supported for this folder structure right now'
-                else:
-                     
-                     print 'bagging not supported for this folder structure right now'
-if email == 'enabled': 
-    emailfrom = ""
-    emailto = ['', '']
-    #emailto = ", ".join(emailto)
-    fileToSend = csv_report
-    username = ""
-    password = ""
-
-    msg = MIMEMultipart()
-    msg["From"] = emailfrom
-    msg["To"] = ", ".join(emailto)
-    msg["Subject"] = "Hash check complete"
-    msg.preamble = "testtesttest"
-    body = MIMEText("example email body")
-    msg.attach(body)
-
-    ctype, encoding = mimetypes.guess_type(fileToSend)
-    if ctype is None or encoding is not None:
-        ctype = "application/octet-stream"
-
-    maintype, subtype = ctype.split("/", 1)
-
-    if maintype == "text":
-        fp = open(fileToSend)
-        # Note: we should handle calculating the charset
-        attachment = MIMEText(fp.read(), _subtype=subtype)
-        fp.close()
-    elif maintype == "image":
-        fp = open(fileToSend, "rb")
-        attachment = MIMEImage(fp.read(), _subtype=subtype)
-        fp.close()
-    elif maintype == "audio":
-        fp = open(fileToSend, "rb")
-        attachment = MIMEAudio(fp.read(), _subtype=subtype)
-        fp.close()
-    else:
-        fp = open(fileToSend, "rb")
-        attachment = MIMEBase(maintype, subtype)
-        attachment.set_payload(fp.read())
-        fp.close()
-        encoders.encode_base64(attachment)
-    attachment.add_header("Content-Disposition", "attachment", filename=fileToSend)
-    msg.attach(attachment)
+        else:
+            print time.strftime("%Y-%m-%dT%H:%M:%S") + ' - ' + root + ' - All files are present in your DCP' + report
+            append_csv_rows(csv_report, [(os.path.dirname(root), root, 'All files present ' + report)])
+        if args.bag and not missing and not mismatches:
+            bag_dcp(root, dcp_dir)
+    if args.m:
+        send_gmail(['', ''], csv_report, 'Hash check complete', 'example email body', '', '')
+    return csv_report
 
 
-    server_ssl = smtplib.SMTP_SSL("smtp.gmail.com", 465)
-    server_ssl.ehlo() # optional, called by login()
-    server_ssl.login(username, password)  
-    # ssl server doesn't support or need tls, so don't call server_ssl.starttls() 
-    server_ssl.sendmail(emailfrom, emailto, msg.as_string())
-    print msg.as_string()
-    #server_ssl.quit()
-    server_ssl.close()
-    print 'successfully sent the mail'    
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+'''
+Parsed model of a DCP that is shared by the DCP scripts.
+The ASSETMAP, PKLs and CPLs of a DCP are parsed once and turned into
+uuid to path, uuid to hash and reel to asset lookups.
+XML files are identified by the namespace of their root element, so a
+file is never fully parsed just to find out what it is.
+Everything is cached until the date modified of a file changes.
+Usage: dcpmodel.py /path/to/dcp
+'''
+import sys
+import os
+import argparse
+from lxml import etree
+
+ASSETMAP_NAMES = ('ASSETMAP', 'ASSETMAP.xml')
+# cached results, keyed on the full path of a file or DCP directory.
+NAMESPACE_CACHE = {}
+CPL_CACHE = {}
+PACKAGE_CACHE = {}
+
+
+def get_mtime(path):
+    '''
+    Returns the date modified of a file in nanoseconds.
+    '''
+    path_stat = os.stat(path)
+    mtime_ns = getattr(path_stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(path_stat.st_mtime * 1000000000)
+    return mtime_ns
+
+
+def sniff_namespace(xml_file):
+    '''
+    Returns the namespace of the root element of an XML file, or None if
+    it isn't valid XML. Only the start of the file is parsed.
+    '''
+    xml_file = os.path.abspath(xml_file)
+    mtime_ns = get_mtime(xml_file)
+    cached = NAMESPACE_CACHE.get(xml_file)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    namespace = None
+    try:
+        for _, element in etree.iterparse(xml_file, events=('start',)):
+            namespace = etree.QName(element).namespace or ''
+            break
+    except etree.XMLSyntaxError:
+        namespace = None
+    NAMESPACE_CACHE[xml_file] = (mtime_ns, namespace)
+    return namespace
+
+
+def get_xml_type(xml_file):
+    '''
+    Returns 'ASSETMAP', 'PKL' or 'CPL' for Interop or SMPTE DCP XML, None
+    for other XML and 'invalid' for files that are not valid XML.
+    '''
+    namespace = sniff_namespace(xml_file)
+    if namespace is None:
+        return 'invalid'
+    # eg http://www.smpte-ra.org/schemas/429-8/2007/PKL
+    # or http://www.digicine.com/PROTO-ASDCP-PKL-20040311#
+    name = namespace.rsplit('/', 1)[-1]
+    for xml_type, marker in (('PKL', 'PKL'), ('CPL', 'CPL'), ('ASSETMAP', 'AM')):
+        if marker in name:
+            return xml_type
+    return None
+
+
+def strip_file_uri(path):
+    '''
+    Removes any file:/// style prefix from an ASSETMAP path.
+    '''
+    for prefix in ('file:///', 'file://', 'file:/'):
+        if prefix in path:
+            return path.replace(prefix, '')
+    return path
+
+
+def read_cpl(cpl):
+    '''
+    Returns a dictionary describing a CPL, with the keys:
+    path, id, content_title_text,
+    reels - a list of dictionaries with the reel id and its assets,
+    keyed on the element name, eg 'MainPicture', 'MainSound',
+    'MainSubtitle' or 'MainClosedCaption'. Each asset has the keys
+    id, edit_rate, entry_point, duration and intrinsic_duration.
+    Closed captions that use their own namespace are included.
+    '''
+    cpl = os.path.abspath(cpl)
+    mtime_ns = get_mtime(cpl)
+    cached = CPL_CACHE.get(cpl)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    cpl_parse = etree.parse(cpl)
+    cpl_namespace = cpl_parse.xpath('namespace-uri(.)')
+    namespaces = {'ns': cpl_namespace}
+    reels = []
+    for reel in cpl_parse.findall('//ns:Reel', namespaces=namespaces):
+        assets = {}
+        for asset in reel.iterfind('ns:AssetList/*', namespaces=namespaces):
+            if not isinstance(asset.tag, basestring):
+                continue
+            fields = {}
+            for child in asset:
+                if isinstance(child.tag, basestring):
+                    fields[etree.QName(child).localname] = child.text
+            assets[etree.QName(asset).localname] = {
+                'id': fields.get('Id'),
+                'edit_rate': fields.get('EditRate'),
+                'entry_point': fields.get('EntryPoint'),
+                'duration': fields.get('Duration'),
+                'intrinsic_duration': fields.get('IntrinsicDuration')
+            }
+        reels.append({
+            'id': reel.findtext('ns:Id', namespaces=namespaces),
+            'assets': assets
+        })
+    cpl_info = {
+        'path': cpl,
+        'id': cpl_parse.getroot().findtext('ns:Id', namespaces=namespaces),
+        'content_title_text': cpl_parse.findtext(
+            '//ns:ContentTitleText', namespaces=namespaces
+        ),
+        'reels': reels
+    }
+    CPL_CACHE[cpl] = (mtime_ns, cpl_info)
+    return cpl_info
+
+
+def read_pkl(pkl, package):
+    '''
+    Adds the hash, size and type of every asset in a PKL to a package.
+    '''
+    pkl_parse = etree.parse(pkl)
+    namespaces = {'ns': pkl_parse.xpath('namespace-uri(.)')}
+    for asset in pkl_parse.findall('//ns:Asset', namespaces=namespaces):
+        asset_uuid = asset.findtext('ns:Id', namespaces=namespaces)
+        package['hashes'][asset_uuid] = asset.findtext('ns:Hash', namespaces=namespaces)
+        size = asset.findtext('ns:Size', namespaces=namespaces)
+        package['sizes'][asset_uuid] = int(size) if size else None
+        package['types'][asset_uuid] = asset.findtext('ns:Type', namespaces=namespaces)
+
+
+def get_assetmap(dcp_dir):
+    '''
+    Returns the full path of the ASSETMAP in dcp_dir, or None.
+    '''
+    for assetmap in ASSETMAP_NAMES:
+        if os.path.isfile(os.path.join(dcp_dir, assetmap)):
+            return os.path.join(dcp_dir, assetmap)
+    return None
+
+
+def read_package(dcp_dir):
+    '''
+    Returns a dictionary describing the DCP in dcp_dir, or None if there
+    is no ASSETMAP. Keys are:
+    directory, assetmap - full paths
+    error - None, or the reason that the DCP can't be read
+    pkls, cpls - full paths of the PKLs and CPLs
+    invalid_xml - full paths of XML files that could not be parsed
+    paths - uuid: path of each asset relative to directory, from the ASSETMAP
+    hashes, sizes, types - uuid: base64 SHA-1, size and type from the PKLs
+    cpl_info - CPL path: dictionary from read_cpl
+    Packages are cached until the date modified of the directory or of
+    any of its XML files changes.
+    '''
+    dcp_dir = os.path.abspath(dcp_dir)
+    assetmap = get_assetmap(dcp_dir)
+    if assetmap is None:
+        return None
+    xml_files = sorted(
+        os.path.join(dcp_dir, filename) for filename in os.listdir(dcp_dir)
+        if filename.endswith('.xml') and filename[0] != '.'
+    )
+    cache_key = tuple(
+        get_mtime(path) for path in [dcp_dir, assetmap] + xml_files
+    )
+    cached = PACKAGE_CACHE.get(dcp_dir)
+    if cached is not None and cached[0] == cache_key:
+        return cached[1]
+    package = {
+        'directory': dcp_dir,
+        'assetmap': assetmap,
+        'error': None,
+        'pkls': [],
+        'cpls': [],
+        'invalid_xml': [],
+        'paths': {},
+        'hashes': {},
+        'sizes': {},
+        'types': {},
+        'cpl_info': {}
+    }
+    try:
+        assetmap_xml = etree.parse(assetmap)
+    except etree.XMLSyntaxError:
+        package['error'] = 'NOT A VALID ASSETMAP'
+    else:
+        namespaces = {'ns': assetmap_xml.xpath('namespace-uri(.)')}
+        for asset in assetmap_xml.findall('//ns:Asset', namespaces=namespaces):
+            path = asset.findtext('.//ns:Path', namespaces=namespaces)
+            if path is not None:
+                package['paths'][asset.findtext('ns:Id', namespaces=namespaces)] = (
+                    strip_file_uri(path)
+                )
+    for xml_file in xml_files:
+        if xml_file == assetmap:
+            continue
+        xml_type = get_xml_type(xml_file)
+        try:
+            if xml_type == 'PKL':
+                read_pkl(xml_file, package)
+                package['pkls'].append(xml_file)
+            elif xml_type == 'CPL':
+                package['cpl_info'][xml_file] = read_cpl(xml_file)
+                package['cpls'].append(xml_file)
+        except etree.XMLSyntaxError:
+            # the root element was fine, but the rest of the file is not.
+            xml_type = 'invalid'
+        if xml_type == 'invalid':
+            package['invalid_xml'].append(xml_file)
+    if package['error'] is None and not package['pkls']:
+        package['error'] = 'PKL APPEARS TO BE MISSING'
+    PACKAGE_CACHE[dcp_dir] = (cache_key, package)
+    return package
+
+
+def get_asset_path(package, asset_uuid):
+    '''
+    Returns the full path of an asset, or None if it isn't in the ASSETMAP.
+    '''
+    path = package['paths'].get(asset_uuid)
+    if path is None:
+        return None
+    return os.path.join(package['directory'], path)
+
+
+def get_reel_assets(package, cpl, asset_type):
+    '''
+    Returns the full paths of the asset_type assets, eg 'MainPicture',
+    of every reel in a CPL, in reel order. Reels without one are skipped.
+    '''
+    paths = []
+    for reel in package['cpl_info'][cpl]['reels']:
+        asset = reel['assets'].get(asset_type)
+        if asset is not None:
+            paths.append(get_asset_path(package, asset['id']))
+    return paths
+
+
+def find_packages(source):
+    '''
+    Yields a package from read_package for every DCP beneath source.
+    '''
+    for root, _, filenames in os.walk(source):
+        if any(assetmap in filenames for assetmap in ASSETMAP_NAMES):
+            yield read_package(root)
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Lists the CPLs, reels and assets of every DCP in a'
+        ' directory. Written by Kieran O\'Leary.'
+    )
+    parser.add_argument('input', help='DCP or folder of DCPs')
+    return parser
+
+
+def main(args_):
+    '''
+    Prints a summary of each DCP.
+    '''
+    args = make_parser().parse_args(args_)
+    for package in find_packages(args.input):
+        print package['directory']
+        if package['error'] is not None:
+            print '    %s' % package['error']
+            continue
+        print '    %d assets, %d PKLs, %d CPLs' % (
+            len(package['paths']), len(package['pkls']), len(package['cpls'])
+        )
+        for cpl in package['cpls']:
+            cpl_info = package['cpl_info'][cpl]
+            print '    %s - %s' % (os.path.basename(cpl), cpl_info['content_title_text'])
+            for reel_number, reel in enumerate(cpl_info['reels'], 1):
+                for asset_type in sorted(reel['assets']):
+                    print '        reel %d %s %s' % (
+                        reel_number, asset_type, package['paths'].get(
+                            reel['assets'][asset_type]['id'], 'NOT IN ASSETMAP'
+                        )
+                    )
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
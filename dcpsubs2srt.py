@@ -1,41 +1,154 @@
 #!/usr/bin/env python
 '''
 Simple DCI DCP XML subtitle to SRT convertor.
+Both Interop and SMPTE subtitle XML are supported. The XML is parsed in a
+single pass and each subtitle is written as soon as it has been read, so
+long subtitle files are converted in linear time and constant memory.
 Usage:
 dcpsubs2srt.py /path/to/subtitle.xml
 Output will be a sidecar SRT file in the same directory as input.
 '''
 
 import sys
+import argparse
 from lxml import etree
 
+# Interop subtitle times count ticks of 4 milliseconds after the seconds.
+INTEROP_TICK_RATE = (250, 1)
 
-def main():
+
+def get_local_name(element):
     '''
-    Converts the input XML to SRT
+    Returns the tag of an element without its namespace.
+    '''
+    return etree.QName(element).localname
+
+
+def parse_rate(rate_text):
+    '''
+    Returns an EditRate such as '24 1' or a TimeCodeRate such as '24'
+    as a (numerator, denominator) tuple.
+    '''
+    rate = [int(number) for number in rate_text.split()]
+    if len(rate) == 1:
+        rate.append(1)
+    return rate[0], rate[1]
+
+
+def parse_time(timecode, rate):
+    '''
+    Returns a subtitle TimeIn or TimeOut in milliseconds.
+    The last field of HH:MM:SS:EE counts units of rate, which is ticks for
+    Interop and edit units for SMPTE. HH:MM:SS.sss is also accepted.
+    '''
+    fields = timecode.strip().split(':')
+    if len(fields) == 3:
+        seconds, _, fraction = fields[2].partition('.')
+        fields[2] = seconds
+        units = int(round(float('0.' + (fraction or '0')) * 1000))
+        rate = (1000, 1)
+    else:
+        units = int(fields[3])
+    hours, minutes, seconds = [int(field) for field in fields[:3]]
+    numerator, denominator = rate
+    return (
+        ((hours * 60 + minutes) * 60 + seconds) * 1000
+        + (units * 1000 * denominator + numerator // 2) // numerator
+    )
+
+
+def format_time(milliseconds):
+    '''
+    Returns milliseconds as an SRT timestamp, eg 01:02:03,040
+    '''
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%02d:%02d:%02d,%03d' % (hours, minutes, seconds, milliseconds)
+
+
+def iter_subtitles(xml_filename):
+    '''
+    Yields (in_point, out_point, lines) for each subtitle in a DCP subtitle
+    XML file, with the times in milliseconds.
+    Subtitles are removed from the tree once they have been read.
+    '''
+    rate = INTEROP_TICK_RATE
+    edit_rate = None
+    for event, element in etree.iterparse(xml_filename, events=('start', 'end')):
+        name = get_local_name(element)
+        if event == 'start':
+            if name == 'SubtitleReel':
+                # SMPTE subtitles count edit units instead of ticks.
+                rate = None
+            continue
+        if name == 'TimeCodeRate':
+            rate = parse_rate(element.text)
+        elif name == 'EditRate':
+            edit_rate = parse_rate(element.text)
+        elif name == 'Subtitle':
+            lines = [
+                ''.join(text.itertext()) for text in element.iter()
+                if get_local_name(text) == 'Text'
+            ]
+            yield (
+                parse_time(element.get('TimeIn'), rate or edit_rate),
+                parse_time(element.get('TimeOut'), rate or edit_rate),
+                lines
+            )
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def write_srt(xml_filename, srt_object):
+    '''
+    Writes the subtitles in a DCP subtitle XML file to an open SRT file.
+    Image subtitles have no text, so they are skipped.
+    Returns the amount of subtitles written.
     '''
-    filename = sys.argv[1]
-    srt_file = filename +'.srt'
-    dcp_subtitle = etree.parse(filename)
-    total_subtitles = int(dcp_subtitle.xpath('count(//Subtitle)'))
     counter = 0
-    with open(srt_file, "w") as myfile:
-        print srt_file, 'created'
-    while counter < total_subtitles:
-        xpath_counter = counter + 1
-        in_point = dcp_subtitle.xpath('//Subtitle')[counter].attrib['TimeIn']
-        out_point = dcp_subtitle.xpath('//Subtitle')[counter].attrib['TimeOut']
-        in_point = in_point[:8]  + '.' + in_point[9:]
-        out_point = out_point[:8] + '.' + out_point[9:]
-        with open(srt_file, "a") as myfile:
-            myfile.write(str(counter + 1) + '\n')
-            myfile.write(in_point + ' --> ' + out_point + '\n')
-            subtitle_text = [subtitle_text.text for subtitle_text in dcp_subtitle.iterfind('.//Subtitle[%s]/Text' % int(xpath_counter))]
-            for i in subtitle_text:
-                myfile.write(i + '\n')
-            myfile.write('\n')
+    for in_point, out_point, lines in iter_subtitles(xml_filename):
+        if not lines:
+            continue
         counter += 1
+        srt_object.write('%d\n%s --> %s\n%s\n\n' % (
+            counter, format_time(in_point), format_time(out_point),
+            '\n'.join(lines).encode('utf-8')
+        ))
+    return counter
+
+
+def subs_to_srt(xml_filename, srt_file):
+    '''
+    Converts a DCP subtitle XML file to an SRT file.
+    Returns the amount of subtitles written.
+    '''
+    with open(srt_file, 'wb') as srt_object:
+        return write_srt(xml_filename, srt_object)
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Converts DCP subtitle XML to a sidecar SRT file.'
+        ' Written by Kieran O\'Leary.'
+    )
+    parser.add_argument('input', help='Interop or SMPTE subtitle XML')
+    return parser
+
+
+def main(args_):
+    '''
+    Converts the input XML to SRT
+    '''
+    args = make_parser().parse_args(args_)
+    srt_file = args.input + '.srt'
+    subtitle_count = subs_to_srt(args.input, srt_file)
+    print srt_file, 'created with', subtitle_count, 'subtitles'
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
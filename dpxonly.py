@@ -13,9 +13,10 @@ from ififuncs import create_csv
 from ififuncs import append_csv
 from ififuncs import send_gmail
 from ififuncs import hashlib_manifest
-from ififuncs import diff_textfiles
+from framemd5 import compare_framemd5, describe
 from ififuncs import make_manifest
 from ififuncs import generate_log
+from ififuncs import close_log
 
 
 '''''
@@ -214,8 +215,11 @@ for source_directory in all_files:
             generate_log(general_log, 'Generating destination manifest via md5deep and storing as  %s' % manifest_textfile)
             other = make_framemd5(output_dirname + '/image/dpx_files', 'dpx', 'dpx_framemd5')
             other_textfile = other[1]
-            judgement = diff_textfiles(source_textfile, other_textfile)
-            generate_log(general_log, 'Outcome of transcode was:  %s' % judgement)
+            verdict = compare_framemd5(source_textfile, other_textfile)
+            judgement = verdict['judgement']
+            print describe(verdict)
+            generate_log(general_log, 'Outcome of transcode was:  %s' % describe(verdict))
+            close_log(general_log)
             make_manifest(output_parent_directory, os.path.basename(output_dirname), manifest_textfile)
             source_metadata_dir = root_dir + '/metadata/image'
             shutil.copy(source_textfile, source_metadata_dir + '/%s' % os.path.basename(source_textfile))
@@ -4,23 +4,24 @@ This script will ask mediainfo to get all durations with a folder
 '''
 import os
 import sys
-from ififuncs import get_milliseconds
+from mediaprobe import probe_files
 
 
 def main():
     '''
     Recursively search for AV files and print duration in seconds
+    All files are probed in batches, and durations are cached.
     '''
     all_files = sys.argv[1:]
     duration = 0
+    av_files = []
     for parent_directory in all_files:
         for root, dirnames, filenames in os.walk(parent_directory):
             for filename in filenames:
                 if filename.endswith(('.MP4', '.mov', '.mkv')):
-                    milliseconds = get_milliseconds(
-                        os.path.join(root, filename)
-                    )
-                    duration += float(milliseconds)
+                    av_files.append(os.path.join(root, filename))
+    for record in probe_files(av_files).values():
+        duration += float(record['duration'])
     print '\nDuration of', all_files, ',', duration / 1000 / 60, 'minutes\n'
 
 
@@ -6,13 +6,14 @@ import sys
 import os
 from glob import glob
 import shutil
+from mediaprobe import probe_files
 try:
     from ififuncs import set_environment
     from ififuncs import hashlib_manifest
     from ififuncs import make_mediatrace
     from ififuncs import make_mediainfo
     from ififuncs import generate_log
-    from ififuncs import get_mediainfo
+    from ififuncs import close_log
 except ImportError:
     print '*** ERROR - IFIFUNCS IS MISSING - *** \n'
     'dvsip requires that ififuncs.py is located in the same directory'
@@ -55,11 +56,9 @@ def get_input():
             print "Your input isn't a file or a directory."
             print "What was it? I'm curious."
         dv_test = []    
+        probes = probe_files(video_files)
         for test_files in video_files:
-            codec =  get_mediainfo(
-                'codec', '--inform=Video;%Codec%',
-                 test_files
-                 ).rstrip()
+            codec = probes[test_files]['codec'].rstrip()
             if codec.rstrip() != 'DV':
                 dv_test.append(test_files)
                 print 'Non-DV file found, skipping'
@@ -119,6 +118,7 @@ def make_sip(video_files):
             shutil.move(filename, data_dir)
             generate_log(log, 'dvsip.py DV file moved to %s' % data_dir)
         generate_log(log, 'dvsip.py MD5 manifest started')
+        close_log(log)
         hashlib_manifest(filenoext, manifest, source_parent_dir)
 def main():
     video_files = get_input()
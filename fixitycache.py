@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+'''
+Persistent fixity cache.
+Checksums are stored in an SQLite database along with the device, inode,
+size and modification time of each file. copyit.py, validate.py and
+batchfixity.py can then skip hashing files that have not changed since
+they were last checked.
+Usage: fixitycache.py report or fixitycache.py compact
+'''
+import sys
+import os
+import time
+import sqlite3
+import argparse
+from ififuncs import make_desktop_manifest_dir, generate_log
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fixity (
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    device INTEGER,
+    inode INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER,
+    digest TEXT NOT NULL,
+    checked REAL,
+    PRIMARY KEY (path, algorithm)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    tool TEXT,
+    mode TEXT,
+    started REAL,
+    hits INTEGER,
+    misses INTEGER,
+    changed INTEGER
+);
+'''
+
+
+def get_cache_path():
+    '''
+    Returns the default location of the fixity cache database.
+    '''
+    return os.path.join(make_desktop_manifest_dir(), 'fixity_cache.sqlite')
+
+
+def get_file_key(path):
+    '''
+    Returns a (device, inode, size, mtime_ns) tuple for a file.
+    If any of these values change, a cached checksum is no longer trusted.
+    '''
+    file_stat = os.stat(path)
+    mtime_ns = getattr(file_stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(file_stat.st_mtime * 1000000000)
+    return file_stat.st_dev, file_stat.st_ino, file_stat.st_size, mtime_ns
+
+
+class FixityCache(object):
+    '''
+    Wraps the SQLite fixity cache.
+    In 'trust' mode, lookup returns the cached checksum of any file whose
+    path, device, inode, size and mtime have not changed.
+    In 'paranoid' mode, lookup never returns a checksum, so every file is
+    hashed again. store then records any file whose checksum has changed
+    even though its metadata has not.
+    '''
+    def __init__(self, mode='trust', cache_path=None, tool=''):
+        if cache_path is None:
+            cache_path = get_cache_path()
+        self.mode = mode
+        self.tool = tool
+        self.cache_path = cache_path
+        self.started = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.changed = []
+        self.pending_writes = 0
+        self.file_keys = {}
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.executescript(SCHEMA)
+
+    def lookup(self, filename, algorithm='md5'):
+        '''
+        Returns the cached checksum of filename, or None if it must be hashed.
+        '''
+        path = os.path.abspath(filename)
+        file_key = get_file_key(path)
+        # The file is stat'd before hashing, so a file that is modified
+        # while it is being hashed will not match on the next run.
+        self.file_keys[path] = file_key
+        row = self.connection.execute(
+            'SELECT digest FROM fixity WHERE path=? AND algorithm=?'
+            ' AND device=? AND inode=? AND size=? AND mtime_ns=?',
+            (path, algorithm) + file_key
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.mode == 'paranoid':
+            return None
+        return str(row[0])
+
+    def store(self, filename, digest, algorithm='md5'):
+        '''
+        Adds or updates the checksum of filename.
+        '''
+        path = os.path.abspath(filename)
+        file_key = self.file_keys.pop(path, None)
+        if file_key is None:
+            file_key = get_file_key(path)
+        row = self.connection.execute(
+            'SELECT digest FROM fixity WHERE path=? AND algorithm=?'
+            ' AND device=? AND inode=? AND size=? AND mtime_ns=?',
+            (path, algorithm) + file_key
+        ).fetchone()
+        if row is not None and str(row[0]) != digest:
+            print '%s has changed checksum but not size or date modified - %s cached - %s hashed' % (
+                path, row[0], digest
+            )
+            self.changed.append(path)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO fixity VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, algorithm) + file_key + (digest, time.time())
+        )
+        self.pending_writes += 1
+        if self.pending_writes >= 1000:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def summary(self):
+        '''
+        Returns a one line summary of cache usage for logs.
+        '''
+        total = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / total if total else 0.0
+        return 'Fixity cache (%s mode) - %d hits, %d misses, %.1f%% hit rate, %d changed checksums' % (
+            self.mode, self.hits, self.misses, hit_rate, len(self.changed)
+        )
+
+    def close(self):
+        '''
+        Records the statistics for this run and closes the database.
+        '''
+        self.connection.execute(
+            'INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?)',
+            (self.tool, self.mode, self.started, self.hits, self.misses, len(self.changed))
+        )
+        self.connection.commit()
+        self.connection.close()
+        print self.summary()
+
+
+def open_cache(mode, tool, cache_path=None):
+    '''
+    Returns a FixityCache, or None if mode is None so that scripts can
+    pass their -cache argument straight through.
+    '''
+    if mode is None:
+        return None
+    return FixityCache(mode, cache_path, tool)
+
+
+def close_cache(cache, log_name_source=None):
+    '''
+    Closes a cache returned by open_cache and optionally logs the summary
+    and any changed checksums.
+    '''
+    if cache is None:
+        return
+    if log_name_source is not None:
+        for path in cache.changed:
+            generate_log(
+                log_name_source,
+                'ERROR = %s has changed checksum but not size or date modified' % path
+            )
+        generate_log(log_name_source, 'EVENT = %s' % cache.summary())
+    cache.close()
+
+
+def compact_cache(cache_path, older_than=None):
+    '''
+    Removes entries for files that no longer exist or that have changed,
+    as well as entries that have not been checked in older_than days.
+    The database is then vacuumed to reclaim space.
+    '''
+    connection = sqlite3.connect(cache_path)
+    connection.executescript(SCHEMA)
+    stale = []
+    rows = connection.execute(
+        'SELECT path, algorithm, device, inode, size, mtime_ns, checked FROM fixity'
+    ).fetchall()
+    if older_than is not None:
+        cutoff = time.time() - older_than * 86400
+    for path, algorithm, device, inode, size, mtime_ns, checked in rows:
+        if older_than is not None and checked < cutoff:
+            stale.append((path, algorithm))
+            continue
+        try:
+            if get_file_key(path) != (device, inode, size, mtime_ns):
+                stale.append((path, algorithm))
+        except OSError:
+            stale.append((path, algorithm))
+    connection.executemany(
+        'DELETE FROM fixity WHERE path=? AND algorithm=?', stale
+    )
+    connection.commit()
+    connection.execute('VACUUM')
+    connection.close()
+    print 'Removed %d of %d cache entries' % (len(stale), len(rows))
+
+
+def report_cache(cache_path, run_count):
+    '''
+    Prints the size of the cache and the hit rates of recent runs.
+    '''
+    connection = sqlite3.connect(cache_path)
+    connection.executescript(SCHEMA)
+    print 'Fixity cache: %s' % cache_path
+    for algorithm, count in connection.execute(
+            'SELECT algorithm, COUNT(*) FROM fixity GROUP BY algorithm'
+        ):
+        print '%-8s %d files' % (algorithm, count)
+    print '\n%-20s %-16s %-9s %10s %10s %8s %8s' % (
+        'date', 'tool', 'mode', 'hits', 'misses', 'hit rate', 'changed'
+    )
+    total_hits = 0
+    total_misses = 0
+    runs = connection.execute(
+        'SELECT tool, mode, started, hits, misses, changed FROM runs'
+        ' ORDER BY started DESC LIMIT ?', (run_count,)
+    ).fetchall()
+    for tool, mode, started, hits, misses, changed in reversed(runs):
+        total_hits += hits
+        total_misses += misses
+        hit_rate = 100.0 * hits / (hits + misses) if hits + misses else 0.0
+        print '%-20s %-16s %-9s %10d %10d %7.1f%% %8d' % (
+            time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            tool, mode, hits, misses, hit_rate, changed
+        )
+    if total_hits + total_misses:
+        print '\nOverall hit rate: %.1f%%' % (
+            100.0 * total_hits / (total_hits + total_misses)
+        )
+    connection.close()
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Maintains the fixity cache used by the -cache option of'
+        ' copyit.py, validate.py and batchfixity.py.'
+        ' Written by Kieran O\'Leary.'
+    )
+    parser.add_argument(
+        '-db',
+        help='full path of the cache database. Defaults to %s' % os.path.join(
+            '~/Desktop/moveit_manifests', 'fixity_cache.sqlite'
+        )
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    compact_parser = subparsers.add_parser(
+        'compact',
+        help='Remove entries for missing or changed files and shrink the database'
+    )
+    compact_parser.add_argument(
+        '-older_than', type=int,
+        help='Also remove entries that have not been checked in this many days'
+    )
+    report_parser = subparsers.add_parser(
+        'report', help='Print cache size and hit rates of recent runs'
+    )
+    report_parser.add_argument(
+        '-runs', type=int, default=20,
+        help='Number of recent runs to list'
+    )
+    return parser
+
+
+def main(args_):
+    '''
+    Launches the compact or report commands.
+    '''
+    parser = make_parser()
+    args = parser.parse_args(args_)
+    cache_path = args.db
+    if cache_path is None:
+        cache_path = get_cache_path()
+    if args.command == 'compact':
+        compact_cache(cache_path, args.older_than)
+    elif args.command == 'report':
+        report_cache(cache_path, args.runs)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+'''
+Compares two framemd5 files frame by frame.
+Both files are streamed, so multi-million frame files are compared in
+constant memory. Header lines such as timebase and pixel aspect ratio are
+reported but do not affect the verdict, as they commonly differ between
+a source and a lossless transcode.
+Usage: framemd5.py source.framemd5 transcode.framemd5
+'''
+import sys
+import itertools
+import argparse
+
+# Mismatched frame ranges kept for reporting. Any beyond this are still counted.
+MAX_RANGES = 1000
+
+
+def read_framemd5(framemd5_object):
+    '''
+    Yields ('header', name, value) for each '#' header line and
+    ('frame', stream_index, checksum) for each frame in a framemd5 file.
+    Timestamps, durations and sizes are ignored, so that files with
+    different timebases can still be compared.
+    '''
+    for line in framemd5_object:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            name, _, value = line[1:].partition(':')
+            yield 'header', name.strip(), value.strip()
+            continue
+        fields = line.split(',')
+        yield 'frame', fields[0].strip(), fields[-1].strip()
+
+
+def read_frames(framemd5_object, headers):
+    '''
+    Yields (stream_index, checksum) for each frame, and stores the header
+    lines that are passed over in the headers dictionary.
+    '''
+    for line_type, name, value in read_framemd5(framemd5_object):
+        if line_type == 'header':
+            headers[name] = value
+        else:
+            yield name, value
+
+
+def add_mismatch(ranges, frame_index):
+    '''
+    Adds frame_index to a list of [start, end] ranges of mismatched frames.
+    Returns False if the frame needed a new range and there was no room.
+    '''
+    if ranges and ranges[-1][1] == frame_index - 1:
+        ranges[-1][1] = frame_index
+        return True
+    if len(ranges) >= MAX_RANGES:
+        return False
+    ranges.append([frame_index, frame_index])
+    return True
+
+
+def compare_framemd5(source_textfile, other_textfile):
+    '''
+    Compares two framemd5 files and returns a dictionary with the keys:
+    judgement - 'lossless' or 'lossy'
+    frames - amount of frames in each file as a (source, other) tuple
+    mismatches - amount of frames with a different checksum, stream or a
+    missing partner in the other file
+    ranges - [start, end] frame numbers of the mismatches, starting at 0
+    truncated - True if there were more than MAX_RANGES ranges
+    header_differences - header names whose values differ, eg ['sar 0']
+    '''
+    source_headers = {}
+    other_headers = {}
+    source_frames = 0
+    other_frames = 0
+    mismatches = 0
+    ranges = []
+    truncated = False
+    with open(source_textfile, 'r') as source_object:
+        with open(other_textfile, 'r') as other_object:
+            for frame_index, (source_frame, other_frame) in enumerate(
+                    itertools.izip_longest(
+                        read_frames(source_object, source_headers),
+                        read_frames(other_object, other_headers)
+                    )
+                ):
+                if source_frame is not None:
+                    source_frames += 1
+                if other_frame is not None:
+                    other_frames += 1
+                if source_frame != other_frame:
+                    mismatches += 1
+                    if not add_mismatch(ranges, frame_index):
+                        truncated = True
+    header_differences = sorted(
+        name for name in set(source_headers) | set(other_headers)
+        if source_headers.get(name) != other_headers.get(name)
+    )
+    if mismatches == 0:
+        judgement = 'lossless'
+    else:
+        judgement = 'lossy'
+    return {
+        'judgement': judgement,
+        'frames': (source_frames, other_frames),
+        'mismatches': mismatches,
+        'ranges': [tuple(frame_range) for frame_range in ranges],
+        'truncated': truncated,
+        'header_differences': header_differences
+    }
+
+
+def format_ranges(ranges, truncated=False):
+    '''
+    Returns ranges as a string like '10-12, 400'.
+    '''
+    formatted = []
+    for start, end in ranges:
+        if start == end:
+            formatted.append('%d' % start)
+        else:
+            formatted.append('%d-%d' % (start, end))
+    if truncated:
+        formatted.append('...')
+    return ', '.join(formatted)
+
+
+def describe(verdict):
+    '''
+    Returns a one line summary of a verdict for logs and the terminal.
+    '''
+    source_frames, other_frames = verdict['frames']
+    if verdict['judgement'] == 'lossless':
+        description = 'lossless - %d frames match' % source_frames
+    else:
+        description = 'lossy - %d of %d frames do not match - frames %s' % (
+            verdict['mismatches'], max(source_frames, other_frames),
+            format_ranges(verdict['ranges'], verdict['truncated'])
+        )
+        if source_frames != other_frames:
+            description += ' - %d source frames, %d output frames' % (
+                source_frames, other_frames
+            )
+    if verdict['header_differences']:
+        description += ' - headers differ: %s' % ', '.join(
+            verdict['header_differences']
+        )
+    return description
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Compares two framemd5 files and reports the frames'
+        ' that do not match. Written by Kieran O\'Leary.'
+    )
+    parser.add_argument(
+        'source', help='framemd5 of the source'
+    )
+    parser.add_argument(
+        'other', help='framemd5 to compare against the source'
+    )
+    return parser
+
+
+def main(args_):
+    '''
+    Prints the verdict, and exits with a status of 1 if the files are lossy.
+    '''
+    args = make_parser().parse_args(args_)
+    verdict = compare_framemd5(args.source, args.other)
+    print describe(verdict)
+    if verdict['judgement'] != 'lossless':
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -8,6 +8,7 @@ import time
 import smtplib
 import mimetypes
 import getpass
+import atexit
 import os
 import filecmp
 import hashlib
@@ -16,6 +17,16 @@ import uuid
 import tempfile
 import csv
 import json
+import zlib
+import gzip
+import multiprocessing
+import collections
+import Queue
+import re
+import array
+import threading
+import traceback
+import ctypes
 from glob import glob
 from email.mime.multipart import MIMEMultipart
 from email.mime.audio import MIMEAudio
@@ -23,6 +34,37 @@ from email.mime.base import MIMEBase
 from email.mime.image import MIMEImage
 from email.mime.text import MIMEText
 from lxml import etree
+import imageheader
+import dcpmodel
+import mediaprobe
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # https://pypi.python.org/pypi/scandir - backport for python 2.
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+try:
+    # https://pypi.python.org/pypi/xxhash - optional fast checksums.
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# The fast non-cryptographic checksum for quick re-verification passes.
+if xxhash is not None:
+    FAST_HASH = 'xxh64'
+else:
+    FAST_HASH = 'crc32'
+CHECKSUM_LENGTHS = {8: 'crc32', 16: 'xxh64', 32: 'md5', 40: 'sha1', 128: 'sha512'}
+# QCTools XML is read from ffprobe and compressed in chunks of this size.
+QCTOOLS_CHUNK_SIZE = 1024 * 1024
+# Python 2 lets a subprocess inherit every open file descriptor, so one
+# started from a worker thread could hold the pipes of another thread's
+# subprocess open until it exits. Subprocesses that may run in a thread
+# are started with close_fds=CLOSE_FDS. Windows can't close fds when
+# stdout is redirected.
+CLOSE_FDS = sys.platform != 'win32'
 
 def diff_textfiles(source_textfile, other_textfile):
     '''
@@ -50,7 +92,7 @@ def make_mediainfo(xmlfilename, xmlvariable, inputfilename):
         inputfilename
     ]
     with open(xmlfilename, "w+") as fo:
-        xmlvariable = subprocess.check_output(mediainfo_cmd)
+        xmlvariable = subprocess.check_output(mediainfo_cmd, close_fds=CLOSE_FDS)
         fo.write(xmlvariable)
 
 def make_exiftool(xmlfilename, inputfilename):
@@ -63,7 +105,7 @@ def make_exiftool(xmlfilename, inputfilename):
         inputfilename
     ]
     with open(xmlfilename, "w+") as fo:
-        xmlvariable = subprocess.check_output(exiftool_cmd)
+        xmlvariable = subprocess.check_output(exiftool_cmd, close_fds=CLOSE_FDS)
         fo.write(xmlvariable)
 def make_siegfried(xmlfilename, inputfilename):
     '''
@@ -76,7 +118,7 @@ def make_siegfried(xmlfilename, inputfilename):
     ]
     
     with open(xmlfilename, "w+") as fo:
-        xmlvariable = subprocess.check_output(siegfried_cmd)
+        xmlvariable = subprocess.check_output(siegfried_cmd, close_fds=CLOSE_FDS)
         parsed = json.loads(xmlvariable)
         fo.write(json.dumps(parsed, indent=4, sort_keys=True))
 
@@ -95,26 +137,134 @@ def make_mediaconch(full_path, mediaconch_xmlfile):
         xmlfile.write(mediaconch_output)
 
 
-def make_qctools(input):
+def get_qctools_cmd(input, audio_tracks=1):
     '''
-    Runs an ffprobe process that stores QCTools XML info as a variable.
-    A file is not actually created here.
+    Returns the ffprobe command that generates QCTools XML for input.
+    Audio filters are only added if there are audio_tracks, as the
+    movie source fails on files without audio.
     '''
     qctools_args = ['ffprobe', '-f', 'lavfi', '-i',]
-    qctools_args += ["movie=%s:s=v+a[in0][in1],[in0]signalstats=stat=tout+vrep+brng,cropdetect=reset=1:round=1,split[a][b];[a]field=top[a1];[b]field=bottom[b1],[a1][b1]psnr[out0];[in1]ebur128=metadata=1,astats=metadata=1:reset=1:length=0.4[out1]" % input]
+    if audio_tracks > 0:
+        qctools_args += ["movie=%s:s=v+a[in0][in1],[in0]signalstats=stat=tout+vrep+brng,cropdetect=reset=1:round=1,split[a][b];[a]field=top[a1];[b]field=bottom[b1],[a1][b1]psnr[out0];[in1]ebur128=metadata=1,astats=metadata=1:reset=1:length=0.4[out1]" % input]
+    else:
+        qctools_args += ["movie=%s,signalstats=stat=tout+vrep+brng,cropdetect=reset=1,split[a][b];[a]field=top[a1];[b]field=bottom[b1],[a1][b1]psnr" % input]
     qctools_args += ['-show_frames', '-show_versions', '-of', 'xml=x=1:q=1', '-noprivate']
+    return qctools_args
+
+
+def make_qctools(input):
+    '''
+    Runs an ffprobe process that stores QCTools XML info as a variable.
+    A file is not actually created here, and the whole report is held in
+    memory, so use write_qctools_gz for anything longer than a clip.
+    '''
+    qctools_args = get_qctools_cmd(input)
     print qctools_args
     qctoolsreport = subprocess.check_output(qctools_args)
     return qctoolsreport
 
 
-def write_qctools_gz(qctoolsxml, sourcefile):
+def get_stream_count(filename, stream_type):
+    '''
+    Returns the number of streams of stream_type, eg 'a' or 'v', in a file.
+    '''
+    ffprobe_cmd = [
+        'ffprobe', '-v',
+        'error', '-select_streams', stream_type,
+        '-show_entries', 'stream=index', '-of', 'flat',
+        filename
+    ]
+    return len(subprocess.check_output(ffprobe_cmd).splitlines())
+
+
+def get_video_frame_count(filename):
+    '''
+    Returns the number of frames in the first video stream from the
+    container metadata, or an estimate from the duration and frame rate.
+    Returns None if neither are known. Frames are not decoded.
+    '''
+    ffprobe_cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=nb_frames,avg_frame_rate,duration:format=duration',
+        '-of', 'json', filename
+    ]
+    try:
+        probe = json.loads(subprocess.check_output(ffprobe_cmd))
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+    streams = probe.get('streams') or [{}]
+    nb_frames = streams[0].get('nb_frames', 'N/A')
+    if nb_frames.isdigit() and int(nb_frames) > 0:
+        return int(nb_frames)
+    duration = streams[0].get('duration') or probe.get('format', {}).get('duration')
+    numerator, _, denominator = streams[0].get('avg_frame_rate', '0/0').partition('/')
+    try:
+        return int(round(float(duration) * int(numerator) / int(denominator or 1)))
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def write_qctools_gz(qctoolsxml, sourcefile, audio_tracks=None, progress=True):
+    '''
+    Pipes the QCTools XML for sourcefile straight from ffprobe into
+    qctoolsxml.gz, so only one chunk of the report is ever in memory and
+    the uncompressed XML is never written to disk.
+    ffprobe runs in the directory of sourcefile, as the movie filter
+    can't cope with most full paths.
+    If progress is True, the percentage of video frames analysed is printed.
+    Returns the path of the .gz file.
+    '''
+    source_dir = os.path.dirname(os.path.abspath(sourcefile))
+    source_name = os.path.basename(sourcefile)
+    if audio_tracks is None:
+        audio_tracks = get_stream_count(sourcefile, 'a')
+    total_frames = None
+    if progress:
+        total_frames = get_video_frame_count(sourcefile)
+    qctools_gz = qctoolsxml + '.gz'
+    qctools_args = get_qctools_cmd(source_name, audio_tracks)
+    print qctools_args
+    # Video frames are the only frames with this attribute in the XML.
+    marker = 'media_type="video"'
+    frames = 0
+    reported = -1
+    tail = ''
+    qctools_process = subprocess.Popen(
+        qctools_args, stdout=subprocess.PIPE, cwd=source_dir
+    )
+    try:
+        with gzip.open(qctools_gz, 'wb') as gz_object:
+            while True:
+                chunk = qctools_process.stdout.read(QCTOOLS_CHUNK_SIZE)
+                if not chunk:
+                    break
+                gz_object.write(chunk)
+                if total_frames:
+                    # a marker can be split across two chunks.
+                    frames += (tail + chunk).count(marker)
+                    tail = chunk[-(len(marker) - 1):]
+                    percent = min(100, frames * 100 // total_frames)
+                    if percent != reported:
+                        reported = percent
+                        print '\r%s - %d%% of %d frames' % (source_name, percent, total_frames),
+                        sys.stdout.flush()
+    finally:
+        qctools_process.stdout.close()
+        returncode = qctools_process.wait()
+    if total_frames:
+        print
+    if returncode != 0:
+        os.remove(qctools_gz)
+        raise subprocess.CalledProcessError(returncode, qctools_args)
+    return qctools_gz
+
+
+def write_qctools_gz_worker(sourcefile, qctoolsxml):
     '''
-    This accepts a variable containing XML that is written to a file.
+    Version of write_qctools_gz for use in a multiprocessing pool.
+    Returns a (sourcefile, .gz path) tuple.
     '''
-    with open(qctoolsxml, "w+") as fo:
-        fo.write(make_qctools(sourcefile))
-    subprocess.call(['gzip', qctoolsxml])
+    return sourcefile, write_qctools_gz(qctoolsxml, sourcefile, progress=False)
 
 
 def get_audio_stream_count():
@@ -153,13 +303,9 @@ def get_mediainfo(var_type, type, filename):
 def get_milliseconds(filename):
     '''
     Returns a float with the duration of a file in milliseconds.
+    The duration comes from the cached mediaprobe record of the file.
     '''
-    milliseconds = get_mediainfo(
-        'miliseconds',
-        '--inform=General;%Duration%',
-        filename
-    )
-    return float(milliseconds)
+    return float(mediaprobe.probe(filename)['duration'])
 
 def convert_millis(milli):
     '''
@@ -241,115 +387,786 @@ def set_environment(logfile):
     return env_dict
 
 
-def generate_log(log, what2log):
-    if not os.path.isfile(log):
-        with open(log, "wb") as fo:
-            fo.write(time.strftime("%Y-%m-%dT%H:%M:%S ")
-                     + getpass.getuser()
-                     + ' ' + what2log + ' \n')
+# Events that decide the outcome of a copyit.py transfer. The last one
+# logged wins, so a later failure overrides an earlier success.
+OUTCOME_EVENTS = [
+    ('EVENT = File Transfer Judgement - Success', 'success'),
+    ('EVENT = File Transfer Outcome - Failure', 'failure'),
+    ('EVENT = Existing source manifest check - Failure', 'failure - might be outdated manifests in use'),
+]
+
+
+LOGIN_NAME = None
+
+
+def get_login_name():
+    '''
+    Returns the login name for log entries, which only needs to be
+    looked up once.
+    '''
+    global LOGIN_NAME
+    if LOGIN_NAME is None:
+        LOGIN_NAME = getpass.getuser()
+    return LOGIN_NAME
+
+
+def parse_event(what2log):
+    '''
+    Splits a log line like 'EVENT = File Transfer, status=started, agentName=copyit.py'
+    into a dictionary for JSON-lines logs. The text before the first ' = '
+    is the type, the first comma separated field is the event name and any
+    key=value pairs are added as fields.
+    '''
+    event = {'message': what2log}
+    event_type, separator, detail = what2log.partition(' = ')
+    if separator and ' ' not in event_type:
+        event['type'] = event_type
     else:
-        with open(log, "ab") as fo:
-            fo.write(time.strftime("%Y-%m-%dT%H:%M:%S ")
-                     + getpass.getuser()
-                     + ' ' + what2log + ' \n')
+        detail = what2log
+    fields = detail.split(', ')
+    if '=' not in fields[0]:
+        event['event'] = fields.pop(0)
+    for field in fields:
+        key, separator, value = field.partition('=')
+        if separator and key and ' ' not in key and key not in event:
+            event[key] = value
+    return event
+
+
+class EventLog(object):
+    '''
+    Keeps a log file open, rather than opening and closing the file for
+    every event, which is slow on network shares.
+    Each event is handed to the operating system as soon as it is logged,
+    so that manifests of log directories and log consolidation still see
+    every line, but the file is only fsync'd every fsync_interval seconds
+    and when it is closed.
+    If IFI_JSON_LOG is set, each event is also written as a line of JSON
+    to a .jsonl file next to the log.
+    The outcome of a transfer is tracked as events are written, so that
+    scripts don't need to read the log back in to find out what happened.
+    '''
+    fsync_interval = 10.0
+
+    def __init__(self, log, json_log=None):
+        if json_log is None:
+            json_log = bool(os.environ.get('IFI_JSON_LOG'))
+        self.log = log
+        self.outcome = ''
+        self.last_fsync = time.time()
+        self.file_object = open(log, 'ab')
+        self.json_object = None
+        if json_log:
+            self.json_object = open(os.path.splitext(log)[0] + '.jsonl', 'ab')
+
+    def write(self, what2log):
+        '''
+        Adds an event to the log.
+        '''
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.file_object.write(
+            timestamp + ' ' + get_login_name() + ' ' + what2log + ' \n'
+        )
+        if self.json_object is not None:
+            event = parse_event(what2log)
+            event['time'] = timestamp
+            event['user'] = get_login_name()
+            self.json_object.write(json.dumps(event, sort_keys=True) + '\n')
+        for prefix, outcome in OUTCOME_EVENTS:
+            if prefix in what2log:
+                self.outcome = outcome
+        self.flush(time.time() - self.last_fsync >= self.fsync_interval)
+
+    def flush(self, fsync=False):
+        '''
+        Hands buffered events to the operating system, optionally forcing
+        them to disk.
+        '''
+        for file_object in (self.file_object, self.json_object):
+            if file_object is None:
+                continue
+            file_object.flush()
+            if fsync:
+                os.fsync(file_object.fileno())
+        if fsync:
+            self.last_fsync = time.time()
+
+    def close(self):
+        '''
+        Forces any events to disk and closes the log.
+        '''
+        self.flush(True)
+        self.file_object.close()
+        if self.json_object is not None:
+            self.json_object.close()
+
+
+# open EventLogs and the outcomes of closed logs, keyed on the log path.
+EVENT_LOGS = {}
+LOG_OUTCOMES = {}
+# Scripts log from several threads, which share the registry.
+EVENT_LOGS_LOCK = threading.Lock()
+
+
+def get_event_log(log):
+    '''
+    Returns the open EventLog for a log file, opening it if needed.
+    '''
+    key = os.path.abspath(log)
+    with EVENT_LOGS_LOCK:
+        event_log = EVENT_LOGS.get(key)
+        if event_log is None:
+            event_log = EventLog(log)
+            EVENT_LOGS[key] = event_log
+    return event_log
 
 
-def hashlib_md5(filename):
+def generate_log(log, what2log):
+    get_event_log(log).write(what2log)
+
+
+def close_log(log):
     '''
-    uses hashlib to return an MD5 checksum of an input filename
+    Forces a log to disk and closes it. This must be called before a log
+    is moved, as Windows can't move open files.
+    Logging to it again afterwards will reopen it.
+    '''
+    key = os.path.abspath(log)
+    with EVENT_LOGS_LOCK:
+        event_log = EVENT_LOGS.pop(key, None)
+        if event_log is not None:
+            event_log.close()
+            LOG_OUTCOMES[key] = event_log.outcome
+
+
+def close_logs():
+    '''
+    Forces every open log to disk and closes it. This runs when python exits.
+    '''
+    for log in EVENT_LOGS.keys():
+        close_log(log)
+atexit.register(close_logs)
+
+
+def get_log_outcome(log):
+    '''
+    Returns the outcome of a copyit.py transfer - 'success', 'failure'
+    or an empty string if there was no judgement.
+    Logs written by this process are answered from memory. Otherwise
+    the JSON-lines log is used if there is one, and then the text log.
+    '''
+    key = os.path.abspath(log)
+    if key in EVENT_LOGS:
+        return EVENT_LOGS[key].outcome
+    if key in LOG_OUTCOMES:
+        return LOG_OUTCOMES[key]
+    outcome = ''
+    json_log = os.path.splitext(log)[0] + '.jsonl'
+    if os.path.isfile(json_log):
+        with open(json_log, 'r') as fo:
+            messages = [json.loads(line)['message'] for line in fo if line.strip()]
+    else:
+        with open(log, 'r') as fo:
+            messages = fo.readlines()
+    for message in messages:
+        for prefix, event_outcome in OUTCOME_EVENTS:
+            if prefix in message:
+                outcome = event_outcome
+    return outcome
+
+
+def get_hash_block_size(file_size):
+    '''
+    Returns the read size for hashing a file of file_size bytes.
+    IFI_HASH_BLOCK_SIZE sets a fixed size in bytes. Otherwise the size
+    adapts to the file: small files are read in one go, large files on
+    network shares and LTFS benefit from fewer, larger reads.
+    '''
+    block_size = os.environ.get('IFI_HASH_BLOCK_SIZE')
+    if block_size:
+        return max(4096, int(block_size))
+    if file_size <= 2**20:
+        return max(4096, file_size + 1)
+    elif file_size >= 2**28:
+        return 2**23
+    return 2**20
+
+
+# POSIX_FADV_* values, which are the same on linux and the BSDs.
+FADVISE_ADVICE = {
+    'POSIX_FADV_NORMAL': 0,
+    'POSIX_FADV_RANDOM': 1,
+    'POSIX_FADV_SEQUENTIAL': 2,
+    'POSIX_FADV_WILLNEED': 3,
+    'POSIX_FADV_DONTNEED': 4,
+    'POSIX_FADV_NOREUSE': 5
+}
+# The libc posix_fadvise function is looked up on first use.
+LIBC_FADVISE = []
+
+
+def get_libc_fadvise():
+    '''
+    Returns the posix_fadvise function from libc via ctypes, as python 2
+    has no os.posix_fadvise. Returns None where there isn't one, eg on
+    Windows and macOS.
+    '''
+    if not LIBC_FADVISE:
+        libc_fadvise = None
+        if os.name == 'posix':
+            try:
+                libc = ctypes.CDLL(None)
+                # posix_fadvise64 takes 64 bit offsets on 32 bit systems too.
+                libc_fadvise = getattr(
+                    libc, 'posix_fadvise64', getattr(libc, 'posix_fadvise', None)
+                )
+            except (OSError, AttributeError):
+                libc_fadvise = None
+            if libc_fadvise is not None:
+                libc_fadvise.argtypes = [
+                    ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int
+                ]
+                libc_fadvise.restype = ctypes.c_int
+        LIBC_FADVISE.append(libc_fadvise)
+    return LIBC_FADVISE[0]
+
+
+def fadvise(file_object, advice):
+    '''
+    Passes a POSIX_FADV_* hint about file_object to the kernel, eg
+    'POSIX_FADV_SEQUENTIAL' for more readahead or 'POSIX_FADV_DONTNEED'
+    to drop the file from the page cache. os.posix_fadvise is used if
+    python has it, otherwise libc is called directly. This quietly does
+    nothing where neither exists.
+    '''
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(file_object.fileno(), 0, 0, getattr(os, advice))
+        except (OSError, AttributeError):
+            pass
+        return
+    libc_fadvise = get_libc_fadvise()
+    if libc_fadvise is not None:
+        # The return value is an error number, and a hint that isn't
+        # taken is not an error.
+        libc_fadvise(file_object.fileno(), 0, 0, FADVISE_ADVICE[advice])
+
+
+def hash_io(filename, hash_objects, progress=False, output=None):
+    '''
+    The one place where files are read for hashing.
+    Reads filename once and updates every object in hash_objects with each
+    buffer. If output is a file object, each buffer is also written to it.
+    Behaviour can be tuned with environment variables:
+    IFI_HASH_BLOCK_SIZE - read size in bytes, see get_hash_block_size.
+    IFI_HASH_READAHEAD=0 - don't ask the kernel for extra readahead.
+    IFI_HASH_DROP_CACHE=1 - drop files from the page cache after hashing,
+    so that hashing a large package does not evict everything else.
+    If progress is True, the percentage done is printed at most twice a
+    second rather than after every read.
+    Returns the amount of bytes read.
     '''
-    read_size = 0
-    last_percent_done = 0
-    m = hashlib.md5()
     total_size = os.path.getsize(filename)
+    block_size = get_hash_block_size(total_size)
+    drop_cache = os.environ.get('IFI_HASH_DROP_CACHE', '0') != '0'
+    read_size = 0
+    last_progress = 0
     with open(str(filename), 'rb') as f:
+        if os.environ.get('IFI_HASH_READAHEAD', '1') != '0':
+            fadvise(f, 'POSIX_FADV_SEQUENTIAL')
         while True:
-            buf = f.read(2**20)
+            buf = f.read(block_size)
             if not buf:
                 break
             read_size += len(buf)
-            m.update(buf)
-            percent_done = 100 * read_size / total_size
-            if percent_done > last_percent_done:
-                sys.stdout.write('[%d%%]\r' % percent_done)
+            for hash_object in hash_objects:
+                hash_object.update(buf)
+            if output is not None:
+                output.write(buf)
+            if progress and time.time() - last_progress >= 0.5:
+                last_progress = time.time()
+                sys.stdout.write('[%d%%]\r' % (100 * read_size / total_size))
                 sys.stdout.flush()
-                last_percent_done = percent_done
+        if drop_cache:
+            fadvise(f, 'POSIX_FADV_DONTNEED')
+    if progress and total_size:
+        sys.stdout.write('[100%]\r')
+        sys.stdout.flush()
+    return read_size
+
+
+def hashlib_md5(filename):
+    '''
+    uses hashlib to return an MD5 checksum of an input filename
+    '''
+    m = hashlib.md5()
+    hash_io(filename, [m], progress=True)
     md5_output = m.hexdigest()
     return md5_output
 
 
-def hashlib_manifest(manifest_dir, manifest_textfile, path_to_remove):
+def hashlib_md5_worker(filename):
+    '''
+    Quiet version of hashlib_md5 for use in a multiprocessing pool.
+    There is no progress output as several workers share one terminal.
+    Returns a (filename, md5) tuple so that results can be matched up.
+    '''
+    m = hashlib.md5()
+    hash_io(filename, [m])
+    return filename, m.hexdigest()
+
+
+class Crc32Hash(object):
+    '''
+    hashlib style wrapper around zlib.crc32. This is the fast
+    non-cryptographic checksum when the xxhash module is not installed.
+    '''
+    name = 'crc32'
+
+    def __init__(self):
+        self.crc = 0
+
+    def update(self, buf):
+        self.crc = zlib.crc32(buf, self.crc)
+
+    def hexdigest(self):
+        return '%08x' % (self.crc & 0xffffffff)
+
+
+def get_hash_object(algorithm):
+    '''
+    Returns a new hash object with update() and hexdigest() methods.
+    algorithm can be anything hashlib supports, eg md5 or sha512,
+    as well as xxh64 (requires `pip install xxhash`) or crc32.
+    '''
+    if algorithm == 'xxh64':
+        if xxhash is None:
+            raise ImportError(
+                'xxh64 requires the xxhash module - `pip install xxhash`'
+            )
+        return xxhash.xxh64()
+    elif algorithm == 'crc32':
+        return Crc32Hash()
+    return hashlib.new(algorithm)
+
+
+def guess_algorithm(checksum):
+    '''
+    Guesses the algorithm of a checksum from its length, eg 32 characters
+    for md5. Returns md5 if the length is not recognised.
+    '''
+    return CHECKSUM_LENGTHS.get(len(checksum), 'md5')
+
+
+def hashlib_multi(filename, algorithms):
+    '''
+    Reads a file once and returns a dictionary of algorithm: checksum,
+    eg {'md5': '...', 'sha512': '...'}. Every hash object is updated from
+    the same buffer, so adding algorithms does not add extra reads.
+    '''
+    hash_objects = [(algorithm, get_hash_object(algorithm)) for algorithm in algorithms]
+    hash_io(filename, [hash_object for _, hash_object in hash_objects])
+    return dict(
+        (algorithm, hash_object.hexdigest()) for algorithm, hash_object in hash_objects
+    )
+
+
+def hashlib_multi_worker(filename, algorithms):
+    '''
+    Version of hashlib_multi for use in a multiprocessing pool.
+    Returns a (filename, checksums) tuple so that results can be matched up.
+    '''
+    return filename, hashlib_multi(filename, algorithms)
+
+
+def get_hash_workers(workers=None):
+    '''
+    Returns the number of hashing processes to launch.
+    Defaults to one process per CPU core.
+    '''
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return max(1, int(workers))
+
+
+def pool_imap(function, jobs, workers, queue_size=None, ordered=True):
+    '''
+    Runs function(*job) for every tuple in jobs in a pool of worker
+    processes and yields the results. function must be defined at module
+    level and must return a tuple whose first item is job[0].
+    No more than queue_size jobs are queued at any one time, so a
+    huge directory will not flood the pool with pending jobs.
+    If ordered is False, results are yielded as soon as they are ready,
+    so one large file does not hold back the results of smaller ones.
+    '''
+    if queue_size is None:
+        queue_size = workers * 4
+    pool = multiprocessing.Pool(workers)
+    try:
+        if ordered:
+            in_flight = collections.deque()
+            for job in jobs:
+                in_flight.append(pool.apply_async(function, job))
+                if len(in_flight) >= queue_size:
+                    yield in_flight.popleft().get()
+            while in_flight:
+                yield in_flight.popleft().get()
+        else:
+            finished = Queue.Queue()
+            in_flight = {}
+            for job in jobs:
+                in_flight[job[0]] = pool.apply_async(
+                    function, job, callback=finished.put
+                )
+                if len(in_flight) >= queue_size:
+                    yield next_finished_job(finished, in_flight)
+            while in_flight:
+                yield next_finished_job(finished, in_flight)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def next_finished_job(finished, in_flight):
+    '''
+    Returns the next result that a pool worker has finished and removes
+    it from the in_flight dictionary of AsyncResults.
+    A failed job never reaches the finished queue, so the AsyncResults
+    are checked every second and the worker's exception is raised here.
+    '''
+    while True:
+        try:
+            result = finished.get(timeout=1)
+        except Queue.Empty:
+            for async_result in in_flight.values():
+                if async_result.ready() and not async_result.successful():
+                    async_result.get()
+            continue
+        del in_flight[result[0]]
+        return result
+
+
+# Put on a run_pipeline stage's queue to tell its threads to finish.
+PIPELINE_END = object()
+
+
+def run_pipeline(items, stages):
+    '''
+    Passes every item through a list of (function, slots) stages, where
+    each function takes the value returned by the previous stage.
+    Each stage runs in slots threads, so different items can be in
+    different stages at the same time, eg one image sequence can be
+    verified while the next one is transcoding. This suits stages that
+    mostly wait on subprocesses like ffmpeg.
+    A stage can return None to drop an item. If a stage raises an
+    exception, or calls sys.exit, it is printed and the item is dropped
+    and counted as failed, so that one bad item does not stop the batch.
+    Items are only taken from the items iterable when the first stage
+    has room for them. Returns the number of items that failed.
+    '''
+    queues = [Queue.Queue(maxsize=slots) for _, slots in stages]
+    failures = []
+    remaining = [slots for _, slots in stages]
+    lock = threading.Lock()
+
+    def worker(stage_index):
+        function, _ = stages[stage_index]
+        try:
+            while True:
+                item = queues[stage_index].get()
+                if item is PIPELINE_END:
+                    break
+                try:
+                    result = function(item)
+                except BaseException:
+                    # This includes SystemExit, as many helpers call
+                    # sys.exit, and it would otherwise end the thread.
+                    traceback.print_exc()
+                    with lock:
+                        failures.append(item)
+                    continue
+                if result is not None and stage_index + 1 < len(stages):
+                    queues[stage_index + 1].put(result)
+        finally:
+            with lock:
+                remaining[stage_index] -= 1
+                last_worker = remaining[stage_index] == 0
+            # the last thread to finish a stage tells the next stage to finish.
+            if last_worker and stage_index + 1 < len(stages):
+                for _ in range(stages[stage_index + 1][1]):
+                    queues[stage_index + 1].put(PIPELINE_END)
+
+    threads = []
+    for stage_index, (_, slots) in enumerate(stages):
+        for _ in range(slots):
+            thread = threading.Thread(target=worker, args=(stage_index,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+    for item in items:
+        queues[0].put(item)
+    for _ in range(stages[0][1]):
+        queues[0].put(PIPELINE_END)
+    for thread in threads:
+        # join with a timeout so that ctrl-c still works.
+        while thread.is_alive():
+            thread.join(1)
+    return len(failures)
+
+
+def parallel_hash(filenames, workers=None, queue_size=None, cache=None, ordered=True):
+    '''
+    Hashes an iterable of filenames with a pool of worker processes.
+    Yields (filename, md5) tuples in the same order as the input,
+    unless ordered is False, see pool_imap.
+    With one worker, files are hashed in this process via hashlib_md5.
+    If a fixitycache.FixityCache is supplied, cached checksums are yielded
+    first and only the remaining files are hashed, so the output is no
+    longer in input order.
+    '''
+    if cache is not None:
+        uncached = []
+        for filename in filenames:
+            md5 = cache.lookup(filename)
+            if md5 is None:
+                uncached.append(filename)
+            else:
+                yield filename, md5
+        for filename, md5 in parallel_hash(uncached, workers, queue_size, ordered=ordered):
+            cache.store(filename, md5)
+            yield filename, md5
+        return
+    workers = get_hash_workers(workers)
+    if workers == 1:
+        for filename in filenames:
+            yield filename, hashlib_md5(filename)
+        return
+    for result in pool_imap(
+            hashlib_md5_worker, ((filename,) for filename in filenames),
+            workers, queue_size, ordered
+        ):
+        yield result
+
+
+def parallel_multi_hash(filenames, algorithms, workers=None, queue_size=None, ordered=True):
+    '''
+    Like parallel_hash, but yields (filename, checksums) tuples where
+    checksums is a dictionary from hashlib_multi.
+    '''
+    algorithms = tuple(algorithms)
+    workers = get_hash_workers(workers)
+    if workers == 1:
+        for filename in filenames:
+            yield filename, hashlib_multi(filename, algorithms)
+        return
+    for result in pool_imap(
+            hashlib_multi_worker, ((filename, algorithms) for filename in filenames),
+            workers, queue_size, ordered
+        ):
+        yield result
+
+
+def hashlib_manifest(manifest_dir, manifest_textfile, path_to_remove, workers=None, cache=None):
     '''
     Creates an MD5 manifest with relative filepaths.
+    workers sets the amount of hashing processes and cache is an optional
+    fixitycache.FixityCache, see parallel_hash.
     '''
-    file_count = 0
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if not f[0] == '.']
-        directories[:] = [d for d in directories if not d[0] == '.']
-        for files in filenames:
-            print "Calculating number of files to process in current directory -  %s files        \r"% file_count,
-            file_count += 1
-    manifest_generator = ''
-    md5_counter = 1
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if f[0] != '.']
-        directories[:] = [d for d in directories if d[0] != '.']
-        for files in filenames:
-            print 'Generating MD5 for %s - file %d of %d' % (os.path.join(root, files), md5_counter, file_count)
-            md5 = hashlib_md5(os.path.join(root, files))
-            md5_counter += 1
-            root2 = os.path.abspath(root).replace(path_to_remove, '')
-            try:
-                if root2[0] == '/':
-                    root2 = root2[1:]
-                if root2[0] == '\\':
-                    root2 = root2[1:]
-            except: IndexError
-            manifest_generator += md5[:32] + '  ' + os.path.join(root2, files).replace("\\", "/") + '\n'
-    manifest_list = manifest_generator.splitlines()
-    files_in_manifest = len(manifest_list)
-    # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[34:]))
-    with open(manifest_textfile, "wb") as fo:
-        for i in manifest_list:
-            fo.write(i + '\n')
+    manifest_entries = hashlib_manifest_entries(manifest_dir, path_to_remove, workers, cache)
+    return write_manifest(manifest_textfile, manifest_entries)
 
 
-def hashlib_append(manifest_dir, manifest_textfile, path_to_remove):
+def hashlib_append(manifest_dir, manifest_textfile, path_to_remove, workers=None, cache=None):
     '''
     Lazy rehash of hashlib_manifest, except this just adds files to an existing manifest.
     '''
-    file_count = 0
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if not f[0] == '.']
-        directories[:] = [d for d in directories if not d[0] == '.']
-        for files in filenames:
-            print "Calculating number of files to process in current directory -  %s files        \r"% file_count,
-            file_count += 1
-    manifest_generator = ''
+    manifest_entries = hashlib_manifest_entries(manifest_dir, path_to_remove, workers, cache)
+    return write_manifest(manifest_textfile, manifest_entries, 'ab')
+
+
+def scan_directory(directory):
+    '''
+    Yields (name, is_dir, size) tuples for the contents of a directory.
+    scandir is used where available, as it gets the file type from the
+    directory listing itself. Symlinks to directories are skipped,
+    just like os.walk does by default.
+    '''
+    if scandir is not None:
+        for entry in scandir(directory):
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    yield entry.name, True, 0
+            else:
+                yield entry.name, False, entry.stat().st_size
+    else:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                if not os.path.islink(path):
+                    yield name, True, 0
+            else:
+                yield name, False, os.path.getsize(path)
+
+
+def walk_files(source, skip_dirs=()):
+    '''
+    Walks source once and returns a list of (relative_path, size) tuples
+    for every file. Hidden files and folders are skipped, as are any folder
+    names in skip_dirs. As the whole list is built up front, the file count
+    and total size are known before any hashing starts.
+    '''
+    file_records = []
+    pending_dirs = ['']
+    while pending_dirs:
+        relative_dir = pending_dirs.pop()
+        for name, is_dir, size in scan_directory(os.path.join(source, relative_dir)):
+            if name[0] == '.':
+                continue
+            relative_path = os.path.join(relative_dir, name)
+            if is_dir:
+                if name not in skip_dirs:
+                    pending_dirs.append(relative_path)
+            else:
+                file_records.append((relative_path, size))
+    return file_records
+
+
+def manifest_root(manifest_dir, path_to_remove):
+    '''
+    Returns the portion of manifest_dir that will prefix every path in
+    a manifest, eg /a/b/c with path_to_remove /a will return b/c
+    '''
+    root2 = os.path.abspath(manifest_dir).replace(path_to_remove, '')
+    try:
+        if root2[0] == '/':
+            root2 = root2[1:]
+        if root2[0] == '\\':
+            root2 = root2[1:]
+    except: IndexError
+    return root2
+
+
+def hash_file_records(manifest_dir, file_records, path_to_remove, workers=None, cache=None):
+    '''
+    Hashes the output of walk_files and returns an unsorted list of
+    (manifest_path, md5) tuples.
+    '''
+    file_count = len(file_records)
+    total_size = sum(size for _, size in file_records)
+    print 'Generating MD5 checksums for %d files - %s bytes' % (file_count, total_size)
+    root2 = manifest_root(manifest_dir, path_to_remove)
+    relative_paths = {}
+    for relative_path, _ in file_records:
+        relative_paths[os.path.join(manifest_dir, relative_path)] = relative_path
+    manifest_entries = []
     md5_counter = 1
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if not f[0] == '.']
-        directories[:] = [d for d in directories if not d[0] == '.']
-        for files in filenames:
-            print 'Generating MD5 for %s - file %d of %d' % (os.path.join(root, files), md5_counter, file_count)
-            md5 = hashlib_md5(os.path.join(root, files))
-            md5_counter += 1
-            root2 = os.path.abspath(root).replace(path_to_remove, '')
-            try:
-                if root2[0] == '/':
-                    root2 = root2[1:]
-                if root2[0] == '\\':
-                    root2 = root2[1:]
-            except: IndexError
-            manifest_generator += md5[:32] + '  ' + os.path.join(root2, files).replace("\\", "/") + '\n'
-    manifest_list = manifest_generator.splitlines()
-    files_in_manifest = len(manifest_list)
+    for full_path, md5 in parallel_hash(
+            (os.path.join(manifest_dir, relative_path) for relative_path, _ in file_records),
+            workers, cache=cache
+        ):
+        print 'Generating MD5 for %s - file %d of %d' % (full_path, md5_counter, file_count)
+        md5_counter += 1
+        manifest_entries.append(
+            (os.path.join(root2, relative_paths[full_path]).replace("\\", "/"), md5)
+        )
+    return manifest_entries
+
+
+def hashlib_manifest_entries(manifest_dir, path_to_remove, workers=None, cache=None):
+    '''
+    Hashes every file in manifest_dir and returns a list of
+    (manifest_path, md5) tuples that use relative filepaths.
+    '''
+    file_records = walk_files(manifest_dir)
+    return hash_file_records(manifest_dir, file_records, path_to_remove, workers, cache)
+
+
+def write_manifest(manifest_textfile, manifest_entries, mode='wb'):
+    '''
+    Sorts a list of (manifest_path, checksum) tuples by path and writes
+    them to a manifest one line at a time. Returns the amount of entries.
+    '''
     # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[34:]))
-    with open(manifest_textfile, "ab") as fo:
-        for i in manifest_list:
-            fo.write(i + '\n')
+    manifest_entries.sort(key=lambda x: x[0])
+    with open(manifest_textfile, mode) as fo:
+        for path, checksum in manifest_entries:
+            fo.write(checksum + '  ' + path + '\n')
+    return len(manifest_entries)
+
+
+def hashlib_multi_manifest(manifest_dir, manifest_textfiles, path_to_remove, workers=None):
+    '''
+    Creates several manifests with relative filepaths from one read of
+    each file. manifest_textfiles is a dictionary of algorithm: filename,
+    eg {'md5': 'x_manifest.md5', 'sha512': 'x_manifest_sha512.txt'}
+    '''
+    file_records = walk_files(manifest_dir)
+    file_count = len(file_records)
+    root2 = manifest_root(manifest_dir, path_to_remove)
+    relative_paths = {}
+    for relative_path, _ in file_records:
+        relative_paths[os.path.join(manifest_dir, relative_path)] = relative_path
+    manifest_entries = dict((algorithm, []) for algorithm in manifest_textfiles)
+    counter = 1
+    for full_path, checksums in parallel_multi_hash(
+            (os.path.join(manifest_dir, relative_path) for relative_path, _ in file_records),
+            manifest_textfiles.keys(), workers
+        ):
+        print 'Generating %s for %s - file %d of %d' % (
+            '/'.join(sorted(checksums)), full_path, counter, file_count
+        )
+        counter += 1
+        manifest_path = os.path.join(root2, relative_paths[full_path]).replace("\\", "/")
+        for algorithm, checksum in checksums.iteritems():
+            manifest_entries[algorithm].append((manifest_path, checksum))
+    for algorithm, manifest_textfile in manifest_textfiles.iteritems():
+        write_manifest(manifest_textfile, manifest_entries[algorithm])
+    return file_count
+
+
+def read_manifest(manifest_textfile):
+    '''
+    Parses a checksum manifest into a dictionary of path: checksum.
+    Lines look like `checksum  path`. Windows line endings and
+    backslashes in paths are normalised, and blank lines are skipped.
+    '''
+    manifest_dict = {}
+    with open(manifest_textfile, 'rb') as fo:
+        for line in fo:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            checksum, _, path = line.partition(' ')
+            # md5sum uses a second space, or a * for binary mode.
+            if path[:1] in (' ', '*'):
+                path = path[1:]
+            manifest_dict[path.replace('\\', '/')] = checksum
+    return manifest_dict
+
+
+def compare_manifests(source_dict, destination_dict):
+    '''
+    Compares two path: checksum dictionaries from read_manifest.
+    Returns three sorted lists of paths:
+    missing - in source but not in destination
+    extra - in destination but not in source
+    mismatched - in both, but with different checksums
+    Each path is looked up once in a dictionary, so this takes linear time
+    rather than the quadratic time of searching lists.
+    '''
+    missing = []
+    mismatched = []
+    for path, checksum in source_dict.iteritems():
+        destination_checksum = destination_dict.get(path)
+        if destination_checksum is None:
+            missing.append(path)
+        elif destination_checksum != checksum:
+            mismatched.append(path)
+    extra = [path for path in destination_dict if path not in source_dict]
+    return sorted(missing), sorted(extra), sorted(mismatched)
 
 
 def make_manifest(manifest_dir, relative_manifest_path, manifest_textfile):
@@ -377,7 +1194,7 @@ def make_mediatrace(tracefilename, xmlvariable, inputfilename):
             '--output=XML',
             inputfilename
         ]
-        xmlvariable = subprocess.check_output(mediatrace_cmd)       #input filename
+        xmlvariable = subprocess.check_output(mediatrace_cmd, close_fds=CLOSE_FDS)       #input filename
         fo.write(xmlvariable)
 
 
@@ -421,6 +1238,15 @@ def append_csv(csv_file, *args):
         f.close()
 
 
+def append_csv_rows(csv_file, rows):
+    '''
+    Appends a batch of rows to a CSV with a single open of the file,
+    rather than reopening it for every row like append_csv.
+    '''
+    with open(csv_file, 'ab') as f:
+        csv.writer(f).writerows(rows)
+
+
 def make_desktop_manifest_dir():
     desktop_manifest_dir = os.path.expanduser("~/Desktop/moveit_manifests")
     if not os.path.isdir(desktop_manifest_dir):
@@ -439,24 +1265,125 @@ def make_desktop_logs_dir():
         os.makedirs(desktop_logs_dir)
     return desktop_logs_dir
 
+# Image sequence extensions, in order of preference if a folder has more than one.
+IMAGE_SEQUENCE_EXTENSIONS = ('dpx', 'tiff', 'tif')
+# prefix, frame number and extension of an image sequence filename.
+FRAME_REGEX = re.compile(r'^(.*?)(\d+)\.([^.]+)$')
+# descriptors from describe_image_sequence, keyed on directory.
+SEQUENCE_CACHE = {}
+
+
+def get_directory_mtime(directory):
+    '''
+    Returns the date modified of a directory in nanoseconds, which changes
+    whenever a file is added, removed or renamed in it.
+    '''
+    directory_stat = os.stat(directory)
+    mtime_ns = getattr(directory_stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(directory_stat.st_mtime * 1000000000)
+    return mtime_ns
+
+
+def describe_image_sequence(directory):
+    '''
+    Scans a directory once and returns a dictionary describing the image
+    sequence within it, or None if there isn't one. Keys are:
+    directory, prefix, padding, extension, first, last, frame_count,
+    total_bytes, gaps - a list of (start, end) ranges of missing frames,
+    frames and sizes - arrays of the frame numbers and sizes in bytes
+    in frame order, other_files - files that are not part of the sequence,
+    ffmpeg_pattern - the full path of the sequence for the image2 demuxer,
+    start_number - the first frame number, padded like the filenames.
+    If a directory has more than one sequence, the one with the most
+    frames is described.
+    Descriptors are cached until the directory's date modified changes,
+    so batch scripts can plan work without scanning the same folder twice.
+    Note that this means frames that are overwritten in place will
+    not update total_bytes.
+    '''
+    directory = os.path.abspath(directory)
+    mtime_ns = get_directory_mtime(directory)
+    cached = SEQUENCE_CACHE.get(directory)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    candidates = collections.defaultdict(list)
+    file_count = 0
+    for name, is_dir, size in scan_directory(directory):
+        if is_dir or name[0] == '.':
+            continue
+        file_count += 1
+        match = FRAME_REGEX.match(name)
+        if match is None:
+            continue
+        prefix, number, extension = match.groups()
+        if extension.lower() in IMAGE_SEQUENCE_EXTENSIONS:
+            candidates[(extension.lower(), prefix, extension)].append(
+                (int(number), size, len(number))
+            )
+    descriptor = None
+    if candidates:
+        # prefer dpx over tiff over tif, then the longest sequence.
+        key = min(
+            candidates, key=lambda candidate: (
+                IMAGE_SEQUENCE_EXTENSIONS.index(candidate[0]),
+                -len(candidates[candidate])
+            )
+        )
+        _, prefix, extension = key
+        frames = sorted(candidates[key])
+        padding = frames[0][2]
+        gaps = []
+        for (previous, _, _), (number, _, _) in zip(frames, frames[1:]):
+            if number > previous + 1:
+                gaps.append((previous + 1, number - 1))
+        descriptor = {
+            'directory': directory,
+            'prefix': prefix,
+            'padding': padding,
+            'extension': extension,
+            'first': frames[0][0],
+            'last': frames[-1][0],
+            'frame_count': len(frames),
+            'total_bytes': sum(frame[1] for frame in frames),
+            'gaps': gaps,
+            'frames': array.array('L', [frame[0] for frame in frames]),
+            'sizes': array.array('L', [frame[1] for frame in frames]),
+            'other_files': file_count - len(frames),
+            'ffmpeg_pattern': os.path.join(
+                directory, '%s%%0%dd.%s' % (prefix, padding, extension)
+            ),
+            'start_number': str(frames[0][0]).zfill(padding)
+        }
+    SEQUENCE_CACHE[directory] = (mtime_ns, descriptor)
+    return descriptor
+
+
+def get_sequence_filenames(descriptor):
+    '''
+    Returns the filenames of the frames in a sequence descriptor, in order.
+    '''
+    return [
+        '%s%s.%s' % (
+            descriptor['prefix'],
+            str(number).zfill(descriptor['padding']),
+            descriptor['extension']
+        ) for number in descriptor['frames']
+    ]
+
+
 def get_image_sequence_files(directory):
-    # This function accepts a directory as input, and checks returns a list of files in an image sequence.
-    os.chdir(directory)
-    tiff_check = glob('*.tiff')
-    dpx_check = glob('*.dpx')
-    tif_check = glob('*.tif')
-    if len(dpx_check) > 0:
-        images = dpx_check
-        images.sort()
-    elif len(tiff_check) > 0:
-        images = tiff_check
-        images.sort()
-    elif len(tif_check) > 0:
-        images = tif_check
-        images.sort()
-    else:
+    '''
+    Returns a sorted list of the files in the image sequence in directory,
+    or 'none' if there isn't one. The filenames are relative to directory,
+    but the current directory is not changed, so this is safe to use
+    from threads.
+    '''
+    descriptor = describe_image_sequence(directory)
+    if descriptor is None:
         return 'none'
-    return images
+    return get_sequence_filenames(descriptor)
+
 
 def get_ffmpeg_friendly_name(images):
     '''
@@ -728,23 +1655,19 @@ def get_contenttitletext(cpl):
     '''
     Returns the <ContentTitleText> element text from a DCP CPL.xml
     '''
-    cpl_parse = etree.parse(cpl)
-    cpl_namespace = cpl_parse.xpath('namespace-uri(.)')
-    contenttitletext = cpl_parse.findtext('//ns:ContentTitleText', namespaces={'ns': cpl_namespace})
-    return contenttitletext
+    return dcpmodel.read_cpl(cpl)['content_title_text']
 
 
 def find_cpl(source):
     '''
     Recursively searchs through all files in order to find a DCI DCP CPL XML.
+    Only the root element of each XML file is read.
     '''
     for root, _, filenames in os.walk(source):
         for filename in filenames:
             if filename.endswith('.xml'):
                 if filename[0] != '.':
-                    cpl_parse = etree.parse(os.path.join(root, filename))
-                    cpl_namespace = cpl_parse.xpath('namespace-uri(.)')
-                    if 'CPL' in cpl_namespace:
+                    if dcpmodel.get_xml_type(os.path.join(root, filename)) == 'CPL':
                         return os.path.join(root, filename)
 
 def ask_yes_no(question):
@@ -856,8 +1779,16 @@ def checksum_replace(manifest, logname):
 
 def img_seq_pixfmt(start_number, path):
     '''
-    Determine the pixel format of an image sequence
+    Determine the pixel format of an image sequence.
+    The header of the first frame is read directly if it is a DPX or TIFF
+    that imageheader.py understands, otherwise ffprobe is used.
     '''
+    try:
+        header = imageheader.read_header(path % int(start_number))
+    except (TypeError, ValueError, IOError):
+        header = None
+    if header is not None and header['pix_fmt'] is not None:
+        return header['pix_fmt']
     ffprobe_cmd = [
         'ffprobe',
         '-start_number', start_number,
@@ -868,7 +1799,7 @@ def img_seq_pixfmt(start_number, path):
         'stream=pix_fmt',
         '-of', 'default=noprint_wrappers=1:nokey=1'
     ]
-    pix_fmt = subprocess.check_output(ffprobe_cmd).rstrip()
+    pix_fmt = subprocess.check_output(ffprobe_cmd, close_fds=CLOSE_FDS).rstrip()
     return pix_fmt
 
 
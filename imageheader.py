@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+'''
+Reads the headers of DPX and TIFF images without launching ffprobe or
+mediainfo. Returns dimensions, bit depth, packing, endianness,
+colorimetry and, for DPX, timecode.
+Files are memory mapped, so only the pages that hold the header are read
+from disk, no matter how large the image is.
+Usage: imageheader.py image.dpx or imageheader.py sequence_directory
+'''
+import os
+import sys
+import mmap
+import math
+import struct
+import argparse
+
+# SMPTE 268M image element descriptors, with the amount of components.
+DPX_DESCRIPTORS = {
+    1: ('R', 1), 2: ('G', 1), 3: ('B', 1), 4: ('A', 1), 6: ('Y', 1),
+    7: ('CbCr', 1), 8: ('Z', 1), 9: ('Composite', 1),
+    50: ('RGB', 3), 51: ('RGBA', 4), 52: ('ABGR', 4),
+    100: ('CbYCrY', 2), 101: ('CbYACrYA', 3), 102: ('CbYCr', 3),
+    103: ('CbYCrA', 4)
+}
+# SMPTE 268M transfer characteristic and colorimetric specification codes.
+DPX_CHARACTERISTICS = {
+    0: 'User defined', 1: 'Printing density', 2: 'Linear',
+    3: 'Logarithmic', 4: 'Unspecified video', 5: 'SMPTE 274M',
+    6: 'ITU-R 709-4', 7: 'ITU-R 601-5 system B or G',
+    8: 'ITU-R 601-5 system M', 9: 'NTSC composite video',
+    10: 'PAL composite video', 11: 'Z linear', 12: 'Z homogeneous'
+}
+DPX_PACKING = {0: 'packed', 1: 'filled method A', 2: 'filled method B'}
+TIFF_PHOTOMETRIC = {
+    0: 'WhiteIsZero', 1: 'BlackIsZero', 2: 'RGB', 3: 'Palette',
+    4: 'Transparency mask', 5: 'CMYK', 6: 'YCbCr', 8: 'CIELab'
+}
+TIFF_COMPRESSION = {
+    1: 'none', 2: 'CCITT RLE', 5: 'LZW', 7: 'JPEG', 8: 'Deflate',
+    32773: 'PackBits', 32946: 'Deflate'
+}
+# TIFF field types that can hold the tags that are read, with struct formats.
+TIFF_TYPES = {1: 'B', 3: 'H', 4: 'I'}
+# Keys that should match across every frame of a sequence.
+CONSISTENT_KEYS = (
+    'format', 'endianness', 'width', 'height', 'bit_depth', 'descriptor',
+    'packing', 'compression', 'transfer', 'colorimetry'
+)
+# ffmpeg decoder pixel formats, keyed on (descriptor, bit depth). 16 bit
+# formats follow the endianness of the file and 10/12 bit planar formats
+# follow the endianness of the machine, so the suffix is added later.
+DPX_PIX_FMTS = {
+    ('Y', 8): 'gray', ('Y', 10): 'gray10', ('Y', 12): 'gray12',
+    ('Y', 16): 'gray16',
+    ('RGB', 8): 'rgb24', ('RGB', 10): 'gbrp10', ('RGB', 12): 'gbrp12',
+    ('RGB', 16): 'rgb48',
+    ('RGBA', 8): 'rgba', ('RGBA', 10): 'gbrap10', ('RGBA', 12): 'gbrap12',
+    ('RGBA', 16): 'rgba64',
+    ('ABGR', 8): 'abgr', ('CbYCrY', 8): 'uyvy422'
+}
+# Keyed on (planar, bits per sample, samples per pixel).
+TIFF_PIX_FMTS = {
+    (False, 8, 1): 'gray', (False, 16, 1): 'gray16',
+    (False, 8, 3): 'rgb24', (False, 16, 3): 'rgb48',
+    (False, 8, 4): 'rgba', (False, 16, 4): 'rgba64',
+    (True, 8, 3): 'gbrp', (True, 16, 3): 'gbrp16',
+    (True, 8, 4): 'gbrap', (True, 16, 4): 'gbrap16'
+}
+
+
+def get_endian_suffix(endianness):
+    '''
+    Returns the ffmpeg pixel format suffix for 'big' or 'little' endianness.
+    '''
+    if endianness == 'big':
+        return 'be'
+    return 'le'
+
+
+def read_dpx_header(mapped):
+    '''
+    Returns a header dictionary from a memory mapped DPX file.
+    Fields that are undefined in the file are set to None.
+    '''
+    if mapped[:4] == 'SDPX':
+        endian = '>'
+        endianness = 'big'
+    else:
+        endian = '<'
+        endianness = 'little'
+    (width, height) = struct.unpack_from(endian + 'II', mapped, 772)
+    (descriptor_code, transfer, colorimetric, bit_depth,
+     packing, encoding) = struct.unpack_from(endian + 'BBBBHH', mapped, 800)
+    descriptor, components = DPX_DESCRIPTORS.get(
+        descriptor_code, (None, None)
+    )
+    timecode = None
+    frame_rate = None
+    if len(mapped) >= 1944:
+        (timecode_bcd,) = struct.unpack_from(endian + 'I', mapped, 1920)
+        if timecode_bcd != 0xFFFFFFFF:
+            # each pair of digits is binary coded decimal, so it prints as hex.
+            timecode = '%02x:%02x:%02x:%02x' % struct.unpack(
+                '>BBBB', struct.pack('>I', timecode_bcd)
+            )
+        # The television frame rate, or failing that the film frame rate.
+        for offset in (1940, 1724):
+            (rate,) = struct.unpack_from(endian + 'f', mapped, offset)
+            if not math.isnan(rate) and rate > 0:
+                frame_rate = rate
+                break
+    return {
+        'format': 'dpx',
+        'endianness': endianness,
+        'width': width,
+        'height': height,
+        'bit_depth': bit_depth,
+        'components': components,
+        'descriptor': descriptor,
+        'packing': DPX_PACKING.get(packing),
+        'compression': 'RLE' if encoding == 1 else 'none',
+        'transfer': DPX_CHARACTERISTICS.get(transfer),
+        'colorimetry': DPX_CHARACTERISTICS.get(colorimetric),
+        'timecode': timecode,
+        'frame_rate': frame_rate
+    }
+
+
+def read_tiff_values(mapped, endian, entry_offset):
+    '''
+    Returns the values of the TIFF directory entry at entry_offset as a
+    tuple, or None if it is not a byte, short or long field.
+    '''
+    field_type, count = struct.unpack_from(endian + 'HI', mapped, entry_offset + 2)
+    value_format = TIFF_TYPES.get(field_type)
+    if value_format is None:
+        return None
+    value_format = endian + value_format * count
+    if struct.calcsize(value_format) <= 4:
+        value_offset = entry_offset + 8
+    else:
+        (value_offset,) = struct.unpack_from(endian + 'I', mapped, entry_offset + 8)
+    return struct.unpack_from(value_format, mapped, value_offset)
+
+
+def read_tiff_header(mapped):
+    '''
+    Returns a header dictionary from a memory mapped TIFF file.
+    Only the first image in the file is read.
+    '''
+    if mapped[:2] == 'MM':
+        endian = '>'
+        endianness = 'big'
+    else:
+        endian = '<'
+        endianness = 'little'
+    (ifd_offset,) = struct.unpack_from(endian + 'I', mapped, 4)
+    (entry_count,) = struct.unpack_from(endian + 'H', mapped, ifd_offset)
+    tags = {}
+    for entry in range(entry_count):
+        entry_offset = ifd_offset + 2 + entry * 12
+        (tag,) = struct.unpack_from(endian + 'H', mapped, entry_offset)
+        if tag in (256, 257, 258, 259, 262, 277, 284):
+            tags[tag] = read_tiff_values(mapped, endian, entry_offset)
+    samples = tags.get(277, (1,))[0]
+    bit_depth = tags.get(258, (1,))[0]
+    planar = tags.get(284, (1,))[0] == 2
+    photometric = tags.get(262, (None,))[0]
+    return {
+        'format': 'tiff',
+        'endianness': endianness,
+        'width': tags.get(256, (None,))[0],
+        'height': tags.get(257, (None,))[0],
+        'bit_depth': bit_depth,
+        'components': samples,
+        'descriptor': TIFF_PHOTOMETRIC.get(photometric),
+        'packing': 'planar' if planar else 'chunky',
+        'compression': TIFF_COMPRESSION.get(tags.get(259, (1,))[0]),
+        'transfer': None,
+        'colorimetry': None,
+        'timecode': None,
+        'frame_rate': None
+    }
+
+
+def get_pix_fmt(header):
+    '''
+    Returns the pixel format that ffmpeg decodes an image to, or None if
+    the format isn't known, in which case ffprobe should be asked instead.
+    '''
+    if header['format'] == 'dpx':
+        if header['compression'] != 'none':
+            return None
+        pix_fmt = DPX_PIX_FMTS.get((header['descriptor'], header['bit_depth']))
+        if pix_fmt is None:
+            return None
+        if header['bit_depth'] == 16:
+            return pix_fmt + get_endian_suffix(header['endianness'])
+        if header['bit_depth'] in (10, 12):
+            return pix_fmt + get_endian_suffix(sys.byteorder)
+        return pix_fmt
+    if header['descriptor'] not in ('BlackIsZero', 'RGB'):
+        return None
+    if header['compression'] not in ('none', 'LZW', 'Deflate', 'PackBits'):
+        return None
+    pix_fmt = TIFF_PIX_FMTS.get((
+        header['packing'] == 'planar', header['bit_depth'], header['components']
+    ))
+    if pix_fmt is None:
+        return None
+    if header['bit_depth'] == 16:
+        return pix_fmt + get_endian_suffix(header['endianness'])
+    return pix_fmt
+
+
+def read_header(filename):
+    '''
+    Returns a dictionary describing a DPX or TIFF image, or None if the
+    file is neither. Keys are:
+    format - 'dpx' or 'tiff'
+    endianness - 'big' or 'little'
+    width, height, bit_depth - bit depth is per component
+    components - amount of components per pixel
+    descriptor - eg 'RGB' for DPX, or the TIFF photometric interpretation
+    packing - DPX packing method, or 'chunky' or 'planar' for TIFF
+    compression - 'none' for uncompressed images
+    transfer, colorimetry - DPX transfer characteristic and colorimetric
+    specification, eg 'Printing density'
+    timecode - DPX television timecode as hh:mm:ss:ff
+    frame_rate - DPX television or film frame rate
+    pix_fmt - the ffmpeg pixel format, see get_pix_fmt
+    '''
+    with open(filename, 'rb') as fo:
+        try:
+            mapped = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # empty files can't be mapped.
+            return None
+        try:
+            magic = mapped[:4]
+            if magic in ('SDPX', 'XPDS') and len(mapped) >= 808:
+                header = read_dpx_header(mapped)
+            elif magic in ('II*\x00', 'MM\x00*') and len(mapped) >= 8:
+                header = read_tiff_header(mapped)
+            else:
+                return None
+        except struct.error:
+            # the file is too short for the offsets in its header.
+            return None
+        finally:
+            mapped.close()
+    header['pix_fmt'] = get_pix_fmt(header)
+    return header
+
+
+def sample_headers(sampled):
+    '''
+    Reads the headers of a list of frames. Returns a tuple of the first
+    frame's header and a list of (filename, key, value) for any other
+    frame that differs from it.
+    '''
+    first_header = read_header(sampled[0])
+    differences = []
+    for filename in sampled[1:]:
+        header = read_header(filename)
+        if header is None or first_header is None:
+            if header is not None or first_header is not None:
+                differences.append((filename, 'format', header and header['format']))
+            continue
+        for key in CONSISTENT_KEYS:
+            if header[key] != first_header[key]:
+                differences.append((filename, key, header[key]))
+    return first_header, differences
+
+
+def sample_sequence(descriptor, samples=5):
+    '''
+    Runs sample_headers on up to samples frames, spread evenly from the
+    first to the last frame of a descriptor from
+    ififuncs.describe_image_sequence. Only the sampled filenames are
+    made, so this is quick even for very long sequences.
+    '''
+    frames = descriptor['frames']
+    indexes = sorted(set(
+        (len(frames) - 1) * sample // max(1, samples - 1)
+        for sample in range(max(1, samples))
+    ))
+    sampled = [
+        os.path.join(descriptor['directory'], '%s%s.%s' % (
+            descriptor['prefix'],
+            str(frames[index]).zfill(descriptor['padding']),
+            descriptor['extension']
+        )) for index in indexes
+    ]
+    return sample_headers(sampled)
+
+
+def describe(header):
+    '''
+    Returns a one line summary of a header for logs and the terminal.
+    TIFFs without a width, height or bit depth tag have None for it.
+    '''
+    description = '%s %sx%s %s %s bit %s-endian' % (
+        header['format'].upper(), header['width'], header['height'],
+        header['descriptor'], header['bit_depth'], header['endianness']
+    )
+    for key in ('packing', 'compression', 'transfer', 'colorimetry',
+                'timecode', 'frame_rate', 'pix_fmt'):
+        if header[key] is not None:
+            description += ' - %s: %s' % (key.replace('_', ' '), header[key])
+    return description
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Prints the header information of a DPX or TIFF image,'
+        ' or of an image sequence, without using ffprobe or mediainfo.'
+        ' Written by Kieran O\'Leary.'
+    )
+    parser.add_argument(
+        'input', help='full path of an image or an image sequence directory'
+    )
+    parser.add_argument(
+        '-samples',
+        type=int, default=5,
+        help='For a sequence, the number of frames to check for'
+        ' consistency with the first frame. Defaults to 5'
+    )
+    return parser
+
+
+def main(args_):
+    '''
+    Prints the header of an image, or of the first frame of a sequence
+    along with any sampled frames that differ from it.
+    '''
+    args = make_parser().parse_args(args_)
+    if os.path.isdir(args.input):
+        # ififuncs imports this module, so it is only imported when needed.
+        from ififuncs import describe_image_sequence
+        descriptor = describe_image_sequence(args.input)
+        if descriptor is None:
+            print 'No image sequence found in %s' % args.input
+            sys.exit(1)
+        header, differences = sample_sequence(descriptor, args.samples)
+        for filename, key, value in differences:
+            print 'WARNING - %s has a different %s: %s' % (filename, key, value)
+    else:
+        header = read_header(args.input)
+    if header is None:
+        print 'Not a DPX or TIFF image'
+        sys.exit(1)
+    print describe(header)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -14,9 +14,13 @@ from ififuncs import create_csv
 from ififuncs import append_csv
 from ififuncs import send_gmail
 from ififuncs import hashlib_manifest
-from ififuncs import diff_textfiles
+from framemd5 import compare_framemd5, describe
+import seqcheck
+import imageheader
+from ififuncs import describe_image_sequence
 from ififuncs import make_manifest
 from ififuncs import generate_log
+from ififuncs import close_log
 from ififuncs import make_desktop_logs_dir
 from premis import make_premis
 from premis import write_premis
@@ -137,6 +141,9 @@ parser.add_argument(
 parser.add_argument(
                     '-o',
                     help='full path of output directory', required=True)
+parser.add_argument(
+                    '-force', action='store_true',
+                    help='Transcode sequences even if seqcheck.py finds missing, duplicate, empty or wrongly sized frames')
 args = parser.parse_args()
 print args
 desktop_logs_dir = make_desktop_logs_dir()
@@ -187,6 +194,21 @@ for source_directory in all_files:
             general_log = root_dir + '/logs/image/%s_image_log.log' % os.path.basename(root_dir)
             generate_log(general_log, 'Input = %s' % root)
             remove_bad_files(source_directory)
+            report = seqcheck.check_directory(source_directory)
+            descriptor = describe_image_sequence(source_directory)
+            if descriptor is not None:
+                header, differences = imageheader.sample_sequence(descriptor)
+                if header is not None:
+                    generate_log(general_log, 'Source image header:  %s' % imageheader.describe(header))
+                for filename, key, value in differences:
+                    generate_log(general_log, 'WARNING - %s has a different %s: %s' % (filename, key, value))
+            if report is not None and not report['ok']:
+                print '%s - %s' % (source_directory, seqcheck.describe(report))
+                generate_log(general_log, 'Pre-flight check of image sequence:  %s' % seqcheck.describe(report))
+                if not args.force:
+                    append_csv(csv_report_filename, (source_directory, 'SKIPPED - %s' % seqcheck.describe(report), 'n/a', 'n/a'))
+                    close_log(general_log)
+                    continue
             source_parent_dir           = os.path.dirname(source_directory)
             normpath                    = os.path.normpath(source_directory)
             relative_path               = normpath.split(os.sep)[-1]
@@ -216,8 +238,11 @@ for source_directory in all_files:
             generate_log(general_log, 'Generating destination manifest via md5deep and storing as  %s' % manifest_textfile)
             other = make_framemd5(output_dirname + '/image/dpx_files', 'dpx', 'dpx_framemd5')
             other_textfile = other[1]
-            judgement = diff_textfiles(source_textfile, other_textfile)
-            generate_log(general_log, 'Outcome of transcode was:  %s' % judgement)
+            verdict = compare_framemd5(source_textfile, other_textfile)
+            judgement = verdict['judgement']
+            print describe(verdict)
+            generate_log(general_log, 'Outcome of transcode was:  %s' % describe(verdict))
+            close_log(general_log)
             make_manifest(output_parent_directory, os.path.basename(output_dirname), manifest_textfile)
             source_metadata_dir = root_dir + '/metadata/image'
             shutil.copy(source_textfile, source_metadata_dir + '/%s' % os.path.basename(source_textfile))
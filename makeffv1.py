@@ -5,23 +5,28 @@
 
 import subprocess
 import sys
-import filecmp
 import os
 import shutil
 import csv
 import time
-import itertools
 import getpass
+import argparse
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from glob import glob
+from framemd5 import compare_framemd5, describe
+from mediaprobe import probe, probe_files
 try:
     from ififuncs import set_environment
     from ififuncs import hashlib_manifest
     from ififuncs import make_mediatrace
     from ififuncs import make_mediainfo
-    from ififuncs import get_mediainfo
     from ififuncs import append_csv
     from ififuncs import create_csv
     from ififuncs import generate_log
+    from ififuncs import close_log
+    from ififuncs import CLOSE_FDS
 except ImportError:
     print '*** ERROR - IFIFUNCS IS MISSING - *** \n'
     'Makeffv1 requires that ififuncs.py is located in the same directory'
@@ -29,14 +34,12 @@ except ImportError:
     'https://github.com/kieranjol/IFIscripts/blob/master/ififuncs.py'
     sys.exit()
 
-def read_non_comment_lines(infile):
-    # Adapted from Andrew Dalke - http://stackoverflow.com/a/8304087/2188572
-    for lineno, line in enumerate(infile):
-        #if line[:1] != "#":
-        yield lineno, line
+# Each FFV1 encode is split into this many slices, which ffmpeg encodes in
+# parallel, so this is roughly how many cores each encode keeps busy.
+FFV1_SLICES = 16
 
-def get_input():
-    if len(sys.argv) < 2:
+def get_input(input=None):
+    if input is None and len(sys.argv) < 2:
         print 'IFI FFV1.MKV SCRIPT'
         print 'USAGE: PYTHON makeffv1.py FILENAME'
         print 'OR'
@@ -46,7 +49,8 @@ def get_input():
         sys.exit()
     else:
         # Input, either file or firectory, that we want to process.
-        input = sys.argv[1]
+        if input is None:
+            input = sys.argv[1]
         # Store the directory containing the input file/directory.
         wd = os.path.dirname(input)
         # Change current working directory to the value stored as "wd"
@@ -79,12 +83,12 @@ def get_input():
             print "Your input isn't a file or a directory."
             print "What was it? I'm curious."
         # temporary hack to stop makeffv1 from processing DV
+        # All files are probed with one mediainfo process, and the records
+        # are cached for make_ffv1.
         dv_test = []
+        probes = probe_files(video_files)
         for test_files in video_files:
-            codec =  get_mediainfo(
-                'codec', '--inform=Video;%Codec%',
-                 test_files
-                 ).rstrip()
+            codec = probes[test_files]['codec'].rstrip()
             if codec == 'DV':
                 dv_test.append(test_files)
                 print 'DV file found, skipping'
@@ -100,194 +104,240 @@ def get_input():
                 )
             )
         return video_files, csv_report_filename
-def make_ffv1(video_files, csv_report_filename):
-    for filename in video_files: #loop all files in directory
-        filenoext = os.path.splitext(filename)[0]
-        # Generate new directory names
-        metadata_dir = "%s/metadata" % filenoext
-        log_dir = "%s/logs" % filenoext
-        data_dir = "%s/objects" % filenoext
-        # Actually create the directories.
-        os.makedirs(metadata_dir)
-        os.makedirs(data_dir)
-        os.makedirs(log_dir)
-        #Generate filenames for new files.
-        inputxml = "%s/%s_source_mediainfo.xml" % (
-            metadata_dir, os.path.basename(filename)
-            )
-        inputtracexml = "%s/%s_source_mediatrace.xml" % (
-            metadata_dir, os.path.basename(filename)
-            )
-        output = "%s/%s.mkv" % (
-            data_dir, os.path.splitext(os.path.basename(filename))[0]
-            )
-        # Generate filename of ffv1.mkv without the path.
-        outputfilename = os.path.basename(output)
-        outputxml = "%s/%s_mediainfo.xml" % (metadata_dir, outputfilename)
-        outputtracexml = "%s/%s_mediatrace.xml" % (metadata_dir, outputfilename)
-        fmd5 = "%s/%s_source.framemd5" % (
-            metadata_dir, os.path.basename(filename)
-            )
-        fmd5ffv1 = "%s/%s_ffv1.framemd5" % (metadata_dir, outputfilename)
-        log = "%s/%s_log.log" %  (log_dir, filename)
-        generate_log(log, 'Input = %s' % filename)
-        generate_log(log, 'Output = %s' % output)
-        generate_log(
-            log, 'makeffv1.py transcode to FFV1 and framemd5 generation of source started.'
-            )
-        ffv1_logfile = log_dir + '/%s_ffv1_transcode.log' % filename
-        ffv1_env_dict = set_environment(ffv1_logfile)
-        par = subprocess.check_output(
-            [
-                'mediainfo', '--Language=raw', '--Full',
-                "--Inform=Video;%PixelAspectRatio%", filename
-            ]
-            ).rstrip()
-        field_order = subprocess.check_output(
-            [
-                'mediainfo', '--Language=raw',
-                '--Full', "--Inform=Video;%ScanType%", filename
-            ]
-            ).rstrip()
-        height = subprocess.check_output(
-            [
-                'mediainfo', '--Language=raw',
-                '--Full', "--Inform=Video;%Height%",
-                filename
-            ]
-            ).rstrip()
-        # Transcode video file writing frame md5 and output appropriately
-        ffv1_command = [
-            'ffmpeg',
-            '-i', filename,
-            '-c:v', 'ffv1',        # Use FFv1 codec
-            '-g', '1',              # Use intra-frame only aka ALL-I aka GOP=1
-            '-level', '3',          # Use Version 3 of FFv1
-            '-c:a', 'copy',         # Copy and paste audio bitsream with no transcoding
-            '-map', '0',
-            '-dn',
-            '-report',
-            '-slicecrc', '1',
-            '-slices', '16',
-            ]
-        # check for FCP7 lack of description and PAL
-        if par == '1.000':
-            if field_order == '':
-                if height == '576':
-                    ffv1_command += [
-                        '-vf',
-                        'setfield=tff, setdar=4/3'
-                        ]
-        ffv1_command += [
-            output,
-            '-f', 'framemd5', '-an',  # Create decoded md5 checksums for every frame of the input. -an ignores audio
-            fmd5
-            ]
-        print ffv1_command
-        subprocess.call(ffv1_command, env=ffv1_env_dict)
-        generate_log(
-            log, 'makeffv1.py transcode to FFV1 and framemd5 generation completed.'
-            )
-        generate_log(
-            log, 'makeffv1.py Framemd5 generation of output file started.'
-            )
-        fmd5_logfile = log_dir + '/%s_framemd5.log' % outputfilename
-        fmd5_env_dict = set_environment(fmd5_logfile)
-        fmd5_command = [
-            'ffmpeg',    # Create decoded md5 checksums for every frame
-            '-i', output,
-            '-report',
-            '-f', 'framemd5', '-an',
-            fmd5ffv1
-            ]
-        print fmd5_command
-        subprocess.call(fmd5_command, env=fmd5_env_dict)
+def get_encode_workers(jobs=None):
+    '''
+    Returns the number of files to encode at once. Each encode already
+    uses FFV1_SLICES threads, so by default this is the number of CPU
+    cores divided by FFV1_SLICES.
+    '''
+    if jobs is None:
+        try:
+            jobs = multiprocessing.cpu_count() // FFV1_SLICES
+        except NotImplementedError:
+            jobs = 1
+    return max(1, jobs)
+
+
+def encode_ffv1(filename):
+    '''
+    Creates the SIP folders for filename, transcodes it to FFV1 while
+    writing a framemd5 of the source, and then writes a framemd5 of the
+    FFV1 file. Returns a dictionary of paths for finish_ffv1.
+    '''
+    filenoext = os.path.splitext(filename)[0]
+    # Generate new directory names
+    metadata_dir = "%s/metadata" % filenoext
+    log_dir = "%s/logs" % filenoext
+    data_dir = "%s/objects" % filenoext
+    # Actually create the directories.
+    os.makedirs(metadata_dir)
+    os.makedirs(data_dir)
+    os.makedirs(log_dir)
+    output = "%s/%s.mkv" % (
+        data_dir, os.path.splitext(os.path.basename(filename))[0]
+        )
+    # Generate filename of ffv1.mkv without the path.
+    outputfilename = os.path.basename(output)
+    fmd5 = "%s/%s_source.framemd5" % (
+        metadata_dir, os.path.basename(filename)
+        )
+    fmd5ffv1 = "%s/%s_ffv1.framemd5" % (metadata_dir, outputfilename)
+    log = "%s/%s_log.log" %  (log_dir, filename)
+    generate_log(log, 'Input = %s' % filename)
+    generate_log(log, 'Output = %s' % output)
+    generate_log(
+        log, 'makeffv1.py transcode to FFV1 and framemd5 generation of source started.'
+        )
+    ffv1_logfile = log_dir + '/%s_ffv1_transcode.log' % filename
+    ffv1_env_dict = set_environment(ffv1_logfile)
+    source_probe = probe(filename)
+    par = source_probe['par']
+    field_order = source_probe['scan_type'].rstrip()
+    height = source_probe['height']
+    # Transcode video file writing frame md5 and output appropriately
+    ffv1_command = [
+        'ffmpeg',
+        '-i', filename,
+        '-c:v', 'ffv1',        # Use FFv1 codec
+        '-g', '1',              # Use intra-frame only aka ALL-I aka GOP=1
+        '-level', '3',          # Use Version 3 of FFv1
+        '-c:a', 'copy',         # Copy and paste audio bitsream with no transcoding
+        '-map', '0',
+        '-dn',
+        '-report',
+        '-slicecrc', '1',
+        '-slices', str(FFV1_SLICES),
+        ]
+    # check for FCP7 lack of description and PAL
+    if par == 1.0:
+        if field_order == '':
+            if height == 576:
+                ffv1_command += [
+                    '-vf',
+                    'setfield=tff, setdar=4/3'
+                    ]
+    ffv1_command += [
+        output,
+        '-f', 'framemd5', '-an',  # Create decoded md5 checksums for every frame of the input. -an ignores audio
+        fmd5
+        ]
+    print ffv1_command
+    subprocess.call(ffv1_command, env=ffv1_env_dict, close_fds=CLOSE_FDS)
+    generate_log(
+        log, 'makeffv1.py transcode to FFV1 and framemd5 generation completed.'
+        )
+    generate_log(
+        log, 'makeffv1.py Framemd5 generation of output file started.'
+        )
+    fmd5_logfile = log_dir + '/%s_framemd5.log' % outputfilename
+    fmd5_env_dict = set_environment(fmd5_logfile)
+    fmd5_command = [
+        'ffmpeg',    # Create decoded md5 checksums for every frame
+        '-i', output,
+        '-report',
+        '-f', 'framemd5', '-an',
+        fmd5ffv1
+        ]
+    print fmd5_command
+    subprocess.call(fmd5_command, env=fmd5_env_dict, close_fds=CLOSE_FDS)
+    generate_log(
+        log,
+        'makeffv1.py Framemd5 generation of output file completed'
+        )
+    return {
+        'filename': filename,
+        'filenoext': filenoext,
+        'metadata_dir': metadata_dir,
+        'log_dir': log_dir,
+        'output': output,
+        'fmd5': fmd5,
+        'fmd5ffv1': fmd5ffv1,
+        'log': log,
+        'source_video_size': source_probe['file_size']
+    }
+
+
+def finish_ffv1(job):
+    '''
+    Runs everything that happens after an encode - mediainfo and
+    mediatrace XMLs, the framemd5 comparison and the MD5 manifest.
+    Returns the row for the CSV report.
+    '''
+    filename = job['filename']
+    output = job['output']
+    log = job['log']
+    metadata_dir = job['metadata_dir']
+    #Generate filenames for new files.
+    inputxml = "%s/%s_source_mediainfo.xml" % (
+        metadata_dir, os.path.basename(filename)
+        )
+    inputtracexml = "%s/%s_source_mediatrace.xml" % (
+        metadata_dir, os.path.basename(filename)
+        )
+    outputfilename = os.path.basename(output)
+    outputxml = "%s/%s_mediainfo.xml" % (metadata_dir, outputfilename)
+    outputtracexml = "%s/%s_mediatrace.xml" % (metadata_dir, outputfilename)
+    source_video_size = job['source_video_size']
+    ffv1_video_size = probe(output)['file_size']
+    compression_ratio = float(source_video_size) / float(ffv1_video_size)
+    if os.path.basename(sys.argv[0]) == 'makeffv1.py':
+        shutil.copy(sys.argv[0], job['log_dir'])
+    print 'Generating mediainfo xml of input file and saving it in %s' % inputxml
+    make_mediainfo(inputxml, 'mediaxmlinput', filename)
+    print 'Generating mediainfo xml of output file and saving it in %s' % outputxml
+    make_mediainfo(outputxml, 'mediaxmloutput', output)
+    print 'Generating mediatrace xml of input file and saving it in %s' % inputtracexml
+    make_mediatrace(inputtracexml, 'mediatracexmlinput', filename)
+    print 'Generating mediatrace xml of output file and saving it in %s' % outputtracexml
+    make_mediatrace(outputtracexml, 'mediatracexmloutput', output)
+    source_parent_dir = os.path.dirname(os.path.abspath(filename))
+    manifest = '%s/%s_manifest.md5' % (source_parent_dir, job['filenoext'])
+    generate_log(log, 'makeffv1.py MD5 manifest started')
+    verdict = compare_framemd5(job['fmd5'], job['fmd5ffv1'])
+    sar_altered = [
+        name for name in verdict['header_differences'] if name.startswith('sar')
+    ]
+    if verdict['judgement'] == 'lossless' and not sar_altered:
+        print 'LOSSLESS'
+        judgement = 'LOSSLESS'
+        generate_log(log, 'makeffv1.py Transcode was lossless')
+    elif verdict['judgement'] == 'lossless':
+        print 'Image content is lossless,'
+        ' Pixel Aspect Ratio has been altered.'
+        ' Update ffmpeg in order to resolve the PAR issue.'
+        judgement = 'LOSSLESS - different PAR'
         generate_log(
             log,
-            'makeffv1.py Framemd5 generation of output file completed'
-            )
-        source_video_size = get_mediainfo(
-            'source_video_size', "--inform=General;%FileSize%", filename
-            )
-        ffv1_video_size = get_mediainfo(
-            'ffv1_video_size', '--inform=General;%FileSize%', output
+            'makeffv1.py Image content is lossless but Pixel Aspect Ratio has been altered.Update ffmpeg in order to resolve the PAR issue.'
             )
-        compression_ratio = float(source_video_size) / float(ffv1_video_size)
-        if os.path.basename(sys.argv[0]) == 'makeffv1.py':
-            shutil.copy(sys.argv[0], log_dir)
-        print 'Generating mediainfo xml of input file and saving it in %s' % inputxml
-        make_mediainfo(inputxml, 'mediaxmlinput', filename)
-        print 'Generating mediainfo xml of output file and saving it in %s' % outputxml
-        make_mediainfo(outputxml, 'mediaxmloutput', output)
-        print 'Generating mediatrace xml of input file and saving it in %s' % inputtracexml
-        make_mediatrace(inputtracexml, 'mediatracexmlinput', filename)
-        print 'Generating mediatrace xml of output file and saving it in %s' % outputtracexml
-        make_mediatrace(outputtracexml, 'mediatracexmloutput', output)
-        source_parent_dir = os.path.dirname(os.path.abspath(filename))
-        manifest = '%s/%s_manifest.md5' % (source_parent_dir, filenoext)
-        generate_log(log, 'makeffv1.py MD5 manifest started')
-        checksum_mismatches = []
-        with open(fmd5) as f1:
-            with open(fmd5ffv1) as f2:
-                for (lineno1, line1), (lineno2, line2) in itertools.izip(
-                        read_non_comment_lines(f1),
-                        read_non_comment_lines(f2)
-                        ):
-                    if line1 != line2:
-                        if 'sar' in line1:
-                            checksum_mismatches = ['sar']
-                        else:
-                            checksum_mismatches.append(1)
-        if len(checksum_mismatches) == 0:
-            print 'LOSSLESS'
-            append_csv(
-                csv_report_filename, (
-                    output,
-                    'LOSSLESS', source_video_size,
-                    ffv1_video_size, compression_ratio
-                    )
-                )
-            generate_log(log, 'makeffv1.py Transcode was lossless')
-        elif len(checksum_mismatches) == 1:
-            if checksum_mismatches[0] == 'sar':
-                print 'Image content is lossless,'
-                ' Pixel Aspect Ratio has been altered.'
-                ' Update ffmpeg in order to resolve the PAR issue.'
-                append_csv(
-                    csv_report_filename,
-                    (
-                        output,
-                        'LOSSLESS - different PAR',
-                        source_video_size, ffv1_video_size, compression_ratio
-                        )
-                    )
-                generate_log(
-                    log,
-                    'makeffv1.py Image content is lossless but Pixel Aspect Ratio has been altered.Update ffmpeg in order to resolve the PAR issue.'
-                    )
-        elif len(checksum_mismatches) > 1:
-            print 'NOT LOSSLESS'
-            append_csv(
-                csv_report_filename,
-                (
-                    output, 'NOT LOSSLESS',
-                    source_video_size, ffv1_video_size, compression_ratio
-                    )
-                )
-            generate_log(log, 'makeffv1.py Not Lossless.')
-        hashlib_manifest(filenoext, manifest, source_parent_dir)
-        if filecmp.cmp(fmd5, fmd5ffv1, shallow=False):
-            print "YOUR FILES ARE LOSSLESS YOU SHOULD BE SO HAPPY!!!"
-        else:
-            print "The framemd5 text files are not completely identical."
-            " This may be because of a lossy transcode,"
-            " or a change in metadata, most likely pixel aspect ratio."
-            " Please analyse the framemd5 files for source and output."
+    else:
+        print 'NOT LOSSLESS - %s' % describe(verdict)
+        judgement = 'NOT LOSSLESS'
+        generate_log(log, 'makeffv1.py Not Lossless - %s' % describe(verdict))
+    # The log is finished, so it is closed before it is hashed.
+    close_log(log)
+    # Files are already hashed in parallel by the other jobs, and hashing
+    # processes shouldn't be forked from a worker thread.
+    hashlib_manifest(job['filenoext'], manifest, source_parent_dir, workers=1)
+    return (
+        output, judgement,
+        source_video_size, ffv1_video_size, compression_ratio
+        )
+
+
+def make_ffv1(video_files, csv_report_filename, jobs=None):
+    '''
+    Transcodes every file to FFV1 in its own SIP.
+    Up to get_encode_workers(jobs) files are encoded at once, and the
+    metadata, verification and manifest of each file are made in the
+    background while the next files are encoded.
+    Rows are added to the CSV report in the same order as video_files.
+    '''
+    if not video_files:
+        return
+    encode_workers = get_encode_workers(jobs)
+    print 'Encoding %d files, %d at a time' % (len(video_files), encode_workers)
+    encode_pool = ThreadPool(encode_workers)
+    finish_pool = ThreadPool(encode_workers)
+    finishing = collections.deque()
+    try:
+        for job in encode_pool.imap(encode_ffv1, video_files):
+            finishing.append(finish_pool.apply_async(finish_ffv1, (job,)))
+            while finishing and finishing[0].ready():
+                append_csv(csv_report_filename, finishing.popleft().get())
+        while finishing:
+            append_csv(csv_report_filename, finishing.popleft().get())
+    finally:
+        for pool in (encode_pool, finish_pool):
+            pool.close()
+            pool.join()
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Transcodes to FFV1.mkv and performs framemd5 validation.'
+        ' Written by Kieran O\'Leary.'
+    )
+    parser.add_argument(
+        'input', help='file, or directory of video files'
+    )
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        help='Number of files to encode at once. Defaults to the number of'
+        ' CPU cores divided by %d, the amount of FFV1 slices' % FFV1_SLICES
+    )
+    return parser
+
 
-def main():
-    video_files, csv_report_filename = get_input()
-    make_ffv1(video_files, csv_report_filename)
+def main(args_):
+    args = make_parser().parse_args(args_)
+    video_files, csv_report_filename = get_input(args.input)
+    make_ffv1(video_files, csv_report_filename, args.j)
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
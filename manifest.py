@@ -7,7 +7,7 @@ import os
 import argparse
 import time
 import shutil
-from ififuncs import generate_log
+from ififuncs import generate_log, close_log
 from ififuncs import manifest_file_count
 from ififuncs import hashlib_manifest
 from ififuncs import make_desktop_logs_dir, make_desktop_manifest_dir
@@ -55,6 +55,11 @@ def main():
         action='store_true',
         help='Felix Meehan workflow - places manifest inside of source directory'
     )
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        help='Number of files to hash at once. Defaults to the number of CPU cores'
+    )
 
     args = parser.parse_args()
     source = args.source
@@ -104,10 +109,11 @@ def main():
         try:
             print 'Generating source manifest'
             if args.f:
-                hashlib_manifest(source, manifest, source)
+                hashlib_manifest(source, manifest, source, args.j)
+                close_log(log_name_source)
                 shutil.move(log_name_source, source)
             else:
-                hashlib_manifest(source, manifest, source_parent_dir)
+                hashlib_manifest(source, manifest, source_parent_dir, args.j)
             generate_log(log_name_source, 'EVENT = Generating source manifest')
         except OSError:
             print 'You do not have access to this directory. Perhaps it is read only, or the wrong file system\n'
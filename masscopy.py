@@ -4,26 +4,13 @@ Launches copyit.py for subfolders that have md5 anifests.
 '''
 import os
 import argparse
+import multiprocessing
+import collections
+import Queue
 import copyit
-from ififuncs import make_desktop_logs_dir
+from ififuncs import walk_files, close_logs
 
 
-def analyze_log(logfile):
-    '''
-    Analyzes logfiles on the desktop and summarises the outcome.
-    '''
-    outcome = ''
-    with open(logfile, 'r') as fo:
-        log_lines = fo.readlines()
-        for line in log_lines:
-            if 'EVENT = File Transfer Judgement - Success' in line:
-                outcome = 'success'
-            if 'EVENT = File Transfer Outcome - Failure' in line:
-                outcome = 'failure'
-            if 'EVENT = Existing source manifest check - Failure' in line:
-                outcome = 'failure - might be outdated manifests in use'
-        return outcome
-
 def parse_args():
     '''
     Accepts command line arguments.
@@ -37,12 +24,28 @@ def parse_args():
     )
     parser.add_argument(
         '-o',
-        help='full path of output directory',
+        nargs='+',
+        help='full path of output directory. If more than one is given,'
+        ' every package is copied to each of them',
         required=True)
     parser.add_argument(
         '-l', '-lto',
         action='store_true',
         help='use gcp instead of rsync on osx for SPEED on LTO')
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        default=1,
+        help='Number of copyit.py jobs to run at once. Defaults to 1, which'
+        ' runs everything in this process, one package at a time'
+    )
+    parser.add_argument(
+        '-device_jobs',
+        type=int,
+        default=1,
+        help='Number of copyit.py jobs that can write to the same'
+        ' destination device at once. Defaults to 1'
+    )
     args = parser.parse_args()
     return args
 
@@ -86,24 +89,154 @@ def find_manifest(args):
     return dirlist # the dirlist is sent back out to the rest of the script.
 
 
-def analyze_reports(log_names, desktop_logs_dir):
+def get_device(path):
+    '''
+    Returns the device that a destination directory lives on, so that
+    jobs writing to the same LTO drive or share can be limited.
+    '''
+    return os.stat(path).st_dev
+
+
+def make_jobs(all_files, destinations, copyit_args):
+    '''
+    Returns a list of job dictionaries, one for every package and
+    destination pair, with the largest packages first so that
+    they are not left to run on their own at the end of the batch.
+    Packages that already exist at a destination are skipped.
+    '''
+    jobs = []
+    package_sizes = {}
+    for destination in destinations:
+        device = get_device(destination)
+        for package in all_files:
+            absolute_path = os.path.join(destination, os.path.basename(package))
+            if os.path.isdir(absolute_path):
+                print('%s already exists, skipping') % (absolute_path)
+                continue
+            if package not in package_sizes:
+                package_sizes[package] = sum(
+                    size for _, size in walk_files(package)
+                )
+            jobs.append({
+                'package': package,
+                'destination': destination,
+                'device': device,
+                'size': package_sizes[package],
+                'args': copyit_args + [package, destination]
+            })
+    jobs.sort(key=lambda job: job['size'], reverse=True)
+    return jobs
+
+
+def run_job(job):
     '''
-    Tries to locate copyit.py logs on the desktop and analyzes them.
+    Runs copyit.py for a single job and returns a dictionary with the outcome.
+    copyit.py calls sys.exit when it gives up on a package, so this is
+    recorded as a failure rather than ending the batch.
+    '''
+    result = {
+        'package': job['package'],
+        'destination': job['destination'],
+        'log': None,
+        'outcome': ''
+    }
+    try:
+        result.update(copyit.run(job['args']))
+    except SystemExit:
+        result['outcome'] = 'failure - copyit.py exited early'
+    except Exception as error:
+        result['outcome'] = 'failure - %s' % error
+    # copyit.py does not close its log when it exits early.
+    close_logs()
+    result['package'] = job['package']
+    result['destination'] = job['destination']
+    return result
+
+
+def job_process(job, results):
+    '''
+    Runs a job in a child process and sends the result back to the scheduler.
+    '''
+    results.put(run_job(job))
+
+
+def run_jobs(jobs, job_limit, device_limit):
+    '''
+    Runs up to job_limit copyit.py jobs at once, with no more than
+    device_limit of them writing to the same destination device.
+    A package is only copied to one destination at a time, as copyit.py
+    names its log after the source and the timestamp.
+    Jobs are started in the order that they are listed, except when the
+    next job's device or package is busy, in which case the next job
+    that can run is started instead.
+    Returns a list of result dictionaries.
+    '''
+    if job_limit <= 1:
+        return [run_job(job) for job in jobs]
+    results = []
+    result_queue = multiprocessing.Queue()
+    pending = list(jobs)
+    running = {}
+    device_counts = collections.defaultdict(int)
+    while pending or running:
+        for job in list(pending):
+            if len(running) >= job_limit:
+                break
+            if device_counts[job['device']] >= device_limit:
+                continue
+            if job['package'] in [i['package'] for i in running.values()]:
+                continue
+            pending.remove(job)
+            process = multiprocessing.Process(
+                target=job_process, args=(job, result_queue)
+            )
+            process.start()
+            running[process] = job
+            device_counts[job['device']] += 1
+            print 'Started copying %s to %s' % (job['package'], job['destination'])
+        try:
+            results.append(result_queue.get(timeout=1))
+        except Queue.Empty:
+            pass
+        for process, job in running.items():
+            if process.is_alive():
+                continue
+            # the result may arrive after the process has ended.
+            while True:
+                try:
+                    results.append(result_queue.get(timeout=1))
+                except Queue.Empty:
+                    break
+            process.join()
+            del running[process]
+            device_counts[job['device']] -= 1
+            if not [
+                    result for result in results
+                    if result['package'] == job['package']
+                    and result['destination'] == job['destination']
+                ]:
+                results.append({
+                    'package': job['package'],
+                    'destination': job['destination'],
+                    'log': None,
+                    'outcome': 'failure - copyit.py process ended with exit code %s' % process.exitcode
+                })
+    return results
+
+
+def summarise(results):
+    '''
+    Prints the outcome of every job.
     '''
     print 'SUMMARY REPORT'
-    for i in log_names:
-        if os.path.isfile(i):
-            print "%-*s   : %s" % (50, os.path.basename(i)[:-24], analyze_log(i))
-        else:
-            print i, 'can\'t find log file, trying again...'
-            for logs in os.listdir(desktop_logs_dir):
-                # look at log filename minus the seconds and '.log'
-                if os.path.basename(i)[:-7] in logs:
-                    # make sure that the alternate log filename is more recent
-                    if int(
-                        os.path.basename(logs)[-12:-4].replace('_', '')) > int(os.path.basename(i)[-12:-4].replace('_', '')):
-                        print 'trying to analyze %s' % logs
-                        print "%-*s   : %s" % (50, os.path.basename(logs)[:-24], analyze_log(os.path.join(desktop_logs_dir, logs)))
+    for result in sorted(results, key=lambda result: (result['destination'], result['package'])):
+        print "%-*s   : %s" % (
+            50,
+            os.path.join(result['destination'], os.path.basename(result['package'])),
+            result['outcome']
+        )
+        if result['log']:
+            print '%-*s     log: %s' % (50, '', result['log'])
 
 
 def main():
@@ -114,30 +247,22 @@ def main():
     '''
     args = parse_args()
     all_files = find_manifest(args)
-    processed_dirs = []
-    log_names = []
-    print '\n\n**** All of these folders will be copied to %s\n' % args.o
+    print '\n\n**** All of these folders will be copied to %s\n' % ', '.join(args.o)
     for i in all_files:
         print i
-    for i in all_files:
-        absolute_path = os.path.join(args.o, os.path.basename(i))
-        if os.path.isdir(absolute_path):
-            print('%s already exists, skipping') % (absolute_path)
-        else:
-            desktop_logs_dir = make_desktop_logs_dir()
-            if args.l:
-                log_name = copyit.main(
-                    ['-l', os.path.join(args.input, i), args.o]
-                )
-                log_names.append(log_name)
-            else:
-                log_name = copyit.main(
-                    [os.path.join(args.input, i), args.o]
-                )
-                log_names.append(log_name)
-            processed_dirs.append(os.path.basename(os.path.join(args.input, i)))
-            print '********\nWARNING - Please check the ifiscripts_logs directory on your Desktop to verify if ALL of your transfers were successful'
-            analyze_reports(log_names, desktop_logs_dir)
+    all_files = [os.path.join(args.input, i) for i in all_files]
+    copyit_args = []
+    if args.l:
+        copyit_args.append('-l')
+    if args.j > 1:
+        # share the CPU cores out between the jobs that run at once.
+        copyit_args += [
+            '-j', str(max(1, multiprocessing.cpu_count() // args.j))
+        ]
+    jobs = make_jobs(all_files, args.o, copyit_args)
+    results = run_jobs(jobs, args.j, args.device_jobs)
+    print '********\nWARNING - Please check the ifiscripts_logs directory on your Desktop to verify if ALL of your transfers were successful'
+    summarise(results)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+'''
+Cached technical metadata for AV files.
+mediainfo is run once per file, or once for a whole batch of files, and
+every field that the scripts use is returned in a single record.
+Records are kept in memory and in an SQLite database, keyed on the path,
+size and date modified of each file, so a file is only probed again
+once it changes.
+Set the IFI_PROBE_CACHE environment variable to 0 to turn off the database.
+Usage: mediaprobe.py filename(s)
+'''
+import sys
+import os
+import time
+import json
+import atexit
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+
+# (section, mediainfo field, record key, type) for every field in a record.
+# Fields are read with the same mediainfo --Inform names as get_mediainfo,
+# so values are identical to the old one field at a time calls.
+PROBE_FIELDS = (
+    ('General', 'FileSize', 'file_size', int),
+    ('General', 'Duration', 'duration', float),
+    ('General', 'Format', 'container', str),
+    ('General', 'OverallBitRate', 'overall_bitrate', int),
+    ('Video', 'Codec', 'codec', str),
+    ('Video', 'Format', 'video_format', str),
+    ('Video', 'Width', 'width', int),
+    ('Video', 'Height', 'height', int),
+    ('Video', 'PixelAspectRatio', 'par', float),
+    ('Video', 'DisplayAspectRatio', 'dar', float),
+    ('Video', 'ScanType', 'scan_type', str),
+    ('Video', 'ScanOrder', 'scan_order', str),
+    ('Video', 'FrameRate', 'frame_rate', float),
+    ('Video', 'FrameCount', 'frame_count', int),
+    ('Video', 'BitDepth', 'bit_depth', int),
+    ('Audio', 'Format', 'audio_format', str),
+    ('Audio', 'Channel(s)', 'audio_channels', int),
+    ('Audio', 'SamplingRate', 'audio_sampling_rate', int),
+)
+SECTIONS = ('General', 'Video', 'Audio')
+# mediainfo is given at most this many files at once.
+BATCH_SIZE = 100
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS probes (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    record TEXT NOT NULL,
+    probed REAL
+);
+'''
+# path: (file key, record) for every file probed in this process.
+PROBE_CACHE = {}
+# The mediainfo template and database are set up on first use.
+TEMPLATE = []
+DATABASE = []
+# Scripts may probe from several threads, which share the template and
+# database connection.
+PROBE_LOCK = threading.RLock()
+# See ififuncs.CLOSE_FDS, which can't be imported here.
+CLOSE_FDS = sys.platform != 'win32'
+
+
+def get_file_key(path):
+    '''
+    Returns a (size, mtime_ns) tuple for a file.
+    '''
+    file_stat = os.stat(path)
+    mtime_ns = getattr(file_stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(file_stat.st_mtime * 1000000000)
+    return file_stat.st_size, mtime_ns
+
+
+def get_template():
+    '''
+    Returns the path of a mediainfo --Inform template that prints one line
+    per track. Each line starts with the section name, so the tracks of
+    many files can be told apart, and General lines end with the filename.
+    '''
+    with PROBE_LOCK:
+        if not TEMPLATE:
+            make_template()
+    return TEMPLATE[0]
+
+
+def make_template():
+    '''
+    Writes the template for get_template to a temporary file.
+    '''
+    lines = []
+    for section in SECTIONS:
+        fields = ['%' + field + '%' for field_section, field, _, _ in PROBE_FIELDS if field_section == section]
+        if section == 'General':
+            fields.append('%CompleteName%')
+        lines.append('%s;%s|%s\\n' % (section, section, '|'.join(fields)))
+    template_file = tempfile.NamedTemporaryFile(
+        mode='w', suffix='.txt', prefix='mediaprobe_', delete=False
+    )
+    template_file.write('\n'.join(lines) + '\n')
+    template_file.close()
+    atexit.register(os.remove, template_file.name)
+    TEMPLATE.append(template_file.name)
+
+
+def convert(value, value_type):
+    '''
+    Returns a mediainfo value as value_type, or None if it is empty.
+    Strings are returned as they are, including empty strings.
+    '''
+    if value_type is str:
+        return value
+    try:
+        return value_type(value)
+    except ValueError:
+        try:
+            return value_type(float(value))
+        except ValueError:
+            return None
+
+
+def parse_output(output):
+    '''
+    Returns a dictionary of filename: record from the output of mediainfo
+    with the template from get_template. Only the first track of each
+    section is used.
+    '''
+    records = {}
+    record = None
+    for line in output.splitlines():
+        section, _, values = line.partition('|')
+        if section not in SECTIONS:
+            continue
+        fields = [field for field in PROBE_FIELDS if field[0] == section]
+        if section == 'General':
+            values = values.split('|', len(fields))
+            record = dict(
+                (key, '' if value_type is str else None)
+                for _, _, key, value_type in PROBE_FIELDS
+            )
+            records[values[-1]] = record
+        else:
+            values = values.split('|', len(fields) - 1)
+            if record is None or record.get('_%s' % section):
+                continue
+            record['_%s' % section] = True
+        for (_, _, key, value_type), value in zip(fields, values):
+            record[key] = convert(value, value_type)
+    for record in records.values():
+        for section in SECTIONS:
+            record.pop('_%s' % section, None)
+    return records
+
+
+def run_mediainfo(paths):
+    '''
+    Probes a list of full paths with one mediainfo process.
+    Returns a dictionary of path: record.
+    '''
+    mediainfo_cmd = [
+        'mediainfo',
+        '--Language=raw',
+        '--Full',
+        '--File_TestContinuousFileNames=0',
+        '--Inform=file://%s' % get_template()
+    ] + paths
+    return parse_output(subprocess.check_output(mediainfo_cmd, close_fds=CLOSE_FDS))
+
+
+def get_cache_path():
+    '''
+    Returns the default location of the probe database.
+    '''
+    # ififuncs imports this module, so it can't be imported at the top.
+    from ififuncs import make_desktop_manifest_dir
+    return os.path.join(make_desktop_manifest_dir(), 'mediainfo_cache.sqlite')
+
+
+def get_database():
+    '''
+    Returns a connection to the probe database, or None if it is turned
+    off with IFI_PROBE_CACHE=0 or can't be opened.
+    '''
+    with PROBE_LOCK:
+        if not DATABASE:
+            connection = None
+            if os.environ.get('IFI_PROBE_CACHE', '1') != '0':
+                try:
+                    connection = sqlite3.connect(
+                        get_cache_path(), check_same_thread=False
+                    )
+                    connection.executescript(SCHEMA)
+                except (sqlite3.Error, OSError):
+                    connection = None
+            DATABASE.append(connection)
+    return DATABASE[0]
+
+
+def lookup(path, file_key):
+    '''
+    Returns the cached record of path, or None if it must be probed.
+    '''
+    cached = PROBE_CACHE.get(path)
+    if cached is not None and cached[0] == file_key:
+        return cached[1]
+    connection = get_database()
+    if connection is None:
+        return None
+    try:
+        with PROBE_LOCK:
+            row = connection.execute(
+                'SELECT record FROM probes WHERE path=? AND size=? AND mtime_ns=?',
+                (path,) + file_key
+            ).fetchone()
+    except sqlite3.Error:
+        # eg the database is locked by another script, so probe again.
+        return None
+    if row is None:
+        return None
+    record = json.loads(row[0])
+    PROBE_CACHE[path] = (file_key, record)
+    return record
+
+
+def store(records, file_keys):
+    '''
+    Adds newly probed records to the memory and database caches.
+    If the database can't be written to, eg because another script has
+    it locked, the records are only kept in memory.
+    '''
+    connection = get_database()
+    with PROBE_LOCK:
+        for path, record in records.items():
+            PROBE_CACHE[path] = (file_keys[path], record)
+        if connection is None:
+            return
+        try:
+            for path, record in records.items():
+                connection.execute(
+                    'INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?)',
+                    (path,) + file_keys[path] + (json.dumps(record), time.time())
+                )
+            connection.commit()
+        except sqlite3.Error:
+            try:
+                connection.rollback()
+            except sqlite3.Error:
+                pass
+
+
+def probe_files(filenames):
+    '''
+    Returns a dictionary of filename: record for a list of files.
+    Files that aren't cached are probed BATCH_SIZE at a time.
+    A record is a dictionary with a key for every field in PROBE_FIELDS,
+    eg 'duration' in milliseconds, 'file_size' in bytes or 'height'.
+    Empty numeric fields are None and empty text fields are '', as are
+    the fields of tracks that the file doesn't have.
+    '''
+    records = {}
+    file_keys = {}
+    uncached = []
+    for filename in filenames:
+        path = os.path.abspath(filename)
+        file_keys[path] = get_file_key(path)
+        record = lookup(path, file_keys[path])
+        if record is None:
+            uncached.append(path)
+        else:
+            records[filename] = record
+    for index in range(0, len(uncached), BATCH_SIZE):
+        batch = uncached[index:index + BATCH_SIZE]
+        probed = run_mediainfo(batch)
+        store(
+            dict((path, probed[path]) for path in batch if path in probed),
+            file_keys
+        )
+    for filename in filenames:
+        if filename not in records:
+            cached = PROBE_CACHE.get(os.path.abspath(filename))
+            if cached is None:
+                raise ValueError('mediainfo could not read %s' % filename)
+            records[filename] = cached[1]
+    return records
+
+
+def probe(filename):
+    '''
+    Returns the record for a single file. See probe_files.
+    '''
+    return probe_files([filename])[filename]
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Prints the cached technical metadata that the IFI'
+        ' scripts use for each file.'
+        ' Written by Kieran O\'Leary.'
+    )
+    parser.add_argument('input', nargs='+', help='full path of AV files')
+    return parser
+
+
+def main(args_):
+    '''
+    Prints the record of each input file.
+    '''
+    args = make_parser().parse_args(args_)
+    records = probe_files(args.input)
+    for filename in args.input:
+        print filename
+        for _, _, key, _ in PROBE_FIELDS:
+            print '    %-20s %s' % (key, records[filename][key])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -6,34 +6,15 @@ import sys
 import subprocess
 import os
 from glob import glob
-import hashlib
 from collections import OrderedDict
 import csv
+import ififuncs
 from ififuncs import append_csv
 from ififuncs import create_csv
 
 
 def hashlib_md5(source_file,filename):
-   read_size = 0
-   last_percent_done = 0
-   m = hashlib.md5()
-   total_size = os.path.getsize(filename)
-   with open(str(filename), 'rb') as f:
-       while True:
-           buf = f.read(2**20)
-           if not buf:
-               break
-           read_size += len(buf)
-           m.update(buf)
-           percent_done = 100 * read_size / total_size
-           if percent_done > last_percent_done:
-               sys.stdout.write('[%d%%]\r' % percent_done)
-               sys.stdout.flush()
-
-
-               last_percent_done = percent_done
-   md5_output = m.hexdigest()
-   return md5_output
+    return ififuncs.hashlib_md5(filename)
 
 def add_value(value, element):
     element.text = value
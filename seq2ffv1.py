@@ -4,6 +4,8 @@
 Usage: seq2ffv1.py source_parent_directory output_directory
 The script will look through all subdirectories beneath the
 source_parent_directory for a DPX or image sequence.
+Sequences with missing, duplicate, empty or wrongly sized frames are
+skipped unless -force is used - see seqcheck.py.
 The script will then:
 Create folder structure for each image sequence in
 your designated output_directory.
@@ -11,6 +13,10 @@ Create framemd5 values of the source sequence
 Transcode to a single FFV1 in Matroska file
 Create framemd5 values for the FFV1 in Matroska file
 Verify losslessness
+Sequences are processed in a pipeline, so the framemd5s of one sequence are
+made while the next is transcoding.
+With -single_decode, the source framemd5 and the FFV1 are made by one ffmpeg
+process.
 (There will most likely be a warning about pixel aspect ratio
 - https://www.ietf.org/mail-archive/web/cellar/current/msg00739.html)
 Generate CSV log that will be saved to your desktop
@@ -20,36 +26,34 @@ import os
 import argparse
 import datetime
 import time
-import itertools
 import ififuncs
-from ififuncs import diff_textfiles
 from ififuncs import get_mediainfo
 from ififuncs import create_csv
 from ififuncs import append_csv
-from ififuncs import get_image_sequence_files
-from ififuncs import get_ffmpeg_friendly_name
+from ififuncs import describe_image_sequence
+from framemd5 import compare_framemd5, describe
+import seqcheck
+import imageheader
 
 
 
-def read_lines(infile):
-    '''
-    Returns line number and text from an textfile.
-    '''
-    for lineno, line in enumerate(infile):
-        yield lineno, line
-
-
 def make_framemd5(directory, log_filename_alteration, args):
     '''
     Apparently this makes framemd5s. But it clearly does a lot more.
+    It creates the folder structure and returns info about the sequence,
+    ending with the ffmpeg command and environment for the source framemd5,
+    which is run later by make_source_framemd5.
     '''
+    folder_structure = make_folder_structure(directory, args)
+    if folder_structure == 'none':
+        return 'none'
     (
     basename,
     ffmpeg_friendly_name,
     start_number,
-    images,
+    descriptor,
     container,
-    output_dirname) = make_folder_structure(directory, args)
+    output_dirname) = folder_structure
     output = output_dirname + '/metadata/%ssource.framemd5' % (basename)
     logfile = output_dirname + '/logs/%s%s.log' % (
         basename,
@@ -58,12 +62,9 @@ def make_framemd5(directory, log_filename_alteration, args):
     logfile = "\'" + logfile + "\'"
     env_dict = ififuncs.set_environment(logfile)
     image_seq_without_container = ffmpeg_friendly_name
-    start_number_length = len(start_number)
-    number_regex = "%0" + str(start_number_length) + 'd.'
-    if len(images[0].split("_")[-1].split(".")) > 2:
-        image_seq_without_container = ffmpeg_friendly_name[:-1] + ffmpeg_friendly_name[-1].replace('_', '.')
-        ffmpeg_friendly_name = image_seq_without_container
-    ffmpeg_friendly_name += number_regex + '%s' % container
+    number_regex = "%0" + str(descriptor['padding']) + 'd.'
+    # sequences are transcoded in other threads, so ffmpeg gets an absolute path.
+    ffmpeg_friendly_name = descriptor['ffmpeg_pattern']
     framemd5 = [
         'ffmpeg', '-start_number',
         start_number, '-report',
@@ -72,8 +73,6 @@ def make_framemd5(directory, log_filename_alteration, args):
         '-i', ffmpeg_friendly_name,
         '-f', 'framemd5', output
     ]
-    print framemd5
-    subprocess.call(framemd5, env=env_dict)
     info = [
         output_dirname,
         output,
@@ -82,7 +81,9 @@ def make_framemd5(directory, log_filename_alteration, args):
         container,
         ffmpeg_friendly_name,
         number_regex,
-        len(images)
+        descriptor['frame_count'],
+        framemd5,
+        env_dict
     ]
     return info
 
@@ -116,7 +117,32 @@ def setup():
                                     ' Written by Kieran O\'Leary.')
     parser.add_argument('source_directory', help='Input directory')
     parser.add_argument('destination', help='Destination directory')
+    parser.add_argument(
+        '-single_decode',
+        action='store_true',
+        help='Make the source framemd5 and the FFV1 from a single decode of'
+        ' the image sequence'
+    )
+    parser.add_argument(
+        '-encode_slots',
+        type=int, default=1,
+        help='Number of sequences to transcode at once. Defaults to 1'
+    )
+    parser.add_argument(
+        '-hash_slots',
+        type=int, default=1,
+        help='Number of source framemd5s and of verification framemd5s to'
+        ' run at once, alongside the transcodes. Defaults to 1'
+    )
+    parser.add_argument(
+        '-force',
+        action='store_true',
+        help='Transcode sequences even if seqcheck.py finds missing,'
+        ' duplicate, empty or wrongly sized frames'
+    )
     args = parser.parse_args()
+    args.source_directory = os.path.abspath(args.source_directory)
+    args.destination = os.path.abspath(args.destination)
     create_csv(csv_report_filename, (
         'Sequence Name', 'Lossless?',
         'Start time', 'Finish Time',
@@ -134,14 +160,14 @@ def make_folder_structure(directory, args):
     '''
     Creates output folder structure and sets more variables
     '''
-    images = get_image_sequence_files(directory)
-    if images == 'none':
+    descriptor = describe_image_sequence(directory)
+    if descriptor is None:
         return 'none'
-    (ffmpeg_friendly_name,
-    container,
-    start_number) = get_ffmpeg_friendly_name(images)
+    ffmpeg_friendly_name = descriptor['prefix']
+    container = descriptor['extension']
+    start_number = descriptor['start_number']
     output_parent_directory = args.destination
-    if start_number == '864000':
+    if descriptor['first'] == 864000:
         output_dirname = os.path.join(
             output_parent_directory,
             os.path.basename(directory) + time.strftime("%Y_%m_%dT%H_%M_%S")
@@ -166,7 +192,7 @@ def make_folder_structure(directory, args):
     return (basename,
             ffmpeg_friendly_name,
             start_number,
-            images,
+            descriptor,
             container,
             output_dirname)
 
@@ -175,18 +201,20 @@ def make_ffv1(
         dpx_filename,
         output_dirname,
         output_filename,
-        image_seq_without_container,
-        env_dict
+        env_dict,
+        source_framemd5=None
     ):
     '''
-    This launches the image sequence to FFV1/Matroska process
-    as well as framemd5 losslessness verification.
+    This launches the image sequence to FFV1/Matroska process.
+    If source_framemd5 is given, the framemd5 of the source is written by
+    the same ffmpeg process, so that the sequence is only decoded once.
     '''
 
     pix_fmt = ififuncs.img_seq_pixfmt(
         start_number,
         os.path.abspath(dpx_filename)
     )
+    ffv1_path = output_dirname +  '/objects/'  + output_filename + '.mkv'
     ffv12dpx = [
         'ffmpeg', '-report',
         '-f', 'image2',
@@ -200,18 +228,36 @@ def make_ffv1(
         '-slicecrc', '1',
         '-slices', '16',
         '-pix_fmt', pix_fmt,
-        output_dirname +  '/objects/' + output_filename + '.mkv'
+        ffv1_path
     ]
+    if source_framemd5:
+        # output options only apply to the next output, so the framemd5
+        # is of the decoded source pixels, not the converted pix_fmt.
+        ffv12dpx += ['-f', 'framemd5', source_framemd5]
     print ffv12dpx
     transcode_start = datetime.datetime.now()
     transcode_start_machine = time.time()
-    subprocess.call(ffv12dpx, env=env_dict)
+    subprocess.call(ffv12dpx, env=env_dict, close_fds=ififuncs.CLOSE_FDS)
     transcode_finish = datetime.datetime.now()
     transcode_finish_machine = time.time()
     transcode_time = transcode_finish_machine - transcode_start_machine
-    ffv1_path = output_dirname +  '/objects/'  + output_filename + '.mkv'
-    width = get_mediainfo('duration', '--inform=Video;%Width%', ffv1_path)
-    height = get_mediainfo('duration', '--inform=Video;%Height%', ffv1_path)
+    return (
+        ffv1_path, transcode_time, pix_fmt,
+        transcode_start, transcode_finish
+    )
+
+
+def make_ffv1_framemd5(
+        ffv1_path,
+        pix_fmt,
+        output_dirname,
+        output_filename,
+        image_seq_without_container
+    ):
+    '''
+    Makes the framemd5 of the FFV1 for losslessness verification.
+    Returns the path of the framemd5.
+    '''
     ffv1_md5 = os.path.join(
         output_dirname +  '/metadata',
         image_seq_without_container + 'ffv1.framemd5'
@@ -228,89 +274,197 @@ def make_ffv1(
     )
     ffv1_fmd5_logfile = "\'" + ffv1_fmd5_logfile + "\'"
     ffv1_fmd5_env_dict = ififuncs.set_environment(ffv1_fmd5_logfile)
-    subprocess.call(ffv1_fmd5_cmd, env=ffv1_fmd5_env_dict)
-    finish = datetime.datetime.now()
-    return (
-        ffv1_path, ffv1_md5,
-        transcode_time, pix_fmt,
-        width, height,
-        finish, transcode_start,
-        transcode_finish
+    subprocess.call(
+        ffv1_fmd5_cmd, env=ffv1_fmd5_env_dict, close_fds=ififuncs.CLOSE_FDS
+    )
+    return ffv1_md5
+
+
+def prepare_sequence(root, args):
+    '''
+    Creates the folder structure for the image sequence in root.
+    Returns a dictionary that is passed through the other stages, or None
+    if there is no image sequence in root.
+    '''
+    start = datetime.datetime.now()
+    info = make_framemd5(root, 'dpx_framemd5', args)
+    if info == 'none':
+        return None
+    # the directory was already scanned by make_folder_structure.
+    descriptor = describe_image_sequence(root)
+    header, differences = imageheader.sample_sequence(descriptor)
+    if header is not None:
+        print '%s - %s' % (root, imageheader.describe(header))
+    for filename, key, value in differences:
+        print 'WARNING - %s has a different %s: %s' % (filename, key, value)
+    image_seq_without_container = info[2]
+    return {
+        'start': start,
+        'single_decode': args.single_decode,
+        'output_dirname': info[0],
+        'source_textfile': info[1],
+        'image_seq_without_container': image_seq_without_container,
+        'output_filename': image_seq_without_container[:-1],
+        'start_number': info[3],
+        'container': info[4],
+        'dpx_filename': info[5],
+        'sequence_length': info[7],
+        'source_framemd5_cmd': info[8],
+        'source_framemd5_env': info[9],
+        'total_size': descriptor['total_bytes'],
+        'header': header
+    }
+
+
+def make_source_framemd5(sequence):
+    '''
+    Pipeline stage that makes the framemd5 of the source sequence, unless
+    it is going to be made during the transcode.
+    '''
+    if not sequence['single_decode']:
+        print sequence['source_framemd5_cmd']
+        subprocess.call(
+            sequence['source_framemd5_cmd'], env=sequence['source_framemd5_env'],
+            close_fds=ififuncs.CLOSE_FDS
+        )
+    return sequence
+
+
+def encode_sequence(sequence):
+    '''
+    Pipeline stage that transcodes the sequence to FFV1.
+    '''
+    logfile = os.path.join(
+        sequence['output_dirname'],
+        'logs/%s_ffv1_transcode.log' % sequence['output_filename']
     )
+    logfile = "\'" + logfile + "\'"
+    source_framemd5 = None
+    if sequence['single_decode']:
+        source_framemd5 = sequence['source_textfile']
+    (sequence['ffv1_path'],
+     sequence['transcode_time'],
+     sequence['pix_fmt'],
+     sequence['transcode_start'],
+     sequence['transcode_finish']) = make_ffv1(
+         sequence['start_number'],
+         sequence['dpx_filename'],
+         sequence['output_dirname'],
+         sequence['output_filename'],
+         ififuncs.set_environment(logfile),
+         source_framemd5
+     )
+    return sequence
+
+
+def verify_sequence(sequence):
+    '''
+    Pipeline stage that makes the framemd5 of the FFV1, compares it with
+    the source framemd5. The width and height for the report come from
+    the source header, so mediainfo is only used if it couldn't be read.
+    '''
+    ffv1_md5 = make_ffv1_framemd5(
+        sequence['ffv1_path'], sequence['pix_fmt'],
+        sequence['output_dirname'], sequence['output_filename'],
+        sequence['image_seq_without_container']
+    )
+    sequence['verdict'] = compare_framemd5(sequence['source_textfile'], ffv1_md5)
+    if sequence['header'] is not None:
+        # the sequence is not scaled, so the FFV1 has the source dimensions.
+        sequence['width'] = sequence['header']['width']
+        sequence['height'] = sequence['header']['height']
+    else:
+        sequence['width'] = get_mediainfo(
+            'duration', '--inform=Video;%Width%', sequence['ffv1_path']
+        )
+        sequence['height'] = get_mediainfo(
+            'duration', '--inform=Video;%Height%', sequence['ffv1_path']
+        )
+    sequence['finish'] = datetime.datetime.now()
+    return sequence
+
+
+def report_sequence(sequence, csv_report_filename):
+    '''
+    Pipeline stage that adds a finished sequence to the CSV report.
+    This stage only has one slot, so rows are written one at a time.
+    '''
+    ffv1_size = os.path.getsize(sequence['ffv1_path'])
+    comp_ratio = float(sequence['total_size']) / float(ffv1_size)
+    fps = float(sequence['sequence_length']) / float(sequence['transcode_time'])
+    log_results(
+        sequence['verdict'],
+        csv_report_filename,
+        os.path.basename(sequence['output_dirname']),
+        sequence['verdict']['judgement'],
+        sequence['start'], sequence['finish'],
+        sequence['transcode_start'], sequence['transcode_finish'],
+        sequence['transcode_time'], sequence['sequence_length'],
+        fps, sequence['total_size'],
+        ffv1_size, sequence['pix_fmt'],
+        sequence['container'], sequence['width'],
+        sequence['height'], comp_ratio)
+
+
+def preflight_check(root, args, csv_report_filename):
+    '''
+    Checks the image sequence in root for missing, duplicate, empty or
+    wrongly sized frames before anything is created for it.
+    Returns False if the sequence should be skipped, which is also
+    recorded in the CSV report.
+    '''
+    descriptor = describe_image_sequence(root)
+    if descriptor is None:
+        return True
+    report = seqcheck.analyse_sequence(descriptor)
+    if report['ok']:
+        return True
+    description = seqcheck.describe(report)
+    print '%s - %s' % (root, description)
+    if args.force:
+        return True
+    append_csv(csv_report_filename, (
+        os.path.basename(root), 'SKIPPED - %s' % description
+    ))
+    return False
+
+
+def find_sequences(args, csv_report_filename):
+    '''
+    Yields a prepared sequence for every image sequence in the
+    subdirectories of the source directory that passes the pre-flight check.
+    '''
+    for root, _, _ in os.walk(args.source_directory):
+        if not preflight_check(root, args, csv_report_filename):
+            continue
+        sequence = prepare_sequence(root, args)
+        if sequence is not None:
+            yield sequence
+
 
 def run_loop(args, csv_report_filename):
     '''
     Launches a recursive loop to process all images sequences in your
     subdirectories.
+    Each sequence passes through a pipeline of source framemd5, transcode,
+    verification and report stages, so the framemd5s of one sequence run
+    while another is transcoding. -encode_slots and -hash_slots set how
+    many sequences can be in the transcode and framemd5 stages at once.
     '''
-    for root, _, filenames in os.walk(args.source_directory):
-        source_directory = root
-        total_size = 0
-        start = datetime.datetime.now()
-        info = make_framemd5(source_directory, 'dpx_framemd5', args)
-        if info == 'none':
-            continue
-        for files in filenames:
-            total_size += os.path.getsize(os.path.join(root, files))
-        output_dirname = info[0]
-        source_textfile = info[1]
-        image_seq_without_container = info[2]
-        start_number = info[3]
-        container = info[4]
-        dpx_filename = info[5]
-        sequence_length = info[7]
-        output_filename = image_seq_without_container[:-1]
-        logfile = os.path.join(
-            output_dirname,
-            'logs/%s_ffv1_transcode.log' % output_filename
-        )
-        logfile = "\'" + logfile + "\'"
-        (ffv1_path,
-         ffv1_md5,
-         transcode_time,
-         pix_fmt,
-         width,
-         height,
-         finish,
-         transcode_start,
-         transcode_finish) = make_ffv1(
-            start_number,
-            dpx_filename,
-            output_dirname,
-            output_filename,
-            image_seq_without_container,
-            ififuncs.set_environment(logfile)
-        )
-        comp_ratio = float(total_size) / float(os.path.getsize(ffv1_path))
-        judgement = diff_textfiles(source_textfile, ffv1_md5)
-        fps = float(sequence_length) / float(transcode_time)
-        checksum_mismatches = []
-        with open(source_textfile) as source_md5_object:
-            with open(ffv1_md5) as ffv1_md5_object:
-                for (line1), (line2) in itertools.izip(
-                    read_lines(source_md5_object), read_lines(ffv1_md5_object)
-                ):
-                    if line1 != line2:
-                        if 'sar' in line1:
-                            checksum_mismatches = ['sar']
-                        else:
-                            checksum_mismatches.append(1)
-        log_results(
-            checksum_mismatches,
-            csv_report_filename,
-            os.path.basename(output_dirname),
-            judgement,
-            start, finish,
-            transcode_start, transcode_finish,
-            transcode_time, sequence_length,
-            fps, total_size,
-            os.path.getsize(ffv1_path), pix_fmt,
-            container, width,
-            height, comp_ratio)
+    failures = ififuncs.run_pipeline(
+        find_sequences(args, csv_report_filename), [
+            (make_source_framemd5, args.hash_slots),
+            (encode_sequence, args.encode_slots),
+            (verify_sequence, args.hash_slots),
+            (lambda sequence: report_sequence(sequence, csv_report_filename), 1)
+        ]
+    )
+    if failures:
+        print 'WARNING - %d sequences could not be processed, see the errors above' % failures
 
 
 def log_results(
-    checksum_mismatches,
+    verdict,
     csv_report_filename,
     parent_basename,
     judgement,
@@ -322,7 +476,13 @@ def log_results(
     container, width,
     height, comp_ratio
 ):
-    if len(checksum_mismatches) == 0:
+    '''
+    Prints the outcome of the framemd5 comparison and adds it to the CSV report.
+    '''
+    sar_altered = [
+        name for name in verdict['header_differences'] if name.startswith('sar')
+    ]
+    if verdict['judgement'] == 'lossless' and not sar_altered:
         print 'LOSSLESS'
         append_csv(
             csv_report_filename, (
@@ -337,22 +497,21 @@ def log_results(
             )
         )
 
-    elif len(checksum_mismatches) == 1:
-        if checksum_mismatches[0] == 'sar':
-            print 'Image content is lossless, Pixel Aspect Ratio has been altered - This is mostly likely because your source had no pixel aspect ratio information, and Matroska is specifying 1:1. https://www.ietf.org/mail-archive/web/cellar/current/msg00739.html '
-            append_csv(csv_report_filename, (
-                parent_basename, 'LOSSLESS - different PAR',
-                start, finish, transcode_start,
-                transcode_finish, transcode_time,
-                sequence_length, fps,
-                total_size, ffv1_size,
-                pix_fmt, container,
-                width, height,
-                comp_ratio
-            )
-                      )
-    elif len(checksum_mismatches) > 1:
-        print 'NOT LOSSLESS'
+    elif verdict['judgement'] == 'lossless':
+        print 'Image content is lossless, Pixel Aspect Ratio has been altered - This is mostly likely because your source had no pixel aspect ratio information, and Matroska is specifying 1:1. https://www.ietf.org/mail-archive/web/cellar/current/msg00739.html '
+        append_csv(csv_report_filename, (
+            parent_basename, 'LOSSLESS - different PAR',
+            start, finish, transcode_start,
+            transcode_finish, transcode_time,
+            sequence_length, fps,
+            total_size, ffv1_size,
+            pix_fmt, container,
+            width, height,
+            comp_ratio
+        )
+                  )
+    else:
+        print 'NOT LOSSLESS - %s' % describe(verdict)
         append_csv(csv_report_filename, (
             parent_basename, judgement,
             start, finish, transcode_start,
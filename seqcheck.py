@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+'''
+Pre-flight check for DPX/TIFF image sequences.
+Reports missing frames, duplicate frame numbers, zero byte frames and
+frames whose size differs from the rest of the sequence.
+Only the directory listing is read - no images are opened or decoded -
+so a million frame sequence is checked in seconds.
+Usage: seqcheck.py source_parent_directory
+'''
+import os
+import sys
+import argparse
+import itertools
+import collections
+from ififuncs import describe_image_sequence
+from framemd5 import format_ranges
+
+# Frames listed individually in a description. Any beyond this are still counted.
+MAX_RANGES = 20
+# Uncompressed frames are all the same size, so in a sequence where most
+# frames share a size, any frame of a different size is reported.
+# Otherwise, eg compressed TIFF, frames are only reported if they are this
+# fraction above or below the median size.
+VARIABLE_SIZE_TOLERANCE = 0.5
+
+
+def get_size_norm(sizes):
+    '''
+    Returns a (size, constant) tuple. constant is True if at least half of
+    the frames are the same size, in which case size is that size.
+    Otherwise size is the median.
+    '''
+    most_common, count = collections.Counter(sizes).most_common(1)[0]
+    if count * 2 >= len(sizes):
+        return most_common, True
+    return sorted(sizes)[len(sizes) // 2], False
+
+
+def analyse_sequence(descriptor, tolerance=VARIABLE_SIZE_TOLERANCE):
+    '''
+    Checks a descriptor from ififuncs.describe_image_sequence and returns
+    a dictionary with the keys:
+    frame_count - amount of frames found
+    expected_frames - amount of frames between the first and last frame
+    gaps - (start, end) ranges of missing frames
+    missing_frames - amount of missing frames
+    duplicates - frame numbers that appear more than once, eg
+    frame_0001.dpx and frame_001.dpx
+    zero_byte - frame numbers of empty frames
+    outliers - (frame number, size) of frames of an unexpected size
+    norm_size - the expected frame size in bytes
+    constant_size - True if frames should all be norm_size, False if
+    norm_size is the median of a sequence whose frames vary in size
+    ok - True if none of the above problems were found
+    '''
+    sizes = descriptor['sizes']
+    norm_size, constant = get_size_norm(sizes)
+    duplicates = []
+    zero_byte = []
+    outliers = []
+    previous = None
+    for number, size in itertools.izip(descriptor['frames'], sizes):
+        if number == previous:
+            duplicates.append(number)
+        previous = number
+        if size == 0:
+            zero_byte.append(number)
+        elif constant:
+            if size != norm_size:
+                outliers.append((number, size))
+        elif abs(size - norm_size) > tolerance * norm_size:
+            outliers.append((number, size))
+    missing_frames = sum(end - start + 1 for start, end in descriptor['gaps'])
+    return {
+        'frame_count': descriptor['frame_count'],
+        'expected_frames': descriptor['last'] - descriptor['first'] + 1,
+        'gaps': descriptor['gaps'],
+        'missing_frames': missing_frames,
+        'duplicates': duplicates,
+        'zero_byte': zero_byte,
+        'outliers': outliers,
+        'norm_size': norm_size,
+        'constant_size': constant,
+        'ok': not (missing_frames or duplicates or zero_byte or outliers)
+    }
+
+
+def get_ranges(numbers):
+    '''
+    Returns sorted frame numbers as a list of (start, end) ranges.
+    '''
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] in (number, number - 1):
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ranges
+
+
+def format_frames(ranges):
+    '''
+    Returns the first MAX_RANGES ranges as a string like '10-12, 400'.
+    '''
+    return format_ranges(ranges[:MAX_RANGES], len(ranges) > MAX_RANGES)
+
+
+def describe(report):
+    '''
+    Returns a one line summary of a report for logs and the terminal.
+    '''
+    if report['ok']:
+        return 'OK - %d frames' % report['frame_count']
+    problems = []
+    if report['missing_frames']:
+        problems.append('%d missing frames (%s)' % (
+            report['missing_frames'], format_frames(report['gaps'])
+        ))
+    if report['duplicates']:
+        problems.append('%d duplicate frame numbers (%s)' % (
+            len(report['duplicates']),
+            format_frames(get_ranges(report['duplicates']))
+        ))
+    if report['zero_byte']:
+        problems.append('%d zero byte frames (%s)' % (
+            len(report['zero_byte']),
+            format_frames(get_ranges(report['zero_byte']))
+        ))
+    if report['outliers']:
+        if report['constant_size']:
+            expected = '%d bytes' % report['norm_size']
+        else:
+            expected = 'around %d bytes' % report['norm_size']
+        problems.append('%d frames of unexpected size, expected %s (%s)' % (
+            len(report['outliers']), expected,
+            ', '.join(
+                '%d: %d bytes' % outlier
+                for outlier in report['outliers'][:MAX_RANGES]
+            ) + (', ...' if len(report['outliers']) > MAX_RANGES else '')
+        ))
+    return 'PROBLEMS - %s' % ' - '.join(problems)
+
+
+def check_directory(directory, tolerance=VARIABLE_SIZE_TOLERANCE):
+    '''
+    Returns a report for the image sequence in directory, or None if
+    there isn't one.
+    '''
+    descriptor = describe_image_sequence(directory)
+    if descriptor is None:
+        return None
+    return analyse_sequence(descriptor, tolerance)
+
+
+def make_parser():
+    '''
+    Accepts command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Checks all DPX or TIFF image sequences in the'
+        ' subfolders of your source directories for missing, duplicate,'
+        ' empty or wrongly sized frames, without decoding any images.'
+        ' Written by Kieran O\'Leary.'
+    )
+    parser.add_argument(
+        'input', nargs='+', help='full path of input directories'
+    )
+    parser.add_argument(
+        '-tolerance',
+        type=float, default=VARIABLE_SIZE_TOLERANCE,
+        help='For sequences whose frames vary in size, report frames that'
+        ' are this fraction above or below the median size.'
+        ' Defaults to %s' % VARIABLE_SIZE_TOLERANCE
+    )
+    return parser
+
+
+def main(args_):
+    '''
+    Prints a report for every image sequence, and exits with a status
+    of 1 if any sequence has problems.
+    '''
+    args = make_parser().parse_args(args_)
+    problems = 0
+    for source in args.input:
+        for root, _, _ in os.walk(source):
+            report = check_directory(root, args.tolerance)
+            if report is None:
+                continue
+            if not report['ok']:
+                problems += 1
+            print '%s - %s' % (root, describe(report))
+    if problems:
+        print '%d sequences have problems' % problems
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
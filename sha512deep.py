@@ -1,43 +1,75 @@
 #!/usr/bin/env python
 '''
-Make a sha512 manifest
+Make sha512 and md5 sidecar manifests from a single read of each file.
 '''
 import os
-import subprocess
 import sys
+import argparse
+import ififuncs
 
 
-def main():
+def make_parser():
     '''
-    Super basic sha512 manifest generator.
-    Haven't looked at this in ages, needs a lot more work!
+    Accepts command line arguments.
     '''
-    source = sys.argv[1]
-    total_file_count = 0
-    print 'Determining number of files to be processed'
-    for root, _, filenames in os.walk(source):
-        for files in filenames:
-            total_file_count += 1
-    progress_counter = 1
-    manifest = os.path.dirname(source) + '/manifest_sha512.txt'
-    for root, _, filenames in os.walk(source):
-        for files in filenames:
-            print 'processing %s - %d of %d' % (
-                files, progress_counter, total_file_count
-                )
-            sha512 = subprocess.check_output(
-                ['openssl', 'sha512', '-r', os.path.join(root, files)]
-                )
-            root2 = root.replace(os.path.dirname(source), '')
-            with open(manifest, "ab") as manifest_object:
-                manifest_object.write(
-                    sha512[:128] + ' ' + os.path.join(
-                        root2, files
-                        ).replace("\\", "/") + '\n'
-                    )
-            progress_counter += 1
-    print 'Manifest created in %s' % manifest
+    parser = argparse.ArgumentParser(
+        description='Generates MD5 and SHA-512 sidecar manifests for a directory.'
+        ' Each file is only read once, no matter how many checksums are made.'
+        ' Written by Kieran O\'Leary.'
+    )
+    parser.add_argument(
+        'source',
+        help='Input directory'
+    )
+    parser.add_argument(
+        '-fast',
+        action='store_true',
+        help='Also make a manifest with a fast non-cryptographic checksum'
+        ' (xxh64 if the xxhash module is installed, otherwise crc32)'
+        ' for quick re-verification with validate.py'
+    )
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        help='Number of files to hash at once. Defaults to the number of CPU cores'
+    )
+    return parser
+
+
+def main(args_):
+    '''
+    Generates the sidecar manifests next to the source directory.
+    '''
+    args = make_parser().parse_args(args_)
+    source = os.path.abspath(args.source)
+    if not os.path.isdir(source):
+        print ' %s is either not a directory or it does not exist' % source
+        sys.exit()
+    source_parent_dir = os.path.dirname(source)
+    relative_path = os.path.basename(source)
+    manifest_textfiles = {
+        'md5': os.path.join(
+            source_parent_dir, '%s_manifest.md5' % relative_path
+        ),
+        'sha512': os.path.join(
+            source_parent_dir, '%s_manifest_sha512.txt' % relative_path
+        )
+    }
+    if args.fast:
+        manifest_textfiles[ififuncs.FAST_HASH] = os.path.join(
+            source_parent_dir,
+            '%s_manifest_%s.txt' % (relative_path, ififuncs.FAST_HASH)
+        )
+    for manifest in manifest_textfiles.values():
+        if os.path.isfile(manifest):
+            print '%s already exists. Script will exit.' % manifest
+            sys.exit()
+    ififuncs.hashlib_multi_manifest(
+        source, manifest_textfiles, source_parent_dir, args.j
+    )
+    for manifest in sorted(manifest_textfiles.values()):
+        print 'Manifest created in %s' % manifest
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
@@ -8,9 +8,28 @@ import sys
 import shutil
 import subprocess
 import datetime
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from lxml import etree
 import copyit
 import ififuncs
-from masscopy import analyze_log
+
+AV_EXTENSIONS = ('.mov', 'MP4', '.mp4', '.mkv', '.MXF', '.mxf', '.dv', '.DV')
+DOCUMENT_EXTENSIONS = (
+    '.tif', 'tiff', '.doc', '.txt', '.docx', '.pdf', '.jpg', '.jpeg',
+    '.png', '.rtf', '.xml', '.odt'
+)
+# Metadata sidecars created by get_metadata.
+METADATA_BLACKLIST = ('siegfried', 'exiftool', 'mediainfo', 'mediatrace')
+TOOL_VERSION_CMDS = {
+    'mediainfo': ['mediainfo', '--Version'],
+    'exiftool': ['exiftool', '-ver'],
+    'sf': ['sf', '-version']
+}
+# Tool versions are only looked up once per run.
+TOOL_VERSIONS = {}
+RDF_NAMESPACE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
 
 
 def make_folder_path(path, args, object_entry):
@@ -40,7 +59,7 @@ def consolidate_manifests(path, directory, new_log_textfile):
     new_manifest_textfile = os.path.join(
         os.path.dirname(path), uuid + '_manifest.md5'
     )
-    collective_manifest = []
+    collective_manifest = {}
     for manifest in os.listdir(objects_dir):
         if manifest.endswith('.md5'):
             if manifest[0] != '.':
@@ -48,14 +67,19 @@ def consolidate_manifests(path, directory, new_log_textfile):
                     new_log_textfile,
                     'EVENT = Manifest consolidation - Checksums from %s merged into %s' % (os.path.join(objects_dir, manifest), new_manifest_textfile)
                 )
-                with open(os.path.join(objects_dir, manifest), 'r') as fo:
-                    manifest_lines = fo.readlines()
-                    for i in manifest_lines:
-                        # This is what appends the new path to existing paths.
-                        new_manifest_path = uuid + '/%s/' % directory + i[34:]
-                        collective_manifest.append(
-                            i[:32] + '  ' + new_manifest_path
+                manifest_dict = ififuncs.read_manifest(
+                    os.path.join(objects_dir, manifest)
+                )
+                for manifest_path, checksum in manifest_dict.iteritems():
+                    # This is what appends the new path to existing paths.
+                    new_manifest_path = uuid + '/%s/' % directory + manifest_path
+                    if collective_manifest.get(new_manifest_path, checksum) != checksum:
+                        print 'WARNING - %s has different checksums in different manifests' % new_manifest_path
+                        ififuncs.generate_log(
+                            new_log_textfile,
+                            'WARNING - %s has different checksums in different manifests' % new_manifest_path
                         )
+                    collective_manifest[new_manifest_path] = checksum
                 # Cut and paste old manifests into the log directory
 
                 shutil.move(
@@ -65,9 +89,11 @@ def consolidate_manifests(path, directory, new_log_textfile):
                     new_log_textfile,
                     'EVENT = Manifest movement - Manifest from %s to %s' % (objects_dir + '/' +  manifest, os.path.join(path, 'logs'))
                 )
-    with open(new_manifest_textfile, 'ab') as manifest_object:
-        for checksums in collective_manifest:
-            manifest_object.write(checksums)
+    ififuncs.write_manifest(
+        new_manifest_textfile,
+        collective_manifest.items(),
+        'ab'
+    )
     return new_manifest_textfile
 
 
@@ -101,12 +127,14 @@ def move_files(inputs, sip_path):
 
 def log_report(log_names):
     '''
-    Analyzes all the moveit.py logs on the desktop and print a report.
+    Prints the outcome of all the moveit.py transfers. Outcomes of
+    transfers that ran in this process are remembered, so their logs
+    on the desktop only need to be read as a fallback.
     '''
     desktop_logs_dir = ififuncs.make_desktop_logs_dir()
     for i in log_names:
         if os.path.isfile(i):
-            print "%-*s   : %s" % (50, os.path.basename(i)[:-24], analyze_log(i))
+            print "%-*s   : %s" % (50, os.path.basename(i)[:-24], ififuncs.get_log_outcome(i))
         else:
             print i, 'can\'t find log file, trying again...'
             log_names.remove(i)
@@ -120,7 +148,7 @@ def log_report(log_names):
                         os.path.basename(i)[-12:-4].replace('_', '')):
                         print 'trying to analyze %s' % logs
                         print "%-*s   : %s" % (
-                            50, os.path.basename(logs)[:-24], analyze_log(
+                            50, os.path.basename(logs)[:-24], ififuncs.get_log_outcome(
                                 os.path.join(desktop_logs_dir, logs))
                             )
                         log_names.append(os.path.join(desktop_logs_dir, logs))
@@ -161,96 +189,237 @@ def parse_args(args_):
         '-oe',
         help='Enter the Object Entry number for the representation.SIP will be placed in a folder with this name.'
     )
+    parser.add_argument(
+        '-j', '-jobs', type=int,
+        help='Number of metadata tools to run at once. Defaults to the number of CPU cores'
+    )
+    parser.add_argument(
+        '-batch', type=int, default=1,
+        help='Pass this many documents to each exiftool and siegfried process. Defaults to 1'
+    )
     parsed_args = parser.parse_args(args_)
     return parsed_args
 
 
-def get_metadata(path, new_log_textfile):
+def get_tool_version(tool):
     '''
-    Recursively create mediainfos and mediatraces for AV files.
-    This should probably go in ififuncs as it could be used by other scripts.
+    Returns the version string of mediainfo, exiftool or sf, or None if
+    the tool isn't installed.
+    Each tool is only asked once per run.
+    '''
+    if tool not in TOOL_VERSIONS:
+        version = tool
+        try:
+            version = subprocess.check_output(
+                TOOL_VERSION_CMDS[tool], close_fds=ififuncs.CLOSE_FDS
+            ).rstrip()
+        except subprocess.CalledProcessError as grepexc:
+            version = grepexc.output.rstrip().splitlines()[1]
+        except OSError:
+            version = None
+        TOOL_VERSIONS[tool] = version
+    return TOOL_VERSIONS[tool]
+
+
+def find_metadata_files(path):
+    '''
+    Returns sorted lists of the full paths of the AV files and documents
+    in path that need technical metadata.
+    Metadata sidecars that were created by this script are skipped.
+    '''
+    av_files = []
+    documents = []
+    for root, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if filename[0] == '.':
+                continue
+            if filename.endswith(AV_EXTENSIONS):
+                av_files.append(os.path.join(root, filename))
+            elif filename.endswith(DOCUMENT_EXTENSIONS):
+                if not any(word in filename for word in METADATA_BLACKLIST):
+                    documents.append(os.path.join(root, filename))
+    return av_files, documents
+
+
+def extract_av_metadata(av_file, metadata_dir):
+    '''
+    Creates a mediainfo and a mediatrace XML for an AV file.
+    Returns the paths of the XML files.
+    '''
+    inputxml = "%s/%s_mediainfo.xml" % (metadata_dir, os.path.basename(av_file))
+    inputtracexml = "%s/%s_mediatrace.xml" % (metadata_dir, os.path.basename(av_file))
+    ififuncs.make_mediainfo(inputxml, 'mediaxmlinput', av_file)
+    ififuncs.make_mediatrace(inputtracexml, 'mediatracexmlinput', av_file)
+    return inputxml, inputtracexml
+
+
+def run_batch(cmd):
+    '''
+    Returns the output of an exiftool or sf run on several files.
+    Both tools exit with an error if any one file fails, but still report
+    on the rest, so the output is kept either way.
     '''
-    mediainfo_version = 'mediainfo'
     try:
-        mediainfo_version = subprocess.check_output([
-            'mediainfo', '--Version'
-        ]).rstrip()
+        return subprocess.check_output(cmd, close_fds=ififuncs.CLOSE_FDS)
     except subprocess.CalledProcessError as grepexc:
-        mediainfo_version = grepexc.output.rstrip().splitlines()[1]
-    for root, _, filenames in os.walk(path):
-        for av_file in filenames:
-            if av_file.endswith(
-                    ('.mov', 'MP4', '.mp4', '.mkv', '.MXF', '.mxf', '.dv', '.DV')
-            ):
-                if av_file[0] != '.':
-                    inputxml = "%s/%s_mediainfo.xml" % (
-                        os.path.join(path, 'metadata'), os.path.basename(av_file)
-                        )
-                    inputtracexml = "%s/%s_mediatrace.xml" % (
-                        os.path.join(path, 'metadata'), os.path.basename(av_file)
-                        )
-                    print 'Generating mediainfo xml of input file and saving it in %s' % inputxml
-                    ififuncs.make_mediainfo(
-                        inputxml, 'mediaxmlinput', os.path.join(root, av_file)
+        return grepexc.output
+
+
+def split_exiftool_xml(exiftool_output):
+    '''
+    Splits the output of exiftool -X on several files into one XML
+    document per file. Returns a dictionary of path: XML.
+    '''
+    reports = {}
+    try:
+        rdf = etree.fromstring(exiftool_output)
+    except etree.XMLSyntaxError:
+        return reports
+    for description in list(rdf):
+        single_rdf = etree.Element(rdf.tag, nsmap=rdf.nsmap)
+        single_rdf.append(description)
+        reports[description.get('{%s}about' % RDF_NAMESPACE)] = etree.tostring(
+            single_rdf, xml_declaration=True, encoding='UTF-8', pretty_print=True
+        )
+    return reports
+
+
+def split_siegfried_json(siegfried_output):
+    '''
+    Splits the output of sf -json on several files into one report per
+    file, with the same siegfried and signature details as a single file
+    report. Returns a dictionary of path: parsed JSON.
+    '''
+    reports = {}
+    try:
+        parsed = json.loads(siegfried_output)
+    except ValueError:
+        return reports
+    for file_report in parsed.get('files', []):
+        single = dict(parsed)
+        single['files'] = [file_report]
+        reports[file_report['filename']] = single
+    return reports
+
+
+def extract_document_metadata(documents, metadata_dir):
+    '''
+    Creates an exiftool XML and a siegfried JSON for each document.
+    Several documents are passed to a single exiftool and sf process,
+    and any document missing from the batch output is run on its own.
+    Returns a list of (exiftool xml, siegfried json) paths, in the same
+    order as documents. A tool that isn't installed is skipped, and its
+    paths are None.
+    '''
+    exiftool_installed = get_tool_version('exiftool') is not None
+    siegfried_installed = get_tool_version('sf') is not None
+    outputs = [(
+        "%s/%s_exiftool.xml" % (metadata_dir, os.path.basename(document)) if exiftool_installed else None,
+        "%s/%s_siegfried.json" % (metadata_dir, os.path.basename(document)) if siegfried_installed else None
+    ) for document in documents]
+    exiftool_reports = {}
+    siegfried_reports = {}
+    if len(documents) > 1:
+        if exiftool_installed:
+            exiftool_reports = split_exiftool_xml(run_batch(['exiftool', '-X'] + documents))
+        if siegfried_installed:
+            siegfried_reports = split_siegfried_json(run_batch(['sf', '-json'] + documents))
+    for document, (inputxml, inputjson) in zip(documents, outputs):
+        if document in siegfried_reports:
+            with open(inputjson, 'w+') as fo:
+                fo.write(json.dumps(siegfried_reports[document], indent=4, sort_keys=True))
+        elif siegfried_installed:
+            ififuncs.make_siegfried(inputjson, document)
+        if document in exiftool_reports:
+            with open(inputxml, 'w+') as fo:
+                fo.write(exiftool_reports[document])
+        elif exiftool_installed:
+            ififuncs.make_exiftool(inputxml, document)
+    return outputs
+
+
+def run_metadata_job(job):
+    '''
+    Runs one job from get_metadata in the pool. A job is an
+    ('av', [path], metadata_dir) or ('documents', [paths], metadata_dir)
+    tuple. Returns the job along with its outputs.
+    '''
+    job_type, paths, metadata_dir = job
+    if job_type == 'av':
+        return job, [extract_av_metadata(paths[0], metadata_dir)]
+    return job, extract_document_metadata(paths, metadata_dir)
+
+
+def get_metadata(path, new_log_textfile, workers=None, batch_size=1):
+    '''
+    Recursively create mediainfos and mediatraces for AV files, and
+    exiftool and siegfried reports for documents.
+    The tools are run by a pool of worker threads, as each one is just
+    waiting on a subprocess. workers defaults to the amount of CPU cores.
+    batch_size documents are passed to each exiftool and sf process.
+    Events are logged in the order the files were found, whichever
+    finishes first.
+    This should probably go in ififuncs as it could be used by other scripts.
+    '''
+    metadata_dir = os.path.join(path, 'metadata')
+    av_files, documents = find_metadata_files(path)
+    jobs = [('av', [av_file], metadata_dir) for av_file in av_files]
+    batch_size = max(1, batch_size)
+    for index in range(0, len(documents), batch_size):
+        jobs.append(('documents', documents[index:index + batch_size], metadata_dir))
+    if not jobs:
+        return
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    pool = ThreadPool(max(1, min(workers, len(jobs))))
+    try:
+        for (job_type, paths, _), outputs in pool.imap(run_metadata_job, jobs):
+            if job_type == 'av':
+                inputxml, inputtracexml = outputs[0]
+                print 'Generated mediainfo xml of %s and saved it in %s' % (paths[0], inputxml)
+                ififuncs.generate_log(
+                    new_log_textfile,
+                    'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via mediainfo, eventOutcome=%s, agentName=%s' % (inputxml, get_tool_version('mediainfo'))
+                )
+                print 'Generated mediatrace xml of %s and saved it in %s' % (paths[0], inputtracexml)
+                ififuncs.generate_log(
+                    new_log_textfile,
+                    'EVENT = Metadata extraction - eventDetail=Mediatrace technical metadata extraction via mediainfo, eventOutcome=%s, agentName=%s' % (inputtracexml, get_tool_version('mediainfo'))
+                )
+                continue
+            for document, (inputxml, inputjson) in zip(paths, outputs):
+                if inputxml is None:
+                    print 'exiftool is not installed, so no exiftool xml was made for %s' % document
+                    ififuncs.generate_log(
+                        new_log_textfile,
+                        'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via exiftool skipped as exiftool is not installed, eventOutcome=%s' % document
                     )
+                else:
+                    print 'Generated exiftool xml of %s and saved it in %s' % (document, inputxml)
                     ififuncs.generate_log(
                         new_log_textfile,
-                        'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via mediainfo, eventOutcome=%s, agentName=%s' % (inputxml, mediainfo_version)
+                        'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via exiftool, eventOutcome=%s, agentName=%s' % (inputxml, get_tool_version('exiftool'))
                     )
-                    print 'Generating mediatrace xml of input file and saving it in %s' % inputtracexml
-                    ififuncs.make_mediatrace(
-                        inputtracexml,
-                        'mediatracexmlinput',
-                        os.path.join(root, av_file)
+                if inputjson is None:
+                    print 'sf is not installed, so no siegfried json was made for %s' % document
+                    ififuncs.generate_log(
+                        new_log_textfile,
+                        'EVENT = Format identification - eventType=format identification, eventDetail=Format identification via Siegfried skipped as sf is not installed, eventOutcome=%s' % document
                     )
+                else:
+                    print 'Generated siegfried json of %s and saved it in %s' % (document, inputjson)
                     ififuncs.generate_log(
                         new_log_textfile,
-                        'EVENT = Metadata extraction - eventDetail=Mediatrace technical metadata extraction via mediainfo, eventOutcome=%s, agentName=%s' % (inputtracexml, mediainfo_version)
+                        'EVENT = Format identification - eventType=format identification, eventDetail=Format identification via PRONOM signatures using Siegfried, eventOutcome=%s, agentName=%s' % (inputjson, get_tool_version('sf'))
                     )
-            elif av_file.endswith(
-                    ('.tif', 'tiff', '.doc', '.txt', '.docx', '.pdf', '.jpg', '.jpeg', '.png', '.rtf', '.xml', '.odt')
-            ):
-                blacklist = ('siegfried', 'exiftool', 'mediainfo', 'mediatrace')
-                if av_file[0] != '.':
-                    if any(word in blacklist for word in av_file):
-                        exiftool_version = 'exiftool'
-                        try:
-                            exiftool_version = subprocess.check_output([
-                                'exiftool', '-ver'
-                            ])
-                        except subprocess.CalledProcessError as grepexc:
-                            exiftool_version = grepexc.output.rstrip().splitlines()[1]
-                        siegfried_version = 'siegfried'
-                        try:
-                            siegfried_version = subprocess.check_output([
-                                'sf', '-version'
-                            ])
-                        except subprocess.CalledProcessError as grepexc:
-                            siegfried_version = grepexc.output.rstrip().splitlines()[1]
-                        inputxml = "%s/%s_exiftool.xml" % (
-                            os.path.join(path, 'metadata'), os.path.basename(av_file)
-                            )
-                        inputtracexml = "%s/%s_siegfried.json" % (
-                            os.path.join(path, 'metadata'), os.path.basename(av_file)
-                            )
-                        ififuncs.make_siegfried(
-                            inputtracexml,
-                            os.path.join(root, av_file)
-                        )
-                        print 'Generating exiftool xml of input file and saving it in %s' % inputxml
-                        ififuncs.generate_log(
-                            new_log_textfile,
-                            'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via exiftool, eventOutcome=%s, agentName=%s' % (inputxml, exiftool_version)
-                        )
-                        print 'Generating mediatrace xml of input file and saving it in %s' % inputtracexml
-                        ififuncs.make_exiftool(
-                            inputxml,
-                            os.path.join(root, av_file)
-                        )
-                        ififuncs.generate_log(
-                            new_log_textfile,
-                            'EVENT = Format identification - eventType=format identification, eventDetail=Format identification via PRONOM signatures using Siegfried, eventOutcome=%s, agentName=%s' % (inputtracexml, siegfried_version)
-                        )
+    finally:
+        pool.close()
+        pool.join()
+
+
 def create_content_title_text(sip_path):
     '''
     DCPs are often delivered with inconsistent foldernames.
@@ -351,7 +520,7 @@ def main(args_):
     metadata_dir = os.path.join(sip_path, 'metadata')
     logs_dir = os.path.join(sip_path, 'logs')
     log_names = move_files(inputs, sip_path)
-    get_metadata(sip_path, new_log_textfile)
+    get_metadata(sip_path, new_log_textfile, args.j, args.batch)
     ififuncs.hashlib_manifest(
         metadata_dir, metadata_dir + '/metadata_manifest.md5', metadata_dir
     )
@@ -362,6 +531,7 @@ def main(args_):
         os.path.dirname(os.path.dirname(logs_dir))
     )
     ififuncs.sort_manifest(new_manifest_textfile)
+    ififuncs.close_log(new_log_textfile)
     log_report(log_names)
     finish = datetime.datetime.now()
     print '\n', user, 'ran this script at %s and it finished at %s' % (start, finish)
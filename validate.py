@@ -1,33 +1,13 @@
 #!/usr/bin/env python
 import sys
-import hashlib
 import os
 import argparse
 import time
 import ififuncs
+import fixitycache
 from ififuncs import make_desktop_logs_dir
 
 
-def hashlib_md5(filename):
-   read_size = 0
-   last_percent_done = 0
-   m = hashlib.md5()
-   total_size = os.path.getsize(filename)
-   with open(str(filename), 'rb') as f:
-       while True:
-           buf = f.read(2**20)
-           if not buf:
-               break
-           read_size += len(buf)
-           m.update(buf)
-           percent_done = 100 * read_size / total_size
-           if percent_done > last_percent_done:
-               sys.stdout.write('[%d%%]\r' % percent_done)
-               sys.stdout.flush()
-               last_percent_done = percent_done
-   md5_output = m.hexdigest()
-   return md5_output
-
 def get_input(manifest):
     if not manifest.endswith(('.txt', '.md5', '.exf' )):
         print 'Usage: validate.py manifest \nManifests can be a .txt or a .md5 or an ExactFile .exf file.'
@@ -38,25 +18,56 @@ def get_input(manifest):
     else:
         return manifest
 
+def list_directory_sizes(directory):
+    '''
+    Returns a dictionary of filename: size for every file in a directory.
+    Missing or unreadable directories return an empty dictionary.
+    '''
+    file_sizes = {}
+    try:
+        for name, is_dir, size in ififuncs.scan_directory(directory):
+            if not is_dir:
+                file_sizes[name] = size
+    except OSError:
+        pass
+    return file_sizes
+
+
 def parse_manifest(manifest, log_name_source):
+    '''
+    Reads the manifest and checks that every file exists.
+    Each directory in the manifest is listed once, rather than checking
+    each file separately, and the listing also supplies the file sizes.
+    Returns a dictionary of path: checksum, the amount of missing files
+    and a dictionary of path: size.
+    '''
     missing_files = 0
     manifest_dict = {}
-    os.chdir(os.path.dirname(manifest))
-    with open(manifest, 'rb') as manifest_object:
-        manifest_list = manifest_object.readlines()
-        for entries in manifest_list:
-            checksum = entries.split(' ')[0]
-            path = entries[34:].replace('\r', '').replace('\n', '')
-            path = path.replace('\\', '/')
-            if not os.path.isfile(path):
-                ififuncs.generate_log(
-                    log_name_source,
-                    '%s is missing' % path 
-                )
-                print '%s is missing' % path
-                missing_files += 1
-            elif os.path.isfile(path):
-                manifest_dict[path] = checksum
+    file_sizes = {}
+    directory_listings = {}
+    manifest_directory = os.path.dirname(os.path.abspath(manifest))
+    for path, checksum in sorted(ififuncs.read_manifest(manifest).iteritems()):
+        directory, filename = os.path.split(path)
+        if directory not in directory_listings:
+            directory_listings[directory] = list_directory_sizes(
+                os.path.join(manifest_directory, directory)
+            )
+        size = directory_listings[directory].get(filename)
+        full_path = os.path.join(manifest_directory, path)
+        # Case insensitive filesystems can still find a file that
+        # differs in case from the directory listing.
+        if size is None and os.path.isfile(full_path):
+            size = os.path.getsize(full_path)
+        if size is None:
+            ififuncs.generate_log(
+                log_name_source,
+                '%s is missing' % path
+            )
+            print '%s is missing' % path
+            missing_files += 1
+        else:
+            manifest_dict[path] = checksum
+            file_sizes[path] = size
     if missing_files > 0:
         print 'The number of missing files: %s' % missing_files
         ififuncs.generate_log(
@@ -69,23 +80,68 @@ def parse_manifest(manifest, log_name_source):
             log_name_source,
             'All files present'
         )
-    return manifest_dict, missing_files
+    return manifest_dict, missing_files, file_sizes
+
+def hash_files(filenames, algorithm, workers=None, cache=None):
+    '''
+    Yields (filename, checksum) tuples as soon as each file is hashed.
+    The fixity cache only stores md5 checksums, so it is not used for
+    sha512 or fast checksum manifests.
+    '''
+    if algorithm == 'md5':
+        for result in ififuncs.parallel_hash(
+                filenames, workers, cache=cache, ordered=False
+            ):
+            yield result
+    else:
+        for filename, checksums in ififuncs.parallel_multi_hash(
+                filenames, [algorithm], workers, ordered=False
+            ):
+            yield filename, checksums[algorithm]
+
 
-def validate(manifest_dict, manifest,missing_files, log_name_source):
+def validate(manifest_dict, manifest, missing_files, log_name_source, cache=None, file_sizes=None, workers=None):
+    '''
+    Hashes every file in manifest_dict with a pool of workers and compares
+    the result with the manifest. The largest files are started first so
+    that a few big files do not end up running on their own at the end.
+    Results are printed and logged as soon as each file is finished.
+    The checksum algorithm (md5, sha512, xxh64 or crc32) is worked out
+    from the length of the checksums in the manifest.
+    '''
     ififuncs.generate_log(
         log_name_source,
         'Validating %s ' % manifest
     )
     error_counter = 0
-    manifest_directory = os.path.dirname(manifest)
-    os.chdir(manifest_directory)
+    manifest_directory = os.path.dirname(os.path.abspath(manifest))
     error_list = []
-
-    for i in sorted(manifest_dict.keys()):
-        print 'Validating %s' % i
-        current_hash = hashlib_md5(i)
+    if file_sizes is None:
+        file_sizes = {}
+    paths = sorted(
+        manifest_dict.keys(), key=lambda x: file_sizes.get(x, 0), reverse=True
+    )
+    full_paths = {}
+    for i in paths:
+        full_paths[os.path.join(manifest_directory, i)] = i
+    file_count = len(paths)
+    counter = 1
+    algorithm = 'md5'
+    if paths:
+        algorithm = ififuncs.guess_algorithm(manifest_dict[paths[0]])
+    if algorithm != 'md5':
+        print 'Validating %s checksums' % algorithm
+        ififuncs.generate_log(
+            log_name_source,
+            'Checksum algorithm: %s' % algorithm
+        )
+    for full_path, current_hash in hash_files(
+            [os.path.join(manifest_directory, i) for i in paths],
+            algorithm, workers, cache
+        ):
+        i = full_paths[full_path]
         if current_hash == manifest_dict[i]:
-            print '%s has validated' % i
+            print '%s has validated - file %d of %d' % (i, counter, file_count)
         else:
             print '%s has mismatched checksum - %s expected - %s hashed' % (i, manifest_dict[i], current_hash)
             ififuncs.generate_log(
@@ -94,6 +150,7 @@ def validate(manifest_dict, manifest,missing_files, log_name_source):
             )
             error_list.append('%s has mismatched checksum - %s expected - %s hashed' % (i, manifest_dict[i], current_hash))
             error_counter += 1
+        counter += 1
     if error_counter > 0:
         print '\n\n*****ERRORS***********!!!!\n***********\nThe number of mismatched checksums is: %s\n***********\n' % error_counter
         ififuncs.generate_log(
@@ -122,12 +179,22 @@ def make_parser():
     parser = argparse.ArgumentParser(description='MD5 checksum manifest validator. Currently this script expects an md5 checksum, followed by two spaces, followed by a file path.'
                                  ' Written by Kieran O\'Leary.')
     parser.add_argument('input', help='file path of md5 checksum file')
+    parser.add_argument(
+        '-j', '-jobs',
+        type=int,
+        help='Number of files to hash at once. Defaults to the number of CPU cores'
+    )
+    parser.add_argument(
+        '-cache',
+        choices=['trust', 'paranoid'],
+        help='Use the fixity cache. trust skips hashing files whose size, date modified and inode have not changed. paranoid hashes everything and reports checksums that changed when the metadata did not. See fixitycache.py'
+    )
     return parser
 
-def check_manifest(input, log_name_source):
+def check_manifest(input, log_name_source, cache=None, workers=None):
     manifest = get_input(input)
-    manifest_dict, missing_files = parse_manifest(manifest, log_name_source)
-    validate(manifest_dict, manifest, missing_files, log_name_source)
+    manifest_dict, missing_files, file_sizes = parse_manifest(manifest, log_name_source)
+    validate(manifest_dict, manifest, missing_files, log_name_source, cache, file_sizes, workers)
     return manifest
 def log_results(manifest, log, args):
     updated_manifest = []
@@ -171,7 +238,10 @@ def main():
         log_name_source,
         'Command line arguments: %s' % args
     )
-    manifest = check_manifest(args.input, log_name_source)
+    cache = fixitycache.open_cache(args.cache, 'validate.py')
+    manifest = check_manifest(args.input, log_name_source, cache, args.j)
+    fixitycache.close_cache(cache, log_name_source)
+    ififuncs.close_log(log_name_source)
     log_results(manifest, log_name_source, args)
 if __name__ == '__main__':
    main()